@@ -1,520 +1,823 @@
-from pyvim.connect import SmartConnect, Disconnect
-from pyVmomi import vim
-import ssl
-from pyVmomi import vmodl
-from pyvim.task import WaitForTask
-import time
-import getpass
-
-# Color definition
-BLINK = '\033[5m'
-RED = '\033[91m'
-GREEN = '\033[92m'
-YELLOW = '\033[93m'
-BLUE = '\033[94m'
-MAGENTA = '\033[95m'
-CYAN = '\033[96m'
-WHITE = '\033[97m'
-RESET = '\033[0m' 
-
-
-# Script function
-print(f"{YELLOW}\n\nThis script is used to automate the migration of VMs to Private VLAN on the same VDS:")
-print(f"{CYAN}Any selected VM will be parked in a Dummy VLAN, until the PVLAN construct is in place")
-print("The VM(s) will then be moved either to the promiscuous or isolated VLAN (user decision)")
-print("Ports connected to Standard Switches will be ignored")
-print("There is a network outage of any selected VM")
-print("There is no automated recovery process, once the script made any changes")
-print(f"{YELLOW}\nMake sure you understand the risks before proceeding{RESET}")
-
-# Disclaimer
-print(f"{YELLOW}\n\nDISCLAIMER:")
-print("###################################")
-print("This script is provided 'as is' without any guarantees or warranty.")
-print("The use of this script is at your own risk and you are fully responsible for any consequences resulting from its use.")
-print("This script may affect the networking configuration of your VMs and cause downtime or loss of connectivity.")
-print("Before running this script, please ensure you have a full understanding of it function.")
-print("By proceeding with this script, you are acknowledging that you have read and understood this disclaimer.{RESET}")
-print("###################################")
-
-# Ask the user to accept the disclaimer
-accept_disclaimer = input(f"{MAGENTA}\nDo you accept the disclaimer and acknowledge the risks? (yes/no): {RESET}").strip().lower()
-
-if accept_disclaimer != 'yes':
-    print(f"{RED}You did not accept the disclaimer. Exiting the script.{RESET}")
-    exit()
-
-# Replace these values with your vCenter details
-host = input(f"{MAGENTA}Enter vCenter host: {RESET}")
-user= input(f"{MAGENTA}Enter user name: {RESET}")
-password = getpass.getpass()
-
-# Amount of retries to move a VM from its original port-group to the dummy port-group
-MAX_RETRIES = 3 
-
-# Disabling SSL certificate verification if untrusted
-confirm = input(f"{MAGENTA}\nIs a trusted certificate used on the vCenter? (yes/no): {RESET}").strip().lower()
-if confirm == 'yes':
-    print(f"   {GREEN}Continuing in verified TLS context{RESET}")
-else:
-    print(f"   {RED}Continuing in unverified TLS context{RESET}")
-    ssl._create_default_https_context = ssl._create_unverified_context
-
-
-# Connecting to the vCenter server
-si = SmartConnect(host=host, user=user, pwd=password)
-content = si.content
-
-def get_all_vds_names(content):
-    dv_switches = get_all_objects(content, [vim.DistributedVirtualSwitch])
-    return [dvs.name for dvs in dv_switches]
-
-def get_all_port_group_names(vds):
-    return [pg.name for pg in vds.portgroup]
-
-def get_all_objects(content, vimtypes):
-    container = content.viewManager.CreateContainerView(content.rootFolder, vimtypes, True)
-    objects = container.view
-    container.Destroy()
-    return objects
-
-def list_vms_with_vnic_and_vlan(content, port_group_name):
-    dv_switches = get_all_objects(content, [vim.DistributedVirtualSwitch])
-    found_port_group = None
-    print("\n")
-
-    # Find the port group in all distributed virtual switches
-    for dvs in dv_switches:
-        for pg in dvs.portgroup:
-            if pg.name == port_group_name:
-                found_port_group = pg
-                break
-        if found_port_group:
-            break
-
-    if found_port_group is None:
-        print(f"Port group {port_group_name} not found.")
-        return
-
-    # Retrieve VLAN ID
-    vlan_id = found_port_group.config.defaultPortConfig.vlan.vlanId
-    print(f"{CYAN}VLAN ID for port group {port_group_name}{RESET} --> {GREEN}{BLINK}{vlan_id}{RESET}")
-
-    # Check all VMs connected to the found port group
-    if not found_port_group.vm:
-        print(f"No VMs found in port group {port_group_name}.")
-    else:
-        print(f"{CYAN}The following VM's are attached to {port_group_name}{RESET}")
-        for vm in found_port_group.vm:
-            print(f"{CYAN}VM Name: {vm.name}{RESET}")
-            for device in vm.config.hardware.device:
-                if isinstance(device, vim.vm.device.VirtualEthernetCard):
-                    # Check if the Ethernet card is connected to a standard switch
-                    if isinstance(device.backing, vim.vm.device.VirtualEthernetCard.NetworkBackingInfo):
-                        print(f"{YELLOW}VM {vm.name} has a network interface connected to a Standard Switch. This adapter will not be touched. Interface: {RESET}{RED}{device.deviceInfo.label}{RESET}")
-                    # Check if the Ethernet card is connected to the target port group
-                    elif hasattr(device.backing, 'port') and device.backing.port.portgroupKey == found_port_group.key:
-                        print(f"{CYAN}  vNIC Device: {device.deviceInfo.label} (MAC: {device.macAddress}){RESET}\n")
-    print("\n")
-
-def get_network_by_name(content, network_name):
-    for datacenter in content.rootFolder.childEntity:
-        for network in datacenter.network:
-            if network.name == network_name:
-                return network
-    return None
-
-def get_vlan_id(content, vds_name, port_group_name):
-    vds = None
-    dv_switches = get_all_objects(content, [vim.DistributedVirtualSwitch])
-    for dvs in dv_switches:
-        if dvs.name == vds_name:
-            vds = dvs
-            break
-
-    if vds is None:
-        print(f"{RED}Distributed Virtual Switch {vds_name} not found.{RESET}")
-        return None
-
-    port_group = None
-    for pg in vds.portgroup:
-        if pg.name == port_group_name:
-            port_group = pg
-            break
-
-    if port_group is None:
-        print(f"{RED}Port group {port_group_name} not found on VDS {vds_name}.{RESET}")
-        return None
-
-    # Retrieve VLAN ID
-    vlan_id = port_group.config.defaultPortConfig.vlan.vlanId
-    return vlan_id
-
-def migrate_vms(content, vds_name, original_port_group_name, target_port_group_name, is_initial_migration=True):
-    # Find the specified VDS
-    vds = None
-    dv_switches = get_all_objects(content, [vim.DistributedVirtualSwitch])
-    for dvs in dv_switches:
-        if dvs.name == vds_name:
-            vds = dvs
-            break
-
-    if vds is None:
-        print(f"Distributed Virtual Switch {vds_name} not found.")
-        return
-
-    original_network = None
-    target_network = None
-
-    # Search for the original and target port groups within the specified VDS
-    for pg in vds.portgroup:
-        if pg.name == original_port_group_name:
-            original_network = pg
-        if pg.name == target_port_group_name:
-            target_network = pg
-
-    if original_network is None or target_network is None:
-        print("Original or target port group not found.")
-        return
-
-    vms = original_network.vm
-
-    # Ask the user if they want to migrate all VMs at once
-    migrate_all = input(f"{CYAN}Do you want to migrate VMs one by one or all at once? (single/all): {RESET}").strip().lower()
-
-    if migrate_all == 'all':
-        print(f"{CYAN}\nThe following VMs will be migrated:\n{RESET}")
-        for vm in vms:
-            print(f"{GREEN}{vm.name}{RESET}")
-        confirm = input("Do you want to proceed? (yes/no): ").strip().lower()
-        if confirm != 'yes':
-            return
-
-    for vm in vms:
-        device_change = []
-        for device in vm.config.hardware.device:
-            if isinstance(device, vim.vm.device.VirtualEthernetCard):
-                # Check if the Ethernet card is connected to a Standard Switch
-                if isinstance(device.backing, vim.vm.device.VirtualEthernetCard.NetworkBackingInfo):
-                    #print(f"{YELLOW}VM {vm.name} has a network interface connected to a Standard Switch. This adapter will not be touched. Interface: {RESET}{RED}{device.deviceInfo.label}{RESET}")#
-                    continue
-
-                # Check if the Ethernet card is connected to a distributed switch
-                if isinstance(device.backing, vim.vm.device.VirtualEthernetCard.DistributedVirtualPortBackingInfo):
-                    # Check if the Ethernet card is connected to the original network
-                    if is_initial_migration and device.backing.port.portgroupKey != original_network.key:
-                        continue
-              
-                # Create specification for device change
-                nic_spec = vim.vm.device.VirtualDeviceSpec()
-                nic_spec.operation = vim.vm.device.VirtualDeviceSpec.Operation.edit
-                nic_spec.device = device
-                nic_spec.device.backing = vim.vm.device.VirtualEthernetCard.DistributedVirtualPortBackingInfo()
-                nic_spec.device.backing.port = vim.dvs.PortConnection()
-                nic_spec.device.backing.port.portgroupKey = target_network.key
-                nic_spec.device.backing.port.switchUuid = vds.uuid
-                nic_spec.device.connectable = device.connectable  # Keep the same connectable settings
-              
-                # Add to device change list
-                device_change.append(nic_spec)
-
-        # Reconfigure VM only if there are device changes
-        if device_change:
-            # If the user chose to migrate all VMs at once, skip the confirmation
-            if migrate_all == 'all' or input(f"Confirm reconfiguration of VM {vm.name}? ([yes]/no): ").strip().lower() in ['yes', '']:
-                for _ in range(MAX_RETRIES):
-                    try:
-                        vm.ReconfigVM_Task(spec=vim.vm.ConfigSpec(deviceChange=device_change))
-                        print(f"   {GREEN}Reconfigured VM {vm.name}{RESET}")
-                        break
-                    except Exception as e:
-                        print(f"   {RED}Failed to reconfigure VM {vm.name}. Retrying...{RESET}")
-                        time.sleep(RETRY_DELAY)
-                else:
-                    print(f"   {RED}Failed to reconfigure VM {vm.name} after {MAX_RETRIES} attempts.{RESET}")
-            else:
-                print(f"   {RED}Skipped reconfiguration of VM {vm.name}{RESET}")
-
-    #print("\n")
-    #print(f"Migrating VMs from port group {original_port_group_name} to {target_port_group_name} on VDS {vds_name}.")
-
-def create_empty_port_group(content, vds):
-    # Get all port group names in the chosen VDS
-    port_group_names = get_all_port_group_names(vds)
-
-    # Let the user choose a port group or create a new one
-    print(f"{GREEN}\n\nPlease choose a dummy port group or type 'new' to create a new one:{RESET} ")
-    for i, port_group_name in enumerate(port_group_names):
-        print(f"{i+1}. {port_group_name}")
-    port_group_choice = input(f"{MAGENTA}\nSelect an entry or type 'new': {RESET}")
-
-    if port_group_choice.lower() == 'new':
-        # Prompt the user to enter the name of the new port-group
-        port_group_name = input(f"{CYAN}Please enter the name of the new port-group: {RESET}").strip() 
-
-        # Prompt the user to enter the VLAN ID for the new port-group
-        vlan_id = int(input(f"{CYAN}Please enter the VLAN ID for the new port-group: {RESET}").strip()) 
-
-        # Create the new port-group
-        portgroup_config_spec = vim.dvs.DistributedVirtualPortgroup.ConfigSpec()
-        portgroup_config_spec.name = port_group_name
-        portgroup_config_spec.defaultPortConfig = vim.dvs.VmwareDistributedVirtualSwitch.VmwarePortConfigPolicy()
-        portgroup_config_spec.defaultPortConfig.vlan = vim.dvs.VmwareDistributedVirtualSwitch.VlanIdSpec()
-        portgroup_config_spec.defaultPortConfig.vlan.vlanId = vlan_id
-        portgroup_config_spec.type = "earlyBinding"
-        task = vds.AddDVPortgroup_Task([portgroup_config_spec])
-        WaitForTask(task)
-        print(f"{GREEN}Port group {port_group_name} with VLAN ID {vlan_id} created. {RESET}")
-    else:
-        port_group_choice = int(port_group_choice) - 1
-        port_group_name = port_group_names[port_group_choice]
-        print(f"{GREEN}Using existing port group {port_group_name}.{RESET}")
-
-    return port_group_name
-
-def create_promiscuous_pvlan_map(vds, promiscuous_vlan):
-    promiscuous_pvlan_map_entry = vim.dvs.VmwareDistributedVirtualSwitch.PvlanMapEntry()
-    promiscuous_pvlan_map_entry.primaryVlanId = promiscuous_vlan
-    promiscuous_pvlan_map_entry.secondaryVlanId = promiscuous_vlan
-    promiscuous_pvlan_map_entry.pvlanType = 'promiscuous'
-
-    promiscuous_pvlan_config_spec = vim.dvs.VmwareDistributedVirtualSwitch.PvlanConfigSpec()
-    promiscuous_pvlan_config_spec.operation = 'add'
-    promiscuous_pvlan_config_spec.pvlanEntry = promiscuous_pvlan_map_entry
-
-    vds_config_spec = vim.dvs.VmwareDistributedVirtualSwitch.ConfigSpec()
-    vds_config_spec.configVersion = vds.config.configVersion
-    vds_config_spec.pvlanConfigSpec = [promiscuous_pvlan_config_spec]
-    task = vds.ReconfigureDvs_Task(vds_config_spec)
-    WaitForTask(task)
-
-def create_isolated_pvlan_map(vds, promiscuous_vlan, isolated_vlan):
-    isolated_pvlan_map_entry = vim.dvs.VmwareDistributedVirtualSwitch.PvlanMapEntry()
-    isolated_pvlan_map_entry.primaryVlanId = promiscuous_vlan
-    isolated_pvlan_map_entry.secondaryVlanId = isolated_vlan
-    isolated_pvlan_map_entry.pvlanType = 'isolated'
-
-    isolated_pvlan_config_spec = vim.dvs.VmwareDistributedVirtualSwitch.PvlanConfigSpec()
-    isolated_pvlan_config_spec.operation = 'add'
-    isolated_pvlan_config_spec.pvlanEntry = isolated_pvlan_map_entry
-
-    vds_config_spec = vim.dvs.VmwareDistributedVirtualSwitch.ConfigSpec()
-    vds_config_spec.configVersion = vds.config.configVersion
-    vds_config_spec.pvlanConfigSpec = [isolated_pvlan_config_spec]
-    task = vds.ReconfigureDvs_Task(vds_config_spec)
-    WaitForTask(task)
-
-def create_port_group_with_pvlan(content, vds_name, target_port_group_name, promiscuous_vlan, isolated_vlan):
-    # Find the specified VDS
-    vds = None
-    dv_switches = get_all_objects(content, [vim.DistributedVirtualSwitch])
-
-    for dvs in dv_switches:
-        if dvs.name == vds_name:
-            vds = dvs
-            break
-
-    if vds is None:
-        print(f"{RED}Distributed Virtual Switch {vds_name} not found.{RESET}")
-        return
-
-    # Use custom Promiscuous VLAN ID if provided, else default to original VLAN ID + 1
-    #promiscuous_vlan = custom_promiscuous_vlan_id if custom_promiscuous_vlan_id is not None else vlan_id + 1
-    #isolated_vlan = vlan_id
-
-    # Define the Promiscuous PVLAN map entry (Primary VLAN)
-    create_promiscuous_pvlan_map(vds, promiscuous_vlan)
-    create_isolated_pvlan_map(vds, promiscuous_vlan, isolated_vlan)
-
-    # Create port group with isolated PVLAN
-    isolated_portgroup_config_spec = vim.dvs.DistributedVirtualPortgroup.ConfigSpec()
-    isolated_portgroup_config_spec.name = port_group_name + "_isolated"
-    isolated_portgroup_config_spec.defaultPortConfig = vim.dvs.VmwareDistributedVirtualSwitch.VmwarePortConfigPolicy()
-    isolated_portgroup_config_spec.defaultPortConfig.vlan = vim.dvs.VmwareDistributedVirtualSwitch.PvlanSpec()
-    isolated_portgroup_config_spec.defaultPortConfig.vlan.pvlanId = isolated_vlan
-    isolated_portgroup_config_spec.type = "earlyBinding"
-
-    # Create port group with promiscuous PVLAN
-    promiscuous_portgroup_config_spec = vim.dvs.DistributedVirtualPortgroup.ConfigSpec()
-    promiscuous_portgroup_config_spec.name = port_group_name + "_promiscuous"
-    promiscuous_portgroup_config_spec.defaultPortConfig = vim.dvs.VmwareDistributedVirtualSwitch.VmwarePortConfigPolicy()
-    promiscuous_portgroup_config_spec.defaultPortConfig.vlan = vim.dvs.VmwareDistributedVirtualSwitch.PvlanSpec()
-    promiscuous_portgroup_config_spec.defaultPortConfig.vlan.pvlanId = promiscuous_vlan
-    promiscuous_portgroup_config_spec.type = "earlyBinding"
-
-    # Create both port groups on the VDS
-    print(f"{GREEN}Port groups with PVLAN configuration created on VDS {vds_name}.{RESET}")
-    task = vds.AddDVPortgroup_Task([isolated_portgroup_config_spec, promiscuous_portgroup_config_spec])
-    WaitForTask(task)
-    print(f"{GREEN}   Created {port_group_name}_promiscuous{RESET}") 
-    print(f"{GREEN}   Created {port_group_name}_isolated{RESET}")
-    print("\n")
-
-def delete_port_group(content, vds_name, port_group_name):
-    # Find the specified VDS
-    print(f"{YELLOW}\nDeleting original Port group from VDS {RESET}")
-    vds = None
-    dv_switches = get_all_objects(content, [vim.DistributedVirtualSwitch])
-
-    for dvs in dv_switches:
-        if dvs.name == vds_name:
-            vds = dvs
-            break
-
-    if vds is None:
-        print(f"{RED}Distributed Virtual Switch {vds_name} not found.{RESET}")
-        return
-
-    # Find the specified port group
-    port_group = None
-    for pg in vds.portgroup:
-        if pg.name == port_group_name:
-            port_group = pg
-            break
-
-    if port_group is None:
-        print(f"{GREEN}   Port group {port_group_name} successfully removed from VDS {vds_name}{RESET}")
-        return
-
-    # Delete the port group
-    task = port_group.Destroy_Task()
-    WaitForTask(task)  # Wait for the task to complete
-
-    print(f"{GREEN}   Port group {port_group_name} deleted from VDS {vds_name}{RESET}")
-
-print("\n")
-
-# Get all VDS names
-vds_names = get_all_vds_names(content)
-
-# Let the user choose a VDS
-print("Please choose a VDS:")
-for i, vds_name in enumerate(vds_names):
-    print(f"{i+1}. {vds_name}")
-vds_choice = int(input(f"{MAGENTA}\nSelect an entry: {RESET}")) - 1
-original_vds_name = vds_names[vds_choice]
-
-# Retrieve the chosen VDS
-vds = None
-dv_switches = get_all_objects(content, [vim.DistributedVirtualSwitch])
-for dvs in dv_switches:
-    if dvs.name == original_vds_name:
-        vds = dvs
-        break
-
-# Get all port group names in the chosen VDS
-port_group_names = get_all_port_group_names(vds)
-
-# Let the user choose a port group
-print(f"\n\n{GREEN}Please choose the source port group{RESET}:")
-for i, port_group_name in enumerate(port_group_names):
-    print(f"{i+1}. {port_group_name}")
-port_group_choice = int(input(f"\n{MAGENTA}Select an entry: {RESET}")) - 1
-original_port_group_name = port_group_names[port_group_choice]
-
-dummy_port_group_name = create_empty_port_group(content, vds)
-
-list_vms_with_vnic_and_vlan(content, original_port_group_name)
-
-# Determine the new port_group name
-# This will default to the original port group name but two will be created
-# one with _promiscuous and one with _isolated appended 
-port_group_name_input = input(f"Please enter the new base name for the port group ({GREEN}{original_port_group_name}{RESET}): ")
-    
-if port_group_name_input.strip() == "":
-    port_group_name = original_port_group_name
-else:
-    try:
-        port_group_name = port_group_name_input
-    except ValueError:
-        print("Invalid name entered. Keeping existing port group name")
-        port_group_name = port_group_name_input
-
-print(f"{CYAN}  Script will create promiscuous Port Group name: {port_group_name}_promiscuous{RESET}")
-print(f"{CYAN}  Script will create Isolated Port Group name:    {port_group_name}_isolated{RESET}")
-print("\n")
-
-
-#Get the original VLAN ID we are working with that was configured on the selected Port_Group.
-vlan_id = get_vlan_id(content, original_vds_name, original_port_group_name)
-if vlan_id is not None:
-    print(f"The existing base VLAN ID for port group {original_port_group_name} is {GREEN}{vlan_id}{RESET}")
-else:
-    print(f"Failed to retrieve the VLAN ID for port group {original_port_group_name}.")
-
-# Determine the promiscuous VLAN ID that will be used. 
-# This will default to the original non PVLAN ID that was used for the existing Port_Group.
-promiscuous_vlan_input = input(f"{CYAN}Please enter the promiscuous VLAN number ({GREEN}{vlan_id}{RESET}): {RESET}") 
-if promiscuous_vlan_input.strip() == "":
-    promiscuous_vlan_id = vlan_id
-else:
-    try:
-        promiscuous_vlan_id = int(promiscuous_vlan_input)
-    except ValueError:
-        print("Invalid VLAN number entered. Using the default VLAN ID.")
-        promiscuous_vlan_id = vlan_id
-print(f"   {CYAN}Using Promiscuous VLAN ID: {promiscuous_vlan_id}{RESET}")
-print("\n")
-
-
-# Determine the isolated VLAN ID for workloads.
-# If nothing is selected then the default will be the original VLAN ID + 1 
-isolated_vlan_input = input(f"{CYAN}Please enter the Isolated VLAN number ({GREEN}{vlan_id + 1}{RESET}): {RESET}")
-if isolated_vlan_input.strip() == "":
-    isolated_vlan_id = vlan_id + 1 
-else:
-    try:
-        isolated_vlan_id = int(isolated_vlan_input)
-    except ValueError:
-        print("Invalid VLAN number entered. Using the default VLAN ID.")
-        isolated_vlan_id = vlan_id + 1
-
-print(f"   {CYAN}Using Isolated VLAN ID: {isolated_vlan_id}{RESET}")
-
-# Migrate VMs to Dummy Port Group
-print(f"{YELLOW}\nMigrating VM NIC's from original Port-Group to {dummy_port_group_name}\n{RESET}")
-migrate_vms(content, original_vds_name, original_port_group_name, dummy_port_group_name)
-
-# Wait for a bit to ensure that all migrations are complete
-time.sleep(5)
-
-
-# Validate that no VMs are on the original port group
-original_network = get_network_by_name(content, original_port_group_name)
-if original_network and not original_network.vm:
-    delete_port_group(content, original_vds_name, original_port_group_name)
-else:
-    print(f"Failed to migrate all VMs from port group {original_port_group_name}. Cannot delete.")
-
-# Delete Original Port Group
-delete_port_group(content, original_vds_name, original_port_group_name)
-
-# Create New Port Group with PVLAN
-create_port_group_with_pvlan(content, original_vds_name, port_group_name, promiscuous_vlan_id, isolated_vlan_id)
-
-# Migrate VMs to the New Port Group
-# Prompt the user to choose between promiscuous or isolated port group
-migration_choice = input(f"{CYAN}Do you want to migrate all VMs to the 'promiscuous' or 'isolated' port group? Enter 'promiscuous' or 'p', 'isolated' or 'i': {RESET}")
-
-# Map user's choice to the corresponding option
-migration_choice_map = {
-    'promiscuous': '_promiscuous',
-    'p': '_promiscuous',
-    'isolated': '_isolated',
-    'i': '_isolated'
-}
-
-# Retrieve the final choice based on user's input
-final_migration_choice = migration_choice_map.get(migration_choice.lower())
-
-if final_migration_choice is None:
-    print("Invalid choice. Please enter 'promiscuous' or 'p', 'isolated' or 'i'.")
-else:
-    final_target_port_group_name = port_group_name + final_migration_choice
-
-    # Migrate VMs to the chosen port group
-    print(f"{GREEN}Migrating VM NIC's from {dummy_port_group_name} to {final_target_port_group_name}{RESET}")
-    migrate_vms(content, original_vds_name, dummy_port_group_name, final_target_port_group_name)
-    print(f"{GREEN}\nVMs successfully migrated to {final_target_port_group_name}{RESET}")
-
-Disconnect(si)
\ No newline at end of file
+import argparse
+import getpass
+import http.client
+import json
+import os
+import sys
+import time
+from pvlan_migration.metrics import METRICS, ProgressDisplay
+from pvlan_migration.naming import CUTOVER_SUFFIX, TARGET_SUFFIXES, pvlan_portgroup_names, target_portgroup_name
+from pvlan_migration.plan import PlanError, PlanRow, load_plan
+
+# Only the plan file handling is imported up front. pyVmomi and everything
+# talking to vCenter is loaded by main() once it is needed, so --help and
+# plan file errors come back straight away. The operations themselves live in
+# pvlan_migration.api and can be used without this script.
+
+# Color definition
+BLINK = '\033[5m'
+RED = '\033[91m'
+GREEN = '\033[92m'
+YELLOW = '\033[93m'
+BLUE = '\033[94m'
+MAGENTA = '\033[95m'
+CYAN = '\033[96m'
+WHITE = '\033[97m'
+RESET = '\033[0m' 
+
+# Command line options, without --plan the script runs interactively
+parser = argparse.ArgumentParser(description="Migrate VMs from VLAN port groups to Private VLAN port groups on the same VDS")
+parser.add_argument('--plan', help="convert every port group listed in a YAML, JSON or CSV plan file without prompting")
+parser.add_argument('--fleet', help="convert on every vCenter listed in a YAML or JSON fleet file at the same time, each with its own plan")
+parser.add_argument('--max-parallel-vcenters', type=int, default=8, help="with --fleet, vCenters worked on at the same time (default: 8)")
+parser.add_argument('--host', help="vCenter host")
+parser.add_argument('--user', help="vCenter user name, the password is read from VCENTER_PASSWORD or prompted for")
+parser.add_argument('--accept-disclaimer', action='store_true', help="accept the disclaimer without prompting")
+parser.add_argument('--insecure', action='store_true', help="do not verify the vCenter certificate")
+parser.add_argument('--max-parallel', type=int, default=4, help="port groups converted at the same time (default: 4)")
+parser.add_argument('--max-parallel-per-vds', type=int, default=2, help="port groups converted at the same time on one VDS (default: 2)")
+parser.add_argument('--direct-cutover', action='store_true', help="create the PVLAN port groups under temporary names and move every NIC once, without the dummy port group")
+parser.add_argument('--dry-run', action='store_true', help="with --plan, write the planned changes and their cost as JSON instead of applying them")
+parser.add_argument('--snapshot', help="with --dry-run, plan against an inventory snapshot file instead of connecting to vCenter")
+parser.add_argument('--save-snapshot', help="write the vCenter inventory snapshot to this file")
+parser.add_argument('--output', help="file for the --dry-run plan or the --list-vms rows (default: standard output)")
+parser.add_argument('--list-vms', metavar='PORT_GROUP', help="stream the VMs and NICs on a port group page by page without loading the inventory, then exit")
+parser.add_argument('--vds', help="with --list-vms, the VDS of the port group")
+parser.add_argument('--format', choices=['table', 'csv', 'jsonl'], default='table', help="--list-vms output format (default: table)")
+parser.add_argument('--vm-name', metavar='PATTERN', help="with --list-vms, only VMs whose name matches this shell pattern, ignoring case")
+parser.add_argument('--folder', help="with --list-vms, only VMs in this VM folder")
+parser.add_argument('--esx-host', help="with --list-vms, only VMs running on this ESXi host")
+parser.add_argument('--max-in-flight', type=int, default=8, help="VM reconfiguration tasks running at the same time per port group (default: 8)")
+parser.add_argument('--max-per-host', type=int, default=4, help="VM reconfiguration tasks running at the same time on one ESXi host, 0 for no limit (default: 4)")
+parser.add_argument('--priority-attribute', help="numeric VM custom attribute ordering the reconfigurations, lower values first")
+parser.add_argument('--waves', action='store_true', help="move the VMs of each port group in growing waves, checking the NICs after each wave and stopping when too many fail (interactive runs can also answer 'waves')")
+parser.add_argument('--canary', type=int, default=1, help="VMs in the first wave (default: 1)")
+parser.add_argument('--wave-growth', type=float, default=5, help="factor each wave grows by, 1, 5, 25 and so on for 5 (default: 5)")
+parser.add_argument('--max-failure-rate', type=float, default=0.1, help="share of the VMs moved so far that may fail before no further wave starts (default: 0.1)")
+parser.add_argument('--on-wave-failure', choices=['halt', 'rollback'], default='halt', help="when the failure rate is passed, leave the moved VMs where they are or put them back (default: halt)")
+parser.add_argument('--wave-pause', type=float, default=0, help="seconds to wait after each wave before its NICs are checked (default: 0)")
+parser.add_argument('--report', help="write a JSON report with phase timings, vCenter call statistics and per-VM outage to this file")
+parser.add_argument('--progress', action='store_true', help="show a live progress line during plan, resume and rollback runs")
+parser.add_argument('--sessions', type=int, default=4, help="vCenter connections sharing the login, used by parallel workers (default: 4)")
+parser.add_argument('--journal', help="with --plan, journal file recording every change (default: pvlan-migration-<time>.journal)")
+parser.add_argument('--resume', metavar='JOURNAL', help="continue an interrupted plan run from its journal")
+parser.add_argument('--rollback', metavar='JOURNAL', help="undo the changes recorded in a plan run journal")
+# Amount of retries to move a VM from its original port-group to the dummy port-group
+MAX_RETRIES = 3 
+RETRY_DELAY = 5
+
+# Seconds to wait for the original port-group to report no VMs after the migration
+EMPTY_PORT_GROUP_TIMEOUT = 120
+
+# Seconds to wait for vCenter to report a port-group that was just created
+NEW_PORT_GROUP_TIMEOUT = 120
+
+
+def write_dry_run_plan(plan, output):
+    text = json.dumps(plan, indent=2, sort_keys=True)
+    if output:
+        with open(output, 'w') as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+    return not plan['errors']
+
+def list_port_group(vc, args):
+    # Rows are written as vCenter returns them, the summary goes to stderr so
+    # it does not end up in CSV or JSONL output
+    from pvlan_migration.listing import write_rows
+    try:
+        rows = vc.port_group_nics(args.list_vms, args.vds, args.vm_name, args.folder, args.esx_host)
+        if args.output:
+            with open(args.output, 'w', newline='') as f:
+                count = write_rows(rows, args.format, f)
+        else:
+            count = write_rows(rows, args.format, sys.stdout)
+    except (OSError, PlanError) as e:
+        print(f"{RED}{e}{RESET}", file=sys.stderr)
+        return False
+    print(f"{GREEN}{count} NIC(s) listed on {args.list_vms}{RESET}", file=sys.stderr)
+    return True
+
+def print_banner():
+    # Script function
+    print(f"{YELLOW}\n\nThis script is used to automate the migration of VMs to Private VLAN on the same VDS:")
+    print(f"{CYAN}Any selected VM will be parked in a Dummy VLAN, until the PVLAN construct is in place")
+    print("The VM(s) will then be moved either to the promiscuous or isolated VLAN (user decision)")
+    print("Ports connected to Standard Switches will be ignored")
+    print("There is a network outage of any selected VM")
+    print("There is no automated recovery process for interactive runs, once the script made any changes")
+    print("Runs from a plan file are journaled and can be resumed (--resume) or rolled back (--rollback)")
+    print(f"{YELLOW}\nMake sure you understand the risks before proceeding{RESET}")
+
+    # Disclaimer
+    print(f"{YELLOW}\n\nDISCLAIMER:")
+    print("###################################")
+    print("This script is provided 'as is' without any guarantees or warranty.")
+    print("The use of this script is at your own risk and you are fully responsible for any consequences resulting from its use.")
+    print("This script may affect the networking configuration of your VMs and cause downtime or loss of connectivity.")
+    print("Before running this script, please ensure you have a full understanding of it function.")
+    print("By proceeding with this script, you are acknowledging that you have read and understood this disclaimer.{RESET}")
+    print("###################################")
+
+def print_session_pool_stats(vc):
+    if not vc.connected:
+        return
+    session_pool = vc.session_pool
+    stats = session_pool.stats
+    print(f"{CYAN}Session pool: {session_pool.size} connection(s), {stats.acquisitions} calls, waited {stats.wait_total:.1f}s in total (max {stats.wait_max:.2f}s), {stats.relogins} re-login(s){RESET}")
+
+def get_all_vds_names(inventory):
+    return inventory.switch_names()
+
+def get_all_port_group_names(inventory, vds_name):
+    return inventory.portgroup_names(vds_name)
+
+def list_vms_with_vnic_and_vlan(vc, port_group_name):
+    print("\n")
+
+    # Find the port group in all distributed virtual switches
+    listing = vc.port_group_vms(port_group_name)
+
+    if listing is None:
+        print(f"Port group {port_group_name} not found.")
+        return
+    found_port_group, vms = listing
+
+    # Retrieve VLAN ID, trunk and private VLAN port groups have none
+    from pvlan_migration.validation import describe_vlan
+    print(f"{CYAN}VLAN ID for port group {port_group_name}{RESET} --> {GREEN}{BLINK}{describe_vlan(found_port_group.vlan)}{RESET}")
+
+    # Check all VMs connected to the found port group
+    if not vms:
+        print(f"No VMs found in port group {port_group_name}.")
+    else:
+        print(f"{CYAN}The following VM's are attached to {port_group_name}{RESET}")
+        for vm, nics, standard_nics in vms:
+            print(f"{CYAN}VM Name: {vm.name}{RESET}")
+            # Ethernet cards connected to a standard switch
+            for nic in standard_nics:
+                print(f"{YELLOW}VM {vm.name} has a network interface connected to a Standard Switch. This adapter will not be touched. Interface: {RESET}{RED}{nic.label}{RESET}")
+            # Ethernet cards connected to the target port group
+            for nic in nics:
+                print(f"{CYAN}  vNIC Device: {nic.label} (MAC: {nic.mac}){RESET}\n")
+    print("\n")
+
+def get_vlan_id(inventory, vds_name, port_group_name):
+    if inventory.switch(vds_name) is None:
+        print(f"{RED}Distributed Virtual Switch {vds_name} not found.{RESET}")
+        return None
+
+    port_group = inventory.portgroup(vds_name, port_group_name)
+    if port_group is None:
+        print(f"{RED}Port group {port_group_name} not found on VDS {vds_name}.{RESET}")
+        return None
+
+    # Retrieve VLAN ID, a trunk or private VLAN port group has no single one
+    from pvlan_migration.validation import describe_vlan, single_vlan_id
+    vlan_id = single_vlan_id(port_group.vlan)
+    if vlan_id is None:
+        print(f"{YELLOW}Port group {port_group_name} is {describe_vlan(port_group.vlan)}.{RESET}")
+    return vlan_id
+
+def migrate_vms(vc, vds_name, original_port_group_name, target_port_group_name, is_initial_migration=True, phase='migration', wave_policy=None):
+    inventory = vc.inventory
+
+    # Find the specified VDS
+    if inventory.switch(vds_name) is None:
+        print(f"Distributed Virtual Switch {vds_name} not found.")
+        return
+
+    # Search for the original and target port groups within the specified VDS
+    original_network = inventory.portgroup(vds_name, original_port_group_name)
+    target_network = inventory.portgroup(vds_name, target_port_group_name)
+
+    if original_network is None or target_network is None:
+        print("Original or target port group not found.")
+        return
+
+    # Ask the user if they want to migrate all VMs at once, or all of them in growing waves
+    migrate_all = input(f"{CYAN}Do you want to migrate VMs one by one, all at once or in waves? (single/all/waves): {RESET}").strip().lower()
+
+    if migrate_all in ('all', 'waves'):
+        print(f"{CYAN}\nThe following VMs will be migrated:\n{RESET}")
+        # The NIC index answers which VMs have NICs on the original port group
+        if is_initial_migration:
+            vms = inventory.vms_with_nics_on(original_network.key)
+        else:
+            vms = inventory.vms_on_portgroup(original_network.key)
+        for vm in vms:
+            print(f"{GREEN}{vm.name}{RESET}")
+        confirm = input("Do you want to proceed? (yes/no): ").strip().lower()
+        if confirm != 'yes':
+            return
+
+    def select(vm):
+        # If the user chose to migrate all VMs at once, skip the confirmation
+        if migrate_all in ('all', 'waves') or input(f"Confirm reconfiguration of VM {vm.name}? ([yes]/no): ").strip().lower() in ['yes', '']:
+            return True
+        print(f"   {RED}Skipped reconfiguration of VM {vm.name}{RESET}")
+        return False
+
+    # Reconfigure the queued VMs concurrently and report the outcome of each task
+    def report(result):
+        if result.ok:
+            print(f"   {GREEN}Reconfigured VM {result.name}{RESET}")
+        else:
+            print(f"   {RED}Failed to reconfigure VM {result.name} after {result.attempts} attempts: {result.error}{RESET}")
+
+    def report_wave(wave, rollout):
+        color = RED if wave.failed else GREEN
+        print(f"{color}Wave {wave.number}: {wave.size} VM(s), {len(wave.failed)} failed, {rollout.reconfigured} of {rollout.total} done{RESET}")
+        for name, reason in wave.failed:
+            print(f"   {RED}{name}: {reason}{RESET}")
+
+    waves = wave_policy if migrate_all == 'waves' else None
+    return vc.migrate_vms(vds_name, original_port_group_name, target_port_group_name, is_initial_migration, select=select, on_result=report, phase=phase,
+                          waves=waves, on_wave=report_wave)
+
+    #print("\n")
+    #print(f"Migrating VMs from port group {original_port_group_name} to {target_port_group_name} on VDS {vds_name}.")
+
+def all_vms_migrated(results, target_port_group_name):
+    # The TaskResults of migrate_vms, lists the VMs whose reconfiguration failed
+    failed = [result for result in results if not result.ok]
+    if failed:
+        print(f"{RED}{len(failed)} of {len(results)} VM(s) were not migrated to {target_port_group_name}:{RESET}")
+        for result in failed:
+            print(f"   {RED}{result.name}: {result.error}{RESET}")
+    return not failed
+
+def wait_for_port_groups(inventory, vds_name, port_group_names):
+    # Wait until the inventory reports the port groups that were just created
+    with METRICS.phase('inventory wait'):
+        found = inventory.wait_until(lambda inv: all(inv.portgroup(vds_name, name) is not None for name in port_group_names),
+                                     NEW_PORT_GROUP_TIMEOUT)
+    if not found:
+        print(f"{RED}Timed out waiting for vCenter to report port group(s) {', '.join(port_group_names)}{RESET}")
+    return found
+
+def prompt_choice(items, prompt):
+    # Ask until one of the numbered entries is picked
+    while True:
+        choice = input(prompt).strip()
+        if choice.isdigit() and 1 <= int(choice) <= len(items):
+            return items[int(choice) - 1]
+        print(f"{RED}Please enter a number between 1 and {len(items)}.{RESET}")
+
+def prompt_vlan(prompt, default=None):
+    # Ask until a VLAN ID in 1-4094 is entered, an empty answer takes the default
+    while True:
+        answer = input(prompt).strip()
+        if answer == "" and default is not None:
+            return default
+        if answer.isdigit() and 1 <= int(answer) <= 4094:
+            return int(answer)
+        print(f"{RED}Invalid VLAN number entered, it must be between 1 and 4094.{RESET}")
+
+def choose_dummy_port_group(inventory, vds_name):
+    # Returns the dummy port group name and, for a new one, its VLAN ID. A new
+    # port group is only created once the conversion has been validated.
+    port_group_names = get_all_port_group_names(inventory, vds_name)
+
+    # Let the user choose a port group or create a new one
+    print(f"{GREEN}\n\nPlease choose a dummy port group or type 'new' to create a new one:{RESET} ")
+    for i, port_group_name in enumerate(port_group_names):
+        print(f"{i+1}. {port_group_name}")
+    while True:
+        port_group_choice = input(f"{MAGENTA}\nSelect an entry or type 'new': {RESET}").strip()
+        if port_group_choice.lower() == 'new' or (port_group_choice.isdigit() and 1 <= int(port_group_choice) <= len(port_group_names)):
+            break
+        print(f"{RED}Please enter 'new' or a number between 1 and {len(port_group_names)}.{RESET}")
+
+    if port_group_choice.lower() == 'new':
+        # Prompt the user to enter the name of the new port-group
+        port_group_name = ""
+        while not port_group_name:
+            port_group_name = input(f"{CYAN}Please enter the name of the new port-group: {RESET}").strip()
+
+        # Prompt the user to enter the VLAN ID for the new port-group
+        vlan_id = prompt_vlan(f"{CYAN}Please enter the VLAN ID for the new port-group: {RESET}")
+        return port_group_name, vlan_id
+
+    port_group_name = port_group_names[int(port_group_choice) - 1]
+    print(f"{GREEN}Using existing port group {port_group_name}.{RESET}")
+    return port_group_name, None
+
+def create_dummy_port_group(vc, vds_name, port_group_name, vlan_id, template=None, num_ports=None):
+    from pvlan_migration.tasks import TASK_FAULTS, fault_message
+    try:
+        vc.create_vlan_port_group(vds_name, port_group_name, vlan_id, template, num_ports)
+    except PlanError as e:
+        print(f"{RED}{e}{RESET}")
+        return False
+    except TASK_FAULTS as e:
+        print(f"{RED}Failed to create port group {port_group_name}: {fault_message(e)}{RESET}")
+        return False
+    print(f"{GREEN}Port group {port_group_name} with VLAN ID {vlan_id} created. {RESET}")
+    return True
+
+def create_port_group_with_pvlan(vc, vds_name, target_port_group_name, promiscuous_vlan, isolated_vlan, name_suffix='',
+                                 template=None, num_ports=None):
+    # Add the Promiscuous (Primary VLAN) and Isolated PVLAN map entries in a single VDS
+    # reconfiguration, then create both port groups on the VDS as copies of the template
+    # port group with only the VLAN changed
+    from pvlan_migration.tasks import TASK_FAULTS, fault_message
+    try:
+        vc.create_port_group_with_pvlan(vds_name, target_port_group_name, promiscuous_vlan, isolated_vlan, name_suffix,
+                                        template, num_ports)
+    except PlanError as e:
+        print(f"{RED}{e}{RESET}")
+        return False
+    except TASK_FAULTS as e:
+        print(f"{RED}Failed to create the PVLAN port groups on VDS {vds_name}: {fault_message(e)}{RESET}")
+        return False
+
+    print(f"{GREEN}Port groups with PVLAN configuration created on VDS {vds_name}.{RESET}")
+    print(f"{GREEN}   Created {target_port_group_name}_promiscuous{name_suffix}{RESET}") 
+    print(f"{GREEN}   Created {target_port_group_name}_isolated{name_suffix}{RESET}")
+    print("\n")
+    return True
+
+def delete_port_group(vc, vds_name, port_group_name):
+    # Find the specified VDS
+    print(f"{YELLOW}\nDeleting original Port group from VDS {RESET}")
+
+    from pvlan_migration.tasks import TASK_FAULTS, fault_message
+    try:
+        deleted = vc.delete_port_group(vds_name, port_group_name)
+    except PlanError as e:
+        print(f"{RED}{e}{RESET}")
+        return False
+    except TASK_FAULTS as e:
+        print(f"{RED}   Failed to delete port group {port_group_name}: {fault_message(e)}{RESET}")
+        return False
+
+    if deleted:
+        print(f"{GREEN}   Port group {port_group_name} deleted from VDS {vds_name}{RESET}")
+    else:
+        print(f"{GREEN}   Port group {port_group_name} successfully removed from VDS {vds_name}{RESET}")
+    return True
+
+def rename_pvlan_port_groups(vc, vds_name, port_group_name, name_suffix):
+    # Give the temporarily named PVLAN port groups their final names
+    rename_results, missing = vc.rename_pvlan_port_groups(vds_name, port_group_name, name_suffix)
+    for name in missing:
+        print(f"{RED}   Port group {name} not found on VDS {vds_name}.{RESET}")
+    for result in rename_results:
+        if result.ok:
+            print(f"{GREEN}   Renamed {result.name} to {result.name[:-len(name_suffix)]}{RESET}")
+        else:
+            print(f"{RED}   Failed to rename {result.name}: {result.error}{RESET}")
+
+def prompt_migration_target():
+    # Prompt the user to choose between promiscuous or isolated port group
+    while True:
+        migration_choice = input(f"{CYAN}Do you want to migrate all VMs to the 'promiscuous' or 'isolated' port group? Enter 'promiscuous' or 'p', 'isolated' or 'i': {RESET}").strip().lower()
+
+        # Retrieve the final choice based on user's input
+        if migration_choice in TARGET_SUFFIXES:
+            return migration_choice
+        print("Invalid choice. Please enter 'promiscuous' or 'p', 'isolated' or 'i'.")
+
+def print_row_event(row, message, ok):
+    color = GREEN if ok else RED
+    print(f"   {color}[{row.label}] {message}{RESET}")
+
+def run_batch_plan(vc, args, rows):
+    # Validate the whole plan against the snapshot before changing anything
+    validation = vc.check_plan(rows, args.direct_cutover)
+    for warning in validation.warnings:
+        print(f"   {YELLOW}{warning}{RESET}")
+    if not validation.ok:
+        print(f"{RED}The plan cannot be applied:{RESET}")
+        for error in validation.errors:
+            print(f"   {RED}{error}{RESET}")
+        return False
+
+    print(f"{CYAN}\nConverting {len(rows)} port group(s):{RESET}")
+    for row in rows:
+        print(f"   {row.label} -> {row.base_name}_promiscuous (VLAN {row.promiscuous_vlan}) / {row.base_name}_isolated (VLAN {row.isolated_vlan}), VMs to {GREEN}{row.target_port_group}{RESET}")
+
+    # Every change is journaled so an interrupted run can be resumed or rolled back
+    journal_path = args.journal or time.strftime("pvlan-migration-%Y%m%d-%H%M%S.journal")
+    print(f"{CYAN}Journal: {journal_path}{RESET}")
+    results = vc.convert(rows, args.direct_cutover, journal_path, on_event=print_row_event,
+                         max_parallel=args.max_parallel, max_parallel_per_vds=args.max_parallel_per_vds)
+    return report_batch_results(results, journal_path)
+
+def report_batch_results(results, journal_path):
+    failed = [result for result in results if not result.ok]
+    print(f"\n{GREEN}{len(results) - len(failed)} port group(s) converted{RESET}")
+    for result in failed:
+        print(f"{RED}   {result.row.label} failed at {result.step}: {result.error}{RESET}")
+    if failed:
+        print(f"{YELLOW}Continue with --resume {journal_path} or undo the run with --rollback {journal_path}{RESET}")
+    return not failed
+
+def resume_batch_plan(vc, args, journal_path):
+    print(f"{CYAN}\nResuming the plan run journaled in {journal_path}:{RESET}")
+    results = vc.resume(journal_path, on_event=print_row_event, max_parallel=args.max_parallel,
+                        max_parallel_per_vds=args.max_parallel_per_vds)
+    return report_batch_results(results, journal_path)
+
+def run_fleet_plan(args, endpoints):
+    # Every vCenter runs on its own, a failing one is reported at the end and
+    # does not stop the others
+    from pvlan_migration.fleet import fleet_report, run_fleet
+
+    def print_event(endpoint, row, message, ok):
+        color = GREEN if ok else RED
+        print(f"   {color}[{endpoint.name}: {row.label}] {message}{RESET}")
+
+    def print_done(result):
+        if result.ok:
+            print(f"{GREEN}{result.endpoint.name}: done in {result.duration:.1f}s{RESET}")
+        else:
+            print(f"{RED}{result.endpoint.name}: failed at {result.step}: {result.error}{RESET}")
+
+    print(f"{CYAN}\n{'Planning' if args.dry_run else 'Converting'} on {len(endpoints)} vCenter(s):{RESET}")
+    for endpoint in endpoints:
+        print(f"   {endpoint.name} ({endpoint.host}): {len(endpoint.rows)} port group(s)")
+    journal_prefix = None
+    if not args.dry_run:
+        journal_prefix = args.journal or time.strftime("pvlan-migration-%Y%m%d-%H%M%S")
+        print(f"{CYAN}Journals: {journal_prefix}-<vCenter>.journal{RESET}")
+    results = run_fleet(endpoints, args.dry_run, journal_prefix, on_event=print_event, on_done=print_done,
+                        max_parallel=args.max_parallel_vcenters, retries=MAX_RETRIES - 1, retry_delay=RETRY_DELAY,
+                        waves=build_wave_policy(args) if args.waves else None)
+
+    report = fleet_report(results)
+    totals = report['totals']
+    if args.dry_run:
+        errors = [f"{v['name']}: {error}" for v in report['vcenters'] if not v['ok'] for error in v['errors'] or [v['error']]]
+        write_dry_run_plan({'errors': errors, 'vcenters': {v['name']: v['plan'] for v in report['vcenters']}}, args.output)
+        print(f"\n{GREEN}{totals['vcenters'] - totals['vcenters_failed']} of {totals['vcenters']} vCenter(s) planned{RESET}")
+    else:
+        print(f"\n{GREEN}{totals['vcenters'] - totals['vcenters_failed']} of {totals['vcenters']} vCenter(s) done, {totals['port_groups'] - totals['port_groups_failed']} port group(s) converted{RESET}")
+    for result in results:
+        if result.ok:
+            continue
+        print(f"{RED}   {result.endpoint.name} failed at {result.step}: {result.error}{RESET}")
+        for error in result.errors:
+            print(f"{RED}      {error}{RESET}")
+        for conversion in result.results:
+            if not conversion.ok:
+                print(f"{RED}      {conversion.row.label} failed at {conversion.step}: {conversion.error}{RESET}")
+        if result.journal_path and result.results:
+            print(f"{YELLOW}      Continue with --host {result.endpoint.host} --resume {result.journal_path} or undo with --rollback {result.journal_path}{RESET}")
+    if args.report:
+        with open(args.report, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"{GREEN}Fleet report written to {args.report}{RESET}")
+    return report['ok']
+
+def rollback_batch_plan(vc, journal_path):
+    def report(message, ok):
+        color = GREEN if ok else RED
+        print(f"   {color}{message}{RESET}")
+
+    print(f"{CYAN}\nRolling back the plan run journaled in {journal_path}:{RESET}")
+    result = vc.rollback(journal_path, on_event=report)
+    for error in result.errors:
+        print(f"{RED}   {error}{RESET}")
+    if result.ok:
+        print(f"{GREEN}Rollback complete{RESET}")
+    return result.ok
+
+def build_wave_policy(args):
+    from pvlan_migration.waves import WavePolicy
+    return WavePolicy(canary=args.canary, growth=args.wave_growth, max_failure_rate=args.max_failure_rate,
+                      on_failure=args.on_wave_failure, pause=args.wave_pause)
+
+def run_interactive(vc, args):
+    inventory = vc.inventory
+    waves = build_wave_policy(args)
+
+    # Get all VDS names
+    vds_names = get_all_vds_names(inventory)
+
+    # Let the user choose a VDS
+    print("Please choose a VDS:")
+    for i, vds_name in enumerate(vds_names):
+        print(f"{i+1}. {vds_name}")
+    original_vds_name = prompt_choice(vds_names, f"{MAGENTA}\nSelect an entry: {RESET}")
+
+    # Get all port group names in the chosen VDS
+    port_group_names = get_all_port_group_names(inventory, original_vds_name)
+
+    # Let the user choose a port group
+    print(f"\n\n{GREEN}Please choose the source port group{RESET}:")
+    for i, port_group_name in enumerate(port_group_names):
+        print(f"{i+1}. {port_group_name}")
+    original_port_group_name = prompt_choice(port_group_names, f"\n{MAGENTA}Select an entry: {RESET}")
+
+    # The direct cutover does not park VMs on a dummy port group
+    dummy_port_group_name = dummy_vlan_id = None
+    if not args.direct_cutover:
+        dummy_port_group_name, dummy_vlan_id = choose_dummy_port_group(inventory, original_vds_name)
+
+    with METRICS.phase('listing'):
+        list_vms_with_vnic_and_vlan(vc, original_port_group_name)
+
+    # Determine the new port_group name
+    # This will default to the original port group name but two will be created
+    # one with _promiscuous and one with _isolated appended 
+    port_group_name_input = input(f"Please enter the new base name for the port group ({GREEN}{original_port_group_name}{RESET}): ")
+        
+    if port_group_name_input.strip() == "":
+        port_group_name = original_port_group_name
+    else:
+        port_group_name = port_group_name_input.strip()
+
+    print(f"{CYAN}  Script will create promiscuous Port Group name: {port_group_name}_promiscuous{RESET}")
+    print(f"{CYAN}  Script will create Isolated Port Group name:    {port_group_name}_isolated{RESET}")
+    print("\n")
+
+
+    #Get the original VLAN ID we are working with that was configured on the selected Port_Group.
+    vlan_id = get_vlan_id(inventory, original_vds_name, original_port_group_name)
+    if vlan_id is not None:
+        print(f"The existing base VLAN ID for port group {original_port_group_name} is {GREEN}{vlan_id}{RESET}")
+    else:
+        print(f"Failed to retrieve the VLAN ID for port group {original_port_group_name}.")
+
+    # Determine the promiscuous VLAN ID that will be used. 
+    # This will default to the original non PVLAN ID that was used for the existing Port_Group.
+    default = f" ({GREEN}{vlan_id}{RESET})" if vlan_id is not None else ""
+    promiscuous_vlan_id = prompt_vlan(f"{CYAN}Please enter the promiscuous VLAN number{default}: {RESET}", vlan_id)
+    print(f"   {CYAN}Using Promiscuous VLAN ID: {promiscuous_vlan_id}{RESET}")
+    print("\n")
+
+
+    # Determine the isolated VLAN ID for workloads.
+    # If nothing is selected then the default will be the promiscuous VLAN ID + 1 
+    default = promiscuous_vlan_id + 1 if promiscuous_vlan_id < 4094 else None
+    default_text = f" ({GREEN}{default}{RESET})" if default is not None else ""
+    isolated_vlan_id = prompt_vlan(f"{CYAN}Please enter the Isolated VLAN number{default_text}: {RESET}", default)
+    print(f"   {CYAN}Using Isolated VLAN ID: {isolated_vlan_id}{RESET}")
+
+    final_migration_choice = prompt_migration_target()
+    final_target_port_group_name = target_portgroup_name(port_group_name, final_migration_choice)
+
+    # Check the whole conversion against the inventory before anything is changed
+    row = PlanRow(line=1, vds=original_vds_name, source_port_group=original_port_group_name,
+                  dummy_port_group=dummy_port_group_name, target_type=final_migration_choice, base_name=port_group_name,
+                  promiscuous_vlan=promiscuous_vlan_id, isolated_vlan=isolated_vlan_id, dummy_vlan=dummy_vlan_id)
+    validation = vc.check_plan([row], args.direct_cutover)
+    for finding in validation.findings:
+        color = RED if finding.severity == 'error' else YELLOW
+        print(f"   {color}{finding.message}{RESET}")
+    if not validation.ok:
+        print(f"{RED}The conversion cannot be applied, nothing was changed.{RESET}")
+        return
+
+    # The new port groups keep the teaming, security, traffic shaping and port settings
+    # of the original one, read its config before it is deleted
+    template, nic_count = vc.port_group_template(original_vds_name, original_port_group_name)
+
+    if args.direct_cutover:
+        # Create the PVLAN port groups under temporary names next to the original one
+        if not create_port_group_with_pvlan(vc, original_vds_name, port_group_name, promiscuous_vlan_id, isolated_vlan_id, CUTOVER_SUFFIX,
+                                            template, nic_count):
+            return
+        if not wait_for_port_groups(inventory, original_vds_name, [name + CUTOVER_SUFFIX for name in pvlan_portgroup_names(port_group_name)]):
+            return
+
+        # Move every NIC straight to the new port group, one reconfiguration per VM
+        print(f"{GREEN}Migrating VM NIC's from {original_port_group_name} to {final_target_port_group_name}{RESET}")
+        results = migrate_vms(vc, original_vds_name, original_port_group_name, final_target_port_group_name + CUTOVER_SUFFIX, phase='cutover',
+                              wave_policy=waves)
+        if results is None:
+            return
+        if not all_vms_migrated(results, final_target_port_group_name + CUTOVER_SUFFIX):
+            print(f"{YELLOW}Port group {original_port_group_name} is kept and the new port groups keep their temporary names.{RESET}")
+            return
+
+        # Delete the original port group once it is empty and take over the final names
+        with METRICS.phase('inventory wait'):
+            original_port_group_empty = inventory.wait_for_empty_portgroup(original_vds_name, original_port_group_name, EMPTY_PORT_GROUP_TIMEOUT)
+        if original_port_group_empty:
+            if not delete_port_group(vc, original_vds_name, original_port_group_name):
+                print(f"{YELLOW}The VMs are on {final_target_port_group_name + CUTOVER_SUFFIX}, the port groups keep their temporary names.{RESET}")
+                return
+            rename_pvlan_port_groups(vc, original_vds_name, port_group_name, CUTOVER_SUFFIX)
+            print(f"{GREEN}\nVMs successfully migrated to {final_target_port_group_name}{RESET}")
+        else:
+            print(f"Failed to migrate all VMs from port group {original_port_group_name}. Cannot delete.")
+        return
+
+    if dummy_vlan_id is not None:
+        if not create_dummy_port_group(vc, original_vds_name, dummy_port_group_name, dummy_vlan_id, template, nic_count):
+            return
+
+        # Wait for the dummy port group that was just created
+        if not wait_for_port_groups(inventory, original_vds_name, [dummy_port_group_name]):
+            return
+
+    # Migrate VMs to Dummy Port Group
+    print(f"{YELLOW}\nMigrating VM NIC's from original Port-Group to {dummy_port_group_name}\n{RESET}")
+    results = migrate_vms(vc, original_vds_name, original_port_group_name, dummy_port_group_name, phase='dummy hop', wave_policy=waves)
+    if results is None:
+        return
+    if not all_vms_migrated(results, dummy_port_group_name):
+        print(f"Failed to migrate all VMs from port group {original_port_group_name}. Cannot delete.")
+        return
+
+    # Wait until vCenter reports no VMs left on the original port group
+    with METRICS.phase('inventory wait'):
+        original_port_group_empty = inventory.wait_for_empty_portgroup(original_vds_name, original_port_group_name, EMPTY_PORT_GROUP_TIMEOUT)
+
+
+    # Validate that no VMs are on the original port group, VMs left on it keep
+    # it and the conversion stops here
+    original_network = inventory.portgroup(original_vds_name, original_port_group_name)
+    if not (original_network and original_port_group_empty):
+        print(f"Failed to migrate all VMs from port group {original_port_group_name}. Cannot delete.")
+        return
+
+    # Delete Original Port Group
+    if not delete_port_group(vc, original_vds_name, original_port_group_name):
+        print(f"{YELLOW}The VMs stay parked on {dummy_port_group_name}.{RESET}")
+        return
+
+    # Create New Port Group with PVLAN
+    if not create_port_group_with_pvlan(vc, original_vds_name, port_group_name, promiscuous_vlan_id, isolated_vlan_id,
+                                        template=template, num_ports=nic_count):
+        print(f"{YELLOW}The VMs stay parked on {dummy_port_group_name}.{RESET}")
+        return
+
+    # Wait for the new port groups that were just created
+    if not wait_for_port_groups(inventory, original_vds_name, pvlan_portgroup_names(port_group_name)):
+        print(f"{YELLOW}The VMs stay parked on {dummy_port_group_name}.{RESET}")
+        return
+
+    # Migrate VMs to the chosen port group
+    print(f"{GREEN}Migrating VM NIC's from {dummy_port_group_name} to {final_target_port_group_name}{RESET}")
+    results = migrate_vms(vc, original_vds_name, dummy_port_group_name, final_target_port_group_name, phase='final hop', wave_policy=waves)
+    if results is not None and all_vms_migrated(results, final_target_port_group_name):
+        print(f"{GREEN}\nVMs successfully migrated to {final_target_port_group_name}{RESET}")
+    else:
+        print(f"{YELLOW}VMs that were not migrated stay parked on {dummy_port_group_name}.{RESET}")
+
+def main(argv=None):
+    args = parser.parse_args(argv)
+
+    # Read the plan before anything else so file errors show up straight away
+    plan_rows = None
+    if args.plan:
+        try:
+            plan_rows = load_plan(args.plan)
+        except (OSError, ValueError, PlanError) as e:
+            print(f"{RED}Cannot read plan {args.plan}: {e}{RESET}")
+            return 1
+    elif args.dry_run and not args.fleet:
+        print(f"{RED}--dry-run needs a --plan or a --fleet{RESET}")
+        return 1
+
+    # A fleet file names the vCenters and their plans itself
+    endpoints = None
+    if args.fleet:
+        if args.plan or args.snapshot or args.list_vms or args.resume or args.rollback or args.host:
+            print(f"{RED}--fleet cannot be combined with --plan, --snapshot, --list-vms, --resume, --rollback or --host{RESET}")
+            return 1
+        from pvlan_migration.fleet import load_fleet
+        try:
+            endpoints = load_fleet(args.fleet)
+        except (OSError, ValueError, PlanError) as e:
+            print(f"{RED}Cannot read fleet {args.fleet}: {e}{RESET}")
+            return 1
+
+    from pvlan_migration import api
+    from pvlan_migration.inventory import load_snapshot, save_snapshot
+    from pvlan_migration.tasks import TASK_FAULTS, fault_message
+    from pvlan_migration.waves import WaveHalted
+
+    # A dry run against a snapshot file never touches vCenter
+    if args.dry_run and args.snapshot:
+        try:
+            snapshot = load_snapshot(args.snapshot)
+        except (OSError, ValueError) as e:
+            print(f"{RED}Cannot read snapshot {args.snapshot}: {e}{RESET}")
+            return 1
+        return 0 if write_dry_run_plan(api.dry_run(snapshot, plan_rows, args.direct_cutover), args.output) else 1
+
+    # Listing VMs changes nothing, it skips the disclaimer and keeps standard
+    # output for the rows
+    listing = args.list_vms is not None
+    status = sys.stderr if listing else sys.stdout
+    if not listing:
+        print_banner()
+
+    # Ask the user to accept the disclaimer
+    if args.accept_disclaimer or listing:
+        accept_disclaimer = 'yes'
+    else:
+        accept_disclaimer = input(f"{MAGENTA}\nDo you accept the disclaimer and acknowledge the risks? (yes/no): {RESET}").strip().lower()
+
+    if accept_disclaimer != 'yes':
+        print(f"{RED}You did not accept the disclaimer. Exiting the script.{RESET}")
+        return 0
+
+    if endpoints is not None:
+        # Passwords not found in the environment are asked for up front
+        for endpoint in endpoints:
+            endpoint.insecure = endpoint.insecure or args.insecure
+            if endpoint.password is None:
+                endpoint.password = getpass.getpass(f"Password for {endpoint.user} on {endpoint.name} ({endpoint.password_env} is not set): ")
+        return 0 if run_fleet_plan(args, endpoints) else 1
+
+    # Replace these values with your vCenter details
+    host = args.host or input(f"{MAGENTA}Enter vCenter host: {RESET}")
+    user= args.user or input(f"{MAGENTA}Enter user name: {RESET}")
+    password = os.environ.get('VCENTER_PASSWORD') or getpass.getpass()
+
+    # Disabling SSL certificate verification if untrusted
+    if args.insecure:
+        confirm = 'no'
+    elif plan_rows is not None or listing:
+        confirm = 'yes'
+    else:
+        confirm = input(f"{MAGENTA}\nIs a trusted certificate used on the vCenter? (yes/no): {RESET}").strip().lower()
+    if confirm == 'yes':
+        print(f"   {GREEN}Continuing in verified TLS context{RESET}", file=status)
+    else:
+        print(f"   {RED}Continuing in unverified TLS context{RESET}", file=status)
+
+    # Connecting to the vCenter server happens on first use, parallel workers
+    # share a pool of connections on one login which is renewed if the session
+    # expires. The networking inventory is read once and then follows the
+    # changes made on vCenter.
+    vc = api.VCenter(host, user, password, verify_certificate=confirm == 'yes', sessions=args.sessions,
+                     max_in_flight=args.max_in_flight, retries=MAX_RETRIES - 1, retry_delay=RETRY_DELAY,
+                     max_per_host=args.max_per_host, priority_attribute=args.priority_attribute,
+                     waves=build_wave_policy(args) if args.waves else None)
+
+    print("\n", file=status)
+
+    # Live progress only makes sense when nothing prompts
+    progress = None
+    if args.progress and (plan_rows is not None or args.resume or args.rollback):
+        progress = ProgressDisplay().start()
+
+    try:
+        if listing:
+            return 0 if list_port_group(vc, args) else 1
+
+        if args.save_snapshot:
+            save_snapshot(vc.inventory, args.save_snapshot)
+            print(f"{GREEN}Inventory snapshot written to {args.save_snapshot}{RESET}")
+
+        if args.dry_run:
+            return 0 if write_dry_run_plan(vc.dry_run(plan_rows, args.direct_cutover), args.output) else 1
+
+        # The priority attribute has to exist before the first VM is touched
+        if args.priority_attribute and not args.rollback:
+            try:
+                vc.priority
+            except PlanError as e:
+                print(f"{RED}{e}{RESET}")
+                return 1
+
+        # Resuming or rolling back a journaled plan run replaces all of the prompts
+        if args.resume or args.rollback:
+            try:
+                if args.resume:
+                    recovery_ok = resume_batch_plan(vc, args, args.resume)
+                else:
+                    recovery_ok = rollback_batch_plan(vc, args.rollback)
+            except (OSError, PlanError) as e:
+                print(f"{RED}{e}{RESET}")
+                recovery_ok = False
+            print_session_pool_stats(vc)
+            return 0 if recovery_ok else 1
+
+        # In batch mode the plan replaces all of the prompts
+        if plan_rows is not None:
+            batch_ok = run_batch_plan(vc, args, plan_rows)
+            print_session_pool_stats(vc)
+            return 0 if batch_ok else 1
+
+        # A wave rollout that stopped ends the conversion before anything is deleted
+        try:
+            run_interactive(vc, args)
+        except WaveHalted as e:
+            print(f"{RED}{e}. The conversion was stopped.{RESET}")
+            return 1
+        except (PlanError, OSError, http.client.HTTPException) + TASK_FAULTS as e:
+            # vCenter faults and lost connections end the run with a message, not a traceback
+            print(f"{RED}The conversion was stopped: {fault_message(e)}{RESET}")
+            return 1
+        return 0
+    finally:
+        # Write the run report, then release the inventory cache and the session
+        if progress is not None:
+            progress.stop()
+        if args.report:
+            METRICS.write_report(args.report, {'session_pool': vc.session_pool.stats.as_dict()} if vc.connected else None)
+            print(f"{GREEN}Run report written to {args.report}{RESET}")
+        vc.close()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
\ No newline at end of file
@@ -0,0 +1,358 @@
+# Programmatic interface to the migration.
+#
+# The operations of the interactive script, without prompts or prints, for
+# tools that run conversions in-process. check_plan, dry_run and
+# port_group_vms work on any inventory, a live cache or a snapshot loaded from
+# a file. Everything that changes vCenter needs the live InventoryCache, whose
+# objects are bound to the session and which convert, resume and rollback
+# wait on for their changes to show up. VCenter bundles them with a
+# connection that is only made on first use, so creating one, reading a plan
+# or planning against a snapshot file does not log in.
+#
+#   with VCenter('vcenter.example.com', 'admin', password) as vc:
+#       results = vc.convert_port_group('vds-1', 'web', 'isolated', dummy_port_group='parking')
+import ssl
+import threading
+
+from pvlan_migration import recovery
+from pvlan_migration.batch import BatchRunner
+from pvlan_migration.cache import start_inventory_cache
+from pvlan_migration.inventory import BACKING_STANDARD
+from pvlan_migration.journal import Journal
+from pvlan_migration.listing import port_group_nics
+from pvlan_migration.metrics import METRICS
+from pvlan_migration.naming import pvlan_portgroup_names
+from pvlan_migration.plan import PlanError, PlanRow
+from pvlan_migration.planner import plan_conversions
+from pvlan_migration.pvlan import PvlanPlan
+from pvlan_migration.schedule import DEFAULT_MAX_PER_HOST, HostSlots, attribute_priority, custom_field_key
+from pvlan_migration.session import SessionPool
+from pvlan_migration.tasks import reconfigure_vms, rename_portgroups, run_task
+from pvlan_migration.validation import validate_plan
+from pvlan_migration.waves import WaveHalted, run_waves
+from pvlan_migration.workflow import migration_specs, pvlan_portgroup_specs, source_template, vlan_portgroup_spec
+
+# Defaults of the interactive script: three attempts per task, five seconds apart
+RETRIES = 2
+RETRY_DELAY = 5
+MAX_IN_FLIGHT = 8
+
+
+class PlanInvalid(PlanError):
+    def __init__(self, errors):
+        super().__init__("; ".join(errors))
+        self.errors = errors
+
+
+def port_group_vms(inventory, port_group_name):
+    # The port group found on any switch and (vm, NICs on the port group,
+    # NICs on a standard switch) for every VM on it, or None
+    port_group = inventory.find_portgroup(port_group_name)
+    if port_group is None:
+        return None
+    vms = []
+    for vm in inventory.vms_on_portgroup(port_group.key):
+        vms.append((vm, [nic for nic in vm.nics if nic.portgroup_key == port_group.key],
+                    [nic for nic in vm.nics if nic.backing_type == BACKING_STANDARD]))
+    return port_group, vms
+
+
+def migrate_vms(inventory, vds_name, original_port_group_name, target_port_group_name, is_initial_migration=True,
+                select=None, on_result=None, max_in_flight=MAX_IN_FLIGHT, retries=RETRIES, retry_delay=RETRY_DELAY,
+                metrics=METRICS, phase='migration', max_per_host=DEFAULT_MAX_PER_HOST, priority=None, waves=None,
+                on_wave=None):
+    # Move the NICs of every VM on the original port group to the target one,
+    # see workflow.migration_specs. select(vm) may veto single VMs. The VMs
+    # are spread over their ESXi hosts, at most max_per_host at a time on
+    # each, and priority(vm) puts critical ones first. With a WavePolicy the
+    # VMs go in checked waves, see waves.run_waves, and WaveHalted is raised
+    # when the rollout stops. Returns the TaskResult of every reconfigured VM.
+    vm_specs = migration_specs(inventory, vds_name, original_port_group_name, target_port_group_name,
+                               is_initial_migration, select=select)
+    if vm_specs is None:
+        if inventory.switch(vds_name) is None:
+            raise PlanError(f"Distributed Virtual Switch {vds_name} not found")
+        raise PlanError(f"Port group {original_port_group_name} or {target_port_group_name} not found on {vds_name}")
+
+    host_slots = HostSlots(max_per_host)
+
+    def reconfigure(specs):
+        return reconfigure_vms(specs, inventory=inventory, on_result=on_result, metrics=metrics,
+                               max_in_flight=max_in_flight, retries=retries, retry_delay=retry_delay,
+                               host_slots=host_slots, priority=priority)
+
+    with metrics.phase(phase):
+        if waves is None:
+            return reconfigure(vm_specs)
+        rollout = run_waves(vm_specs, inventory, reconfigure, waves, on_wave=on_wave)
+    if rollout.halted:
+        raise WaveHalted(rollout)
+    return rollout.vm_results
+
+
+def port_group_template(inventory, vds_name, port_group_name):
+    # (ConfigInfo, NIC count) of a port group to clone new ones from, read it
+    # before the port group is deleted
+    template, nic_count = source_template(inventory, vds_name, port_group_name)
+    if template is None:
+        raise PlanError(f"Port group {port_group_name} not found on {vds_name}")
+    return template, nic_count
+
+
+def create_vlan_port_group(inventory, vds_name, port_group_name, vlan_id, retries=RETRIES, retry_delay=RETRY_DELAY,
+                           metrics=METRICS, template=None, num_ports=None):
+    # template and num_ports as in create_port_group_with_pvlan
+    switch = inventory.switch(vds_name)
+    if switch is None:
+        raise PlanError(f"Distributed Virtual Switch {vds_name} not found")
+    spec = vlan_portgroup_spec(port_group_name, vlan_id, template, num_ports)
+    with metrics.phase('portgroup creation'):
+        run_task(lambda: switch.ref.AddDVPortgroup_Task([spec]), retries, retry_delay)
+
+
+def create_port_group_with_pvlan(inventory, vds_name, base_name, promiscuous_vlan, isolated_vlan, name_suffix='',
+                                 retries=RETRIES, retry_delay=RETRY_DELAY, metrics=METRICS, template=None,
+                                 num_ports=None):
+    # Add the PVLAN map entries in one switch reconfiguration, then create the
+    # promiscuous and isolated port groups in one task. With template, see
+    # port_group_template, they are clones of that port group with only the
+    # VLAN changed, num_ports is the least number of ports they get.
+    switch = inventory.switch(vds_name)
+    if switch is None:
+        raise PlanError(f"Distributed Virtual Switch {vds_name} not found")
+
+    pvlan_plan = PvlanPlan()
+    pvlan_plan.add_pair(vds_name, promiscuous_vlan, isolated_vlan)
+    with metrics.phase('PVLAN map'):
+        pvlan_results = pvlan_plan.apply(inventory)
+    for result in pvlan_results:
+        if not result.ok:
+            raise PlanError(f"Adding the PVLAN map entries to {vds_name} failed: {result.error}")
+
+    specs = pvlan_portgroup_specs(base_name, promiscuous_vlan, isolated_vlan, name_suffix, template, num_ports)
+    with metrics.phase('portgroup creation'):
+        run_task(lambda: switch.ref.AddDVPortgroup_Task(specs), retries, retry_delay)
+
+
+def delete_port_group(inventory, vds_name, port_group_name, retries=RETRIES, retry_delay=RETRY_DELAY,
+                      metrics=METRICS):
+    # Returns False if there was no such port group
+    if inventory.switch(vds_name) is None:
+        raise PlanError(f"Distributed Virtual Switch {vds_name} not found")
+    port_group = inventory.portgroup(vds_name, port_group_name)
+    if port_group is None:
+        return False
+    with metrics.phase('delete'):
+        run_task(port_group.ref.Destroy_Task, retries, retry_delay)
+    inventory.discard_portgroup(port_group.key)
+    return True
+
+
+def rename_pvlan_port_groups(inventory, vds_name, base_name, name_suffix, retries=RETRIES, retry_delay=RETRY_DELAY,
+                             metrics=METRICS):
+    # Give the temporarily named PVLAN port groups their final names. Returns
+    # the TaskResults and the names that were not found.
+    renames = []
+    missing = []
+    for final_name in pvlan_portgroup_names(base_name):
+        port_group = inventory.portgroup(vds_name, final_name + name_suffix)
+        if port_group is None:
+            missing.append(final_name + name_suffix)
+        else:
+            renames.append((port_group, final_name))
+    with metrics.phase('rename'):
+        return rename_portgroups(renames, retries=retries, retry_delay=retry_delay), missing
+
+
+def check_plan(inventory, rows, direct=False):
+    # ValidationReport with every error and warning, fills in the defaults of
+    # the rows on the way
+    return validate_plan(rows, inventory, direct)
+
+
+def dry_run(inventory, rows, direct=False):
+    return plan_conversions(inventory, rows, direct)
+
+
+def convert(inventory, rows, direct=False, journal_path=None, on_event=None, **runner_options):
+    # Check the plan against the inventory and run it, raising PlanInvalid
+    # with every problem found before anything is changed. runner_options go
+    # to BatchRunner. Returns a ConversionResult per row.
+    report = check_plan(inventory, rows, direct)
+    if not report.ok:
+        raise PlanInvalid(report.errors)
+    journal = Journal(journal_path) if journal_path else None
+    try:
+        runner = BatchRunner(inventory, direct=direct, on_event=on_event, journal=journal, **runner_options)
+        return runner.run(rows)
+    finally:
+        if journal is not None:
+            journal.close()
+
+
+def resume(inventory, journal_path, on_event=None, **runner_options):
+    return recovery.resume(journal_path, inventory, on_event=on_event, **runner_options)
+
+
+def rollback(inventory, journal_path, on_event=None, **options):
+    return recovery.rollback(journal_path, inventory, on_event=on_event, **options)
+
+
+def plan_row(vds_name, source_port_group, target_type, dummy_port_group=None, base_name=None, promiscuous_vlan=None,
+             isolated_vlan=None, dummy_vlan=None, line=1):
+    return PlanRow(line=line, vds=vds_name, source_port_group=source_port_group, dummy_port_group=dummy_port_group,
+                   target_type=str(target_type).strip().lower(), base_name=base_name,
+                   promiscuous_vlan=promiscuous_vlan, isolated_vlan=isolated_vlan, dummy_vlan=dummy_vlan)
+
+
+class VCenter:
+    # A vCenter whose login, session pool and inventory cache are created on
+    # first use. connect can replace the SmartConnect login, it returns a
+    # ServiceInstance. priority_attribute names a numeric VM custom attribute
+    # ordering the reconfigurations, lower values first. waves is the
+    # WavePolicy VM moves are rolled out with, None moves all VMs at once.
+    def __init__(self, host, user, password, verify_certificate=True, sessions=4, connect=None, metrics=METRICS,
+                 max_in_flight=MAX_IN_FLIGHT, retries=RETRIES, retry_delay=RETRY_DELAY,
+                 max_per_host=DEFAULT_MAX_PER_HOST, priority_attribute=None, waves=None):
+        self.host = host
+        self.user = user
+        self.verify_certificate = verify_certificate
+        self.sessions = sessions
+        self.metrics = metrics
+        self.max_in_flight = max_in_flight
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self.max_per_host = max_per_host
+        self.priority_attribute = priority_attribute
+        self.waves = waves
+        self._priority = None
+        self._password = password
+        self._connect = connect or self._smart_connect
+        self._session_pool = None
+        self._inventory = None
+        self._lock = threading.Lock()
+
+    def _smart_connect(self):
+        # pyvim is only needed for the login itself
+        from pyvim.connect import SmartConnect
+        context = None if self.verify_certificate else ssl._create_unverified_context()
+        return SmartConnect(host=self.host, user=self.user, pwd=self._password, sslContext=context)
+
+    @property
+    def connected(self):
+        return self._session_pool is not None
+
+    @property
+    def session_pool(self):
+        with self._lock:
+            if self._session_pool is None:
+                self._session_pool = SessionPool(self._connect, size=self.sessions, metrics=self.metrics)
+            return self._session_pool
+
+    @property
+    def content(self):
+        return self.session_pool.service_instance().content
+
+    @property
+    def inventory(self):
+        # Read once, then kept up to date from vCenter's change feed
+        if self._inventory is None:
+            content = self.content
+            with self._lock:
+                if self._inventory is None:
+                    with self.metrics.phase('inventory load'):
+                        self._inventory = start_inventory_cache(content)
+        return self._inventory
+
+    @property
+    def priority(self):
+        # priority(vm) of priority_attribute, None without one
+        if self.priority_attribute and self._priority is None:
+            field_key = custom_field_key(self.content, self.priority_attribute)
+            if field_key is None:
+                raise PlanError(f"Custom attribute {self.priority_attribute} not found")
+            self._priority = attribute_priority(field_key)
+        return self._priority
+
+    def _scheduling_options(self):
+        return {'max_in_flight': self.max_in_flight, 'max_per_host': self.max_per_host, 'priority': self.priority,
+                'waves': self.waves}
+
+    def _task_options(self):
+        return {'retries': self.retries, 'retry_delay': self.retry_delay, 'metrics': self.metrics}
+
+    def port_group_vms(self, port_group_name):
+        return port_group_vms(self.inventory, port_group_name)
+
+    def port_group_nics(self, port_group_name, vds_name=None, name_pattern=None, folder=None, host=None):
+        # Streams from vCenter without loading the inventory, see listing
+        return port_group_nics(self.content, port_group_name, vds_name, name_pattern, folder, host)
+
+    def migrate_vms(self, vds_name, original_port_group_name, target_port_group_name, is_initial_migration=True,
+                    select=None, on_result=None, phase='migration', waves=None, on_wave=None):
+        # waves overrides the WavePolicy of the VCenter for this move
+        options = self._scheduling_options()
+        if waves is not None:
+            options['waves'] = waves
+        return migrate_vms(self.inventory, vds_name, original_port_group_name, target_port_group_name,
+                           is_initial_migration, select, on_result, phase=phase, on_wave=on_wave, **options,
+                           **self._task_options())
+
+    def port_group_template(self, vds_name, port_group_name):
+        return port_group_template(self.inventory, vds_name, port_group_name)
+
+    def create_vlan_port_group(self, vds_name, port_group_name, vlan_id, template=None, num_ports=None):
+        create_vlan_port_group(self.inventory, vds_name, port_group_name, vlan_id, template=template,
+                               num_ports=num_ports, **self._task_options())
+
+    def create_port_group_with_pvlan(self, vds_name, base_name, promiscuous_vlan, isolated_vlan, name_suffix='',
+                                     template=None, num_ports=None):
+        create_port_group_with_pvlan(self.inventory, vds_name, base_name, promiscuous_vlan, isolated_vlan, name_suffix,
+                                     template=template, num_ports=num_ports, **self._task_options())
+
+    def delete_port_group(self, vds_name, port_group_name):
+        return delete_port_group(self.inventory, vds_name, port_group_name, **self._task_options())
+
+    def rename_pvlan_port_groups(self, vds_name, base_name, name_suffix):
+        return rename_pvlan_port_groups(self.inventory, vds_name, base_name, name_suffix, **self._task_options())
+
+    def check_plan(self, rows, direct=False):
+        return check_plan(self.inventory, rows, direct)
+
+    def dry_run(self, rows, direct=False):
+        return dry_run(self.inventory, rows, direct)
+
+    def convert(self, rows, direct=False, journal_path=None, on_event=None, **runner_options):
+        options = dict(self._scheduling_options(), **self._task_options())
+        options.update(runner_options)
+        return convert(self.inventory, rows, direct, journal_path, on_event, **options)
+
+    def convert_port_group(self, vds_name, source_port_group, target_type, dummy_port_group=None, direct=False,
+                           journal_path=None, on_event=None, **row_options):
+        # One conversion, row_options are the optional plan columns
+        row = plan_row(vds_name, source_port_group, target_type, dummy_port_group, **row_options)
+        return self.convert([row], direct, journal_path, on_event)[0]
+
+    def resume(self, journal_path, on_event=None, **runner_options):
+        options = dict(self._scheduling_options(), **self._task_options())
+        options.update(runner_options)
+        return resume(self.inventory, journal_path, on_event, **options)
+
+    def rollback(self, journal_path, on_event=None):
+        return rollback(self.inventory, journal_path, on_event, max_in_flight=self.max_in_flight,
+                        retries=self.retries, retry_delay=self.retry_delay, max_per_host=self.max_per_host)
+
+    def close(self):
+        with self._lock:
+            if self._inventory is not None:
+                self._inventory.close()
+                self._inventory = None
+            if self._session_pool is not None:
+                self._session_pool.close()
+                self._session_pool = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
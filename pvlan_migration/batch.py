@@ -0,0 +1,377 @@
+# Non-interactive conversion of many port groups from a plan file.
+#
+# A plan is a list of rows, each converting one VLAN port group into a
+# promiscuous/isolated PVLAN pair. The whole plan is validated against one
+# inventory snapshot before anything is changed. The PVLAN map entries of all
+# rows are then added with one reconfiguration per switch, and the rows run as
+# a pipeline: independent port groups are converted in parallel, bounded per
+# switch and across the run. Dummy and PVLAN port groups are created as clones
+# of the source port group with only the VLAN changed.
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import List, Optional
+
+from pvlan_migration.journal import DONE, FAILED, PLANNED, begin_entry, nic_entries
+from pvlan_migration.metrics import METRICS
+from pvlan_migration.naming import CUTOVER_SUFFIX, pvlan_portgroup_names
+from pvlan_migration.plan import PlanError, PlanRow
+from pvlan_migration.pvlan import PvlanPlan
+from pvlan_migration.retry import THROTTLE
+from pvlan_migration.schedule import DEFAULT_MAX_PER_HOST, HostSlots
+from pvlan_migration.serialize import decode, encode
+from pvlan_migration.tasks import TaskTimeout, reconfigure_vms, rename_portgroups, run_task
+from pvlan_migration.validation import validate_plan
+from pvlan_migration.waves import WaveHalted, run_waves
+from pvlan_migration.workflow import dummy_portgroup_specs, migration_specs, pvlan_portgroup_specs, source_template
+
+# Seconds to wait for vCenter to report a port group empty or created
+INVENTORY_WAIT_TIMEOUT = 120
+
+
+@dataclass
+class ConversionResult:
+    row: PlanRow
+    ok: bool = False
+    step: str = ''
+    error: Optional[str] = None
+    vm_results: List = field(default_factory=list)
+
+
+def resolve_plan(rows, inventory, direct=False):
+    # Fill in the defaults used by the interactive prompts and return every
+    # error found, an empty list means the plan can run. See
+    # validation.validate_plan for the warnings as well.
+    return validate_plan(rows, inventory, direct).errors
+
+
+def _parked_on(inventory, dummy_key, parked):
+    # True once the snapshot shows every parked NIC on the dummy port group
+    on_dummy = inventory.nics_on_portgroup(dummy_key)
+    for moid, device_keys in parked.items():
+        if not device_keys <= {nic.key for nic in on_dummy.get(moid, ())}:
+            return False
+    dummy = inventory.portgroup_by_key(dummy_key)
+    return dummy is not None and set(parked) <= {ref._moId for ref in dummy.vm_refs}
+
+
+class BatchRunner:
+    # With a journal every change is recorded before it is made and once it is
+    # confirmed. resume is the JournalState of an earlier run of the same rows,
+    # steps it confirmed are skipped. max_per_host bounds the VM
+    # reconfigurations per ESXi host across all rows, priority(vm) orders
+    # the VMs of a port group, see schedule. throttle is the retry.Throttle
+    # the tasks of the run wait on, one per vCenter. With a WavePolicy in
+    # waves the VMs of each move go in checked waves, a row whose rollout
+    # stops fails at that move.
+    def __init__(self, inventory, max_parallel=4, max_parallel_per_vds=2, max_in_flight=8,
+                 retries=2, retry_delay=5, direct=False, on_event=None, journal=None, resume=None, metrics=METRICS,
+                 max_per_host=DEFAULT_MAX_PER_HOST, priority=None, throttle=THROTTLE, waves=None):
+        self.inventory = inventory
+        self.direct = direct
+        self.max_parallel = max_parallel
+        self.max_parallel_per_vds = max_parallel_per_vds
+        self.max_in_flight = max_in_flight
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self.on_event = on_event
+        self.journal = journal
+        self.resume = resume
+        self.metrics = metrics
+        self.host_slots = HostSlots(max_per_host)
+        self.priority = priority
+        self.throttle = throttle
+        self.waves = waves
+        self._vds_slots = {}
+        self._lock = threading.Lock()
+
+    def _event(self, row, message, ok=True):
+        if self.on_event is not None:
+            self.on_event(row, message, ok)
+
+    def _record(self, op, status=DONE, **fields):
+        if self.journal is not None:
+            self.journal.record(op, status, **fields)
+
+    def _step_done(self, row, step):
+        return self.resume is not None and self.resume.step_done(row.label, step)
+
+    def _finish_step(self, row, step):
+        self._record('step', row=row.label, step=step)
+
+    def _vds_slot(self, vds_name):
+        with self._lock:
+            if vds_name not in self._vds_slots:
+                self._vds_slots[vds_name] = threading.BoundedSemaphore(self.max_parallel_per_vds)
+            return self._vds_slots[vds_name]
+
+    def run(self, rows):
+        if self.journal is not None:
+            if self.resume is None:
+                self.journal.record('begin', **begin_entry(rows, self.direct))
+            else:
+                self.journal.record('resume')
+
+        # Add the PVLAN maps of the whole plan first, one reconfiguration per switch
+        pvlan_plan = PvlanPlan()
+        for row in rows:
+            pvlan_plan.add_pair(row.vds, row.promiscuous_vlan, row.isolated_vlan)
+        pending = pvlan_plan.pending(self.inventory)
+        for vds_name, entries in pending.items():
+            self._record('pvlan_map_add', PLANNED, vds=vds_name, entries=entries)
+        failed_switches = {}
+        with self.metrics.phase('PVLAN map'):
+            pvlan_results = pvlan_plan.apply(self.inventory, throttle=self.throttle)
+        for result in pvlan_results:
+            if not result.ok:
+                failed_switches[result.name] = result.error
+                self._record('pvlan_map_add', FAILED, vds=result.name, error=result.error)
+            else:
+                self._record('pvlan_map_add', vds=result.name, entries=pending.get(result.name, []))
+
+        # Create the missing dummy port groups, one task per switch
+        for vds_name, specs in self._missing_dummy_specs(rows).items():
+            names = [spec.name for spec in specs]
+            try:
+                self._record('portgroup_create', PLANNED, vds=vds_name, names=names)
+                switch_ref = self.inventory.switch(vds_name).ref
+                with self.metrics.phase('portgroup creation'):
+                    run_task(lambda: switch_ref.AddDVPortgroup_Task(specs), self.retries, self.retry_delay,
+                             throttle=self.throttle)
+                self._wait(lambda inv: all(inv.portgroup(vds_name, n) is not None for n in names),
+                           f"dummy port groups on {vds_name}")
+                self._record('portgroup_create', vds=vds_name, names=names)
+            except Exception as e:
+                failed_switches[vds_name] = str(e) or type(e).__name__
+                self._record('portgroup_create', FAILED, vds=vds_name, names=names, error=failed_switches[vds_name])
+
+        results = []
+        with ThreadPoolExecutor(max_workers=max(1, self.max_parallel)) as pool:
+            futures = []
+            for row in rows:
+                if self._step_done(row, 'done'):
+                    self._event(row, "Already converted")
+                    futures.append(None)
+                    results.append(ConversionResult(row, ok=True, step='done'))
+                    continue
+                if row.vds in failed_switches:
+                    result = ConversionResult(row, step='prepare switch', error=failed_switches[row.vds])
+                    self._event(row, f"Switch preparation failed: {result.error}", ok=False)
+                    futures.append(None)
+                    results.append(result)
+                    continue
+                futures.append(pool.submit(self._convert_in_slot, row))
+                results.append(None)
+            for i, future in enumerate(futures):
+                if future is not None:
+                    results[i] = future.result()
+        return results
+
+    def _missing_dummy_specs(self, rows):
+        if self.direct:
+            return {}
+        rows = [row for row in rows if not self._step_done(row, 'dummy hop') and
+                self.inventory.portgroup(row.vds, row.dummy_port_group) is None]
+        return dummy_portgroup_specs(rows, self._source_template)
+
+    def _source_template(self, row):
+        # The new port groups are clones of the source. A resumed run may find
+        # it deleted already, its config is then taken from the journal.
+        template, nic_count = source_template(self.inventory, row.vds, row.source_port_group)
+        if template is None and self.resume is not None:
+            for entry in self.resume.deleted:
+                if entry['vds'] == row.vds and entry['name'] == row.source_port_group and entry.get('config'):
+                    template = decode(entry['config'])
+        return template, nic_count
+
+    def _convert_in_slot(self, row):
+        with self._vds_slot(row.vds):
+            result = ConversionResult(row)
+            try:
+                if self.direct:
+                    self._convert_direct(row, result)
+                else:
+                    self._convert(row, result)
+                self._finish_step(row, 'done')
+            except Exception as e:
+                result.ok = False
+                result.error = str(e) or type(e).__name__
+            self._event(row, "Conversion finished" if result.ok else f"Failed at {result.step}: {result.error}",
+                        ok=result.ok)
+            return result
+
+    def _move(self, row, result, hop, source_name, target_name, only=None):
+        specs = migration_specs(self.inventory, row.vds, source_name, target_name, only=only)
+        if specs is None:
+            raise PlanError(f"Port group {source_name} or {target_name} not found")
+        from_key = self.inventory.portgroup(row.vds, source_name).key
+
+        def reconfigure(vm_specs, journal_hop=hop, journal_from=from_key):
+            # Journal every NIC before its VM is touched, and each VM again as
+            # soon as vCenter confirms it
+            on_result = None
+            if self.journal is not None:
+                self.journal.record_many(nic_entries(row.label, journal_hop, vm_specs, journal_from, PLANNED))
+
+                def on_result(vm_result):
+                    if vm_result.ok:
+                        self.journal.record_many(nic_entries(row.label, journal_hop, [vm_specs[vm_result.index]],
+                                                             journal_from, DONE))
+
+            return reconfigure_vms(vm_specs, inventory=self.inventory, max_in_flight=self.max_in_flight,
+                                   retries=self.retries, retry_delay=self.retry_delay, on_result=on_result,
+                                   metrics=self.metrics, host_slots=self.host_slots, priority=self.priority,
+                                   throttle=self.throttle)
+
+        def restore(vm_specs):
+            # Moves back are journaled as a hop of their own
+            return reconfigure(vm_specs, f"{hop} rollback", self.inventory.portgroup(row.vds, target_name).key)
+
+        def on_wave(wave, rollout):
+            self._event(row, f"Wave {wave.number}: {wave.size} VM(s), {len(wave.failed)} failed, "
+                             f"{rollout.reconfigured} of {rollout.total} done", ok=not wave.failed)
+
+        with self.metrics.phase(result.step):
+            if self.waves is None:
+                vm_results = reconfigure(specs)
+            else:
+                rollout = run_waves(specs, self.inventory, reconfigure, self.waves, restore, on_wave)
+                vm_results = rollout.vm_results
+                if rollout.halted:
+                    result.vm_results.extend(vm_results + rollout.restored)
+                    raise WaveHalted(rollout)
+        result.vm_results.extend(vm_results)
+        failed = [r.name for r in vm_results if not r.ok]
+        if failed:
+            raise PlanError(f"{len(failed)} VM(s) failed to reconfigure: {', '.join(failed)}")
+        return specs
+
+    def _wait(self, condition, what):
+        with self.metrics.phase('inventory wait'):
+            done = self.inventory.wait_until(condition, INVENTORY_WAIT_TIMEOUT)
+        if not done:
+            raise TaskTimeout(f"Timed out waiting for {what}")
+
+    def _create_portgroups(self, row, switch, specs):
+        names = [spec.name for spec in specs]
+        self._record('portgroup_create', PLANNED, row=row.label, vds=row.vds, names=names)
+        with self.metrics.phase('portgroup creation'):
+            run_task(lambda: switch.ref.AddDVPortgroup_Task(specs), self.retries, self.retry_delay,
+                     throttle=self.throttle)
+        self._wait(lambda inv: all(inv.portgroup(row.vds, name) is not None for name in names),
+                   f"port group {names[-1]}")
+        self._record('portgroup_create', row=row.label, vds=row.vds, names=names)
+
+    def _delete_source(self, row):
+        inventory = self.inventory
+        self._wait(lambda inv: not getattr(inv.portgroup(row.vds, row.source_port_group), 'vm_refs', None),
+                   f"port group {row.source_port_group} to be empty")
+        source = inventory.portgroup(row.vds, row.source_port_group)
+        if source is not None:
+            # Keep the full config so a rollback can bring the port group back
+            self._record('portgroup_delete', PLANNED, row=row.label, vds=row.vds, name=source.name,
+                         key=source.key, config=encode(source.config))
+            with self.metrics.phase('delete'):
+                run_task(source.ref.Destroy_Task, self.retries, self.retry_delay, throttle=self.throttle)
+            inventory.discard_portgroup(source.key)
+            self._record('portgroup_delete', row=row.label, vds=row.vds, name=source.name, key=source.key)
+
+    def _still_parked(self, row):
+        # NICs an earlier run parked that are still on the dummy port group
+        dummy = self.inventory.portgroup(row.vds, row.dummy_port_group)
+        if dummy is None:
+            return {}
+        parked = {}
+        on_dummy_nics = self.inventory.nics_on_portgroup(dummy.key)
+        for moid, device_keys in self.resume.parked(row.label).items():
+            on_dummy = {nic.key for nic in on_dummy_nics.get(moid, ())}
+            if device_keys & on_dummy:
+                parked[moid] = device_keys & on_dummy
+        return parked
+
+    def _convert(self, row, result):
+        inventory = self.inventory
+        switch = inventory.switch(row.vds)
+        # Read before the source is deleted
+        template, nic_count = self._source_template(row)
+
+        # The dummy port group may be shared with other rows, remember exactly
+        # which NICs were parked so only those move on in the final hop
+        result.step = 'dummy hop'
+        parked = self._still_parked(row) if self.resume is not None else {}
+        if not self._step_done(row, result.step):
+            self._event(row, f"Moving NICs to {row.dummy_port_group}")
+            specs = self._move(row, result, 'dummy', row.source_port_group, row.dummy_port_group)
+            for _, vm_ref, spec in specs:
+                parked.setdefault(vm_ref._moId, set()).update(change.device.key for change in spec.deviceChange)
+            self._finish_step(row, result.step)
+
+        result.step = 'delete source'
+        if not self._step_done(row, result.step):
+            self._delete_source(row)
+            self._finish_step(row, result.step)
+
+        result.step = 'create PVLAN port groups'
+        target_name = row.target_port_group
+        if not self._step_done(row, result.step):
+            num_ports = max(nic_count, sum(len(device_keys) for device_keys in parked.values()))
+            self._create_portgroups(row, switch, pvlan_portgroup_specs(
+                row.base_name, row.promiscuous_vlan, row.isolated_vlan, template=template, num_ports=num_ports))
+            self._finish_step(row, result.step)
+
+        result.step = 'final hop'
+        self._event(row, f"Moving NICs to {target_name}")
+        if parked:
+            dummy_key = inventory.portgroup(row.vds, row.dummy_port_group).key
+            self._wait(lambda inv: _parked_on(inv, dummy_key, parked), f"NICs parked on {row.dummy_port_group}")
+            self._move(row, result, 'final', row.dummy_port_group, target_name, only=parked)
+        self._finish_step(row, result.step)
+        result.step = 'done'
+        result.ok = True
+
+    def _convert_direct(self, row, result):
+        # Create the PVLAN port groups under temporary names next to the
+        # source, move every NIC once, then take over the final names
+        inventory = self.inventory
+        switch = inventory.switch(row.vds)
+        final_names = pvlan_portgroup_names(row.base_name)
+
+        result.step = 'create PVLAN port groups'
+        temp_target = row.target_port_group + CUTOVER_SUFFIX
+        if not self._step_done(row, result.step):
+            template, nic_count = self._source_template(row)
+            self._create_portgroups(row, switch, pvlan_portgroup_specs(
+                row.base_name, row.promiscuous_vlan, row.isolated_vlan, CUTOVER_SUFFIX, template, nic_count))
+            self._finish_step(row, result.step)
+
+        result.step = 'cutover'
+        if not self._step_done(row, result.step):
+            self._event(row, f"Moving NICs to {temp_target}")
+            self._move(row, result, 'cutover', row.source_port_group, temp_target)
+            self._finish_step(row, result.step)
+
+        result.step = 'delete source'
+        if not self._step_done(row, result.step):
+            self._delete_source(row)
+            self._finish_step(row, result.step)
+
+        result.step = 'rename'
+        # A resumed run may find some port groups renamed already
+        renames = [(inventory.portgroup(row.vds, name + CUTOVER_SUFFIX), name) for name in final_names]
+        renames = [(pg, name) for pg, name in renames if pg is not None and inventory.portgroup(row.vds, name) is None]
+        for pg, name in renames:
+            self._record('portgroup_rename', PLANNED, row=row.label, vds=row.vds, old_name=pg.name, name=name)
+        with self.metrics.phase('rename'):
+            rename_results = rename_portgroups(renames, retries=self.retries, retry_delay=self.retry_delay,
+                                               throttle=self.throttle)
+        for (pg, name), rename_result in zip(renames, rename_results):
+            if rename_result.ok:
+                self._record('portgroup_rename', row=row.label, vds=row.vds, old_name=pg.name, name=name)
+        failed = [r for r in rename_results if not r.ok]
+        if failed:
+            raise PlanError(f"Renaming {', '.join(r.name for r in failed)} failed: {failed[0].error}")
+        self._wait(lambda inv: all(inv.portgroup(row.vds, name) is not None for name in final_names),
+                   f"port group {row.target_port_group}")
+        self._finish_step(row, result.step)
+        result.step = 'done'
+        result.ok = True
@@ -0,0 +1,316 @@
+# Offline benchmark of the batch conversion against a simulated vCenter.
+#
+# Builds a FakeVCenter holding one switch with a number of VLAN port groups and
+# VMs spread over them, then connects to it through api.VCenter like the
+# script does: the paged --list-vms listing of every source port group, then
+# the --plan conversion. With --interactive the port groups are converted one
+# after another through the VCenter calls the interactive mode makes instead,
+# migrate_vms, delete_port_group and create_port_group_with_pvlan. The VMs sit
+# on a few ESXi hosts in contiguous blocks, so the VMs of one port group start
+# out bunched on a host.
+# Per-call latency, task duration, the reconfigurations a host agent works on
+# at once and the task failure rate are configurable. Every
+# size of a sweep reports wall time,
+# the API calls per method and per VM, peak Python memory and the phase
+# timings, so changes to round trips and concurrency show up before a run
+# against production.
+#
+# With --vcenters every size is converted on that many simulated vCenters at
+# once through the fleet mode, each with its own session pool and inventory
+# cache. --unreachable of them refuse the login, which the others must not
+# notice.
+#
+#   python -m pvlan_migration.benchmark --sizes 10,100,1000,10000 --latency 0.002
+#   python -m pvlan_migration.benchmark --sizes 200 --task-duration 0.5 --host-capacity 2 --max-per-host 0
+#   python -m pvlan_migration.benchmark --sizes 10,100,1000 --interactive
+#   python -m pvlan_migration.benchmark --sizes 1000 --vcenters 4 --unreachable 1 --latency 0.002
+import argparse
+import json
+import sys
+import time
+import tracemalloc
+
+from pvlan_migration.api import VCenter
+from pvlan_migration.cache import InventoryCache
+from pvlan_migration.fake import FakeBehaviour, FakeVCenter
+from pvlan_migration.fleet import Endpoint, fleet_report, run_fleet
+from pvlan_migration.metrics import RunMetrics
+from pvlan_migration.naming import CUTOVER_SUFFIX, pvlan_portgroup_names
+from pvlan_migration.plan import PlanError, PlanRow
+from pvlan_migration.schedule import DEFAULT_MAX_PER_HOST
+from pvlan_migration.tasks import TASK_FAULTS
+from pvlan_migration.workflow import vlan_portgroup_spec
+
+BENCHMARK_FORMAT = 1
+
+DEFAULT_SIZES = [10, 100, 1000, 10000]
+
+# VLAN of the first source port group, the next ones follow two apart so each
+# has a free isolated VLAN next to it
+FIRST_VLAN = 100
+DUMMY_VLAN = 4000
+
+# Seconds the interactive conversion waits for vCenter to report a new port
+# group or an empty source port group
+INVENTORY_WAIT_TIMEOUT = 60
+
+
+def build_vcenter(vm_count, portgroup_count=10, nics_per_vm=1, behaviour=None, switch_name='bench-vds', hosts=4):
+    # A FakeVCenter and the plan rows converting all of its port groups. The
+    # NICs of a VM sit on consecutive port groups, VMs are spread round robin
+    # over the port groups and in blocks over the hosts.
+    vcenter = FakeVCenter(behaviour)
+    host_refs = [vcenter.add_host(f"esx-{i:02d}") for i in range(max(1, hosts))]
+    switch = vcenter.add_switch(switch_name)
+    portgroups = [vcenter.add_portgroup(switch, vlan_portgroup_spec(f"pg-{i:04d}", FIRST_VLAN + 2 * i))
+                  for i in range(portgroup_count)]
+    vcenter.add_portgroup(switch, vlan_portgroup_spec('dummy', DUMMY_VLAN))
+    for n in range(vm_count):
+        vcenter.add_vm(f"vm-{n:05d}", [(switch, portgroups[(n + i) % portgroup_count]) for i in range(nics_per_vm)],
+                       host=host_refs[n * len(host_refs) // vm_count])
+    rows = [PlanRow(line=i + 1, vds=switch_name, source_port_group=f"pg-{i:04d}", dummy_port_group='dummy',
+                    target_type='isolated') for i in range(portgroup_count)]
+    return vcenter, rows
+
+
+def _converted(vcenter, inventory, rows):
+    # Number of NICs left on a port group the plan converted
+    source_names = {row.source_port_group for row in rows} | {row.dummy_port_group for row in rows}
+    left = 0
+    for vm in inventory.vms.values():
+        for nic in vm.nics:
+            pg = inventory.portgroup_by_key(nic.portgroup_key)
+            if pg is None or pg.name in source_names:
+                left += 1
+    return left
+
+
+def _port_groups_reported(vc, vds_name, names):
+    with vc.metrics.phase('inventory wait'):
+        return vc.inventory.wait_until(lambda inv: all(inv.portgroup(vds_name, name) is not None for name in names),
+                                       INVENTORY_WAIT_TIMEOUT)
+
+
+def _interactive_conversion(vc, row, direct):
+    # The VCenter calls run_interactive makes for one port group, without the
+    # prompts. True when every VM ended up on the target port group.
+    vc.port_group_vms(row.source_port_group)
+    template, nic_count = vc.port_group_template(row.vds, row.source_port_group)
+    if direct:
+        vc.create_port_group_with_pvlan(row.vds, row.base_name, row.promiscuous_vlan, row.isolated_vlan,
+                                        CUTOVER_SUFFIX, template, nic_count)
+        cutover_names = [name + CUTOVER_SUFFIX for name in pvlan_portgroup_names(row.base_name)]
+        if not _port_groups_reported(vc, row.vds, cutover_names):
+            return False
+        results = vc.migrate_vms(row.vds, row.source_port_group, row.target_port_group + CUTOVER_SUFFIX,
+                                 phase='cutover')
+    else:
+        results = vc.migrate_vms(row.vds, row.source_port_group, row.dummy_port_group, phase='dummy hop')
+    if not all(result.ok for result in results):
+        return False
+    with vc.metrics.phase('inventory wait'):
+        if not vc.inventory.wait_for_empty_portgroup(row.vds, row.source_port_group, INVENTORY_WAIT_TIMEOUT):
+            return False
+    vc.delete_port_group(row.vds, row.source_port_group)
+    if direct:
+        renames, missing = vc.rename_pvlan_port_groups(row.vds, row.base_name, CUTOVER_SUFFIX)
+        return not missing and all(result.ok for result in renames)
+    vc.create_port_group_with_pvlan(row.vds, row.base_name, row.promiscuous_vlan, row.isolated_vlan,
+                                    template=template, num_ports=nic_count)
+    if not _port_groups_reported(vc, row.vds, pvlan_portgroup_names(row.base_name)):
+        return False
+    results = vc.migrate_vms(row.vds, row.dummy_port_group, row.target_port_group, phase='final hop')
+    return all(result.ok for result in results)
+
+
+def run_benchmark(vm_count, portgroup_count=10, nics_per_vm=1, latency=0.0, task_duration=0.0, failure_rate=0.0,
+                  direct=False, max_parallel=4, max_parallel_per_vds=2, max_in_flight=8, retries=3, seed=0, hosts=4,
+                  host_capacity=0, max_per_host=DEFAULT_MAX_PER_HOST, interactive=False):
+    behaviour = FakeBehaviour(latency=latency, task_duration=task_duration, failure_rate=failure_rate, seed=seed,
+                              host_capacity=host_capacity)
+    portgroup_count = max(1, min(portgroup_count, vm_count))
+    vcenter, rows = build_vcenter(vm_count, portgroup_count, nics_per_vm, behaviour, hosts=hosts)
+    metrics = RunMetrics()
+    vc = VCenter(f"{vm_count}.benchmark.invalid", 'benchmark', None, connect=vcenter.service_instance,
+                 metrics=metrics, max_in_flight=max_in_flight, retries=retries, retry_delay=0,
+                 max_per_host=max_per_host)
+
+    tracemalloc.start()
+    started = time.monotonic()
+    try:
+        try:
+            # The listing streams from vCenter before the inventory is loaded
+            with metrics.phase('listing'):
+                listed = sum(1 for row in rows for _ in vc.port_group_nics(row.source_port_group, row.vds))
+            validation = vc.check_plan(rows, direct)
+            if not validation.ok:
+                raise ValueError("; ".join(validation.errors))
+            if interactive:
+                rows_failed = 0
+                for row in rows:
+                    try:
+                        converted = _interactive_conversion(vc, row, direct)
+                    except (PlanError,) + TASK_FAULTS:
+                        converted = False
+                    rows_failed += not converted
+            else:
+                results = vc.convert(rows, direct, max_parallel=max_parallel,
+                                     max_parallel_per_vds=max_parallel_per_vds)
+                rows_failed = sum(1 for result in results if not result.ok)
+            vc.inventory.refresh()
+            nics_left = _converted(vcenter, vc.inventory, rows)
+        finally:
+            vc.close()
+        duration = time.monotonic() - started
+        _, peak_memory = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    report = metrics.report()
+    calls = dict(sorted(vcenter.calls.items()))
+    return {
+        'vms': vm_count,
+        'portgroups': portgroup_count,
+        'nics_per_vm': nics_per_vm,
+        'hosts': hosts,
+        'max_per_host': max_per_host,
+        'direct': direct,
+        'interactive': interactive,
+        'duration': round(duration, 3),
+        'nics_listed': listed,
+        'rows_failed': rows_failed,
+        'nics_left': nics_left,
+        'api_calls': calls,
+        'total_api_calls': vcenter.total_calls,
+        'api_calls_per_vm': round(vcenter.total_calls / vm_count, 2),
+        'peak_memory_mb': round(peak_memory / 1e6, 2),
+        'host_peak': max(vcenter.host_peak.values(), default=0),
+        'phases': report['phases'],
+        'vm_outage': {name: value for name, value in report['vm_outage'].items() if name != 'per_vm'},
+    }
+
+
+def run_fleet_benchmark(vm_count, vcenter_count, unreachable=0, portgroup_count=10, nics_per_vm=1, latency=0.0,
+                        task_duration=0.0, failure_rate=0.0, direct=False, max_parallel=4, max_in_flight=8, retries=3,
+                        seed=0, hosts=4, host_capacity=0, max_per_host=DEFAULT_MAX_PER_HOST):
+    # vm_count VMs on each of vcenter_count simulated vCenters, the last
+    # unreachable of them refuse the login
+    portgroup_count = max(1, min(portgroup_count, vm_count))
+    vcenters = {}
+    endpoints = []
+    for i in range(vcenter_count):
+        behaviour = FakeBehaviour(latency=latency, task_duration=task_duration, failure_rate=failure_rate,
+                                  seed=seed + i, host_capacity=host_capacity)
+        name = f"vc-{i:02d}"
+        vcenters[name], rows = build_vcenter(vm_count, portgroup_count, nics_per_vm, behaviour, hosts=hosts)
+        endpoints.append(Endpoint(name=name, host=f"{name}.invalid", user='benchmark', rows=rows,
+                                  direct_cutover=direct, max_parallel=max_parallel, max_in_flight=max_in_flight,
+                                  max_per_host=max_per_host))
+    down = {endpoint.name for endpoint in endpoints[vcenter_count - unreachable:]} if unreachable else set()
+
+    def connect(endpoint):
+        if endpoint.name in down:
+            raise ConnectionRefusedError(f"{endpoint.host} refused the connection")
+        return vcenters[endpoint.name].service_instance()
+
+    tracemalloc.start()
+    started = time.monotonic()
+    try:
+        results = run_fleet(endpoints, connect=connect, retries=retries, retry_delay=0)
+        duration = time.monotonic() - started
+        _, peak_memory = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    report = fleet_report(results)
+    reachable = [result for result in results if result.endpoint.name not in down]
+    nics_left = 0
+    for result in reachable:
+        inventory = InventoryCache(vcenters[result.endpoint.name].content)
+        try:
+            nics_left += _converted(vcenters[result.endpoint.name], inventory, result.endpoint.rows)
+        finally:
+            inventory.close()
+    total_calls = sum(vcenter.total_calls for vcenter in vcenters.values())
+    return {
+        'vms': vm_count * vcenter_count,
+        'vcenters': vcenter_count,
+        'unreachable': len(down),
+        'portgroups': portgroup_count,
+        'nics_per_vm': nics_per_vm,
+        'hosts': hosts,
+        'max_per_host': max_per_host,
+        'direct': direct,
+        'duration': round(duration, 3),
+        'vcenter_durations': {v['name']: v['duration'] for v in report['vcenters']},
+        'vcenters_failed': sum(1 for result in reachable if not result.ok),
+        'rows_failed': report['totals']['port_groups_failed'],
+        'nics_left': nics_left,
+        'total_api_calls': total_calls,
+        'api_calls_per_vm': round(total_calls / (vm_count * max(1, vcenter_count - len(down))), 2),
+        'peak_memory_mb': round(peak_memory / 1e6, 2),
+        'host_peak': max((peak for vcenter in vcenters.values() for peak in vcenter.host_peak.values()), default=0),
+        'vm_outage': {'p95': max((v['report']['vm_outage']['p95'] for v in report['vcenters']), default=0.0)},
+    }
+
+
+def _sizes(value):
+    return [int(size) for size in value.split(',') if size.strip()]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the batch conversion against a simulated vCenter")
+    parser.add_argument('--sizes', type=_sizes, default=DEFAULT_SIZES, help="comma separated VM counts (default: 10,100,1000,10000)")
+    parser.add_argument('--portgroups', type=int, default=10, help="source port groups the VMs are spread over (default: 10)")
+    parser.add_argument('--nics-per-vm', type=int, default=1, help="distributed switch NICs per VM (default: 1)")
+    parser.add_argument('--latency', type=float, default=0.0, help="seconds every simulated API call takes (default: 0)")
+    parser.add_argument('--task-duration', type=float, default=0.0, help="seconds every simulated task runs (default: 0)")
+    parser.add_argument('--hosts', type=int, default=4, help="ESXi hosts the VMs run on (default: 4)")
+    parser.add_argument('--host-capacity', type=int, default=0, help="VM reconfigurations a simulated host agent works on at once, more queue, 0 for no limit (default: 0)")
+    parser.add_argument('--max-per-host', type=int, default=DEFAULT_MAX_PER_HOST, help=f"VM reconfigurations running at the same time on one host, 0 for no limit (default: {DEFAULT_MAX_PER_HOST})")
+    parser.add_argument('--failure-rate', type=float, default=0.0, help="fraction of tasks failing with a retryable fault (default: 0)")
+    parser.add_argument('--direct-cutover', action='store_true', help="benchmark the direct cutover instead of the dummy hop")
+    parser.add_argument('--interactive', action='store_true', help="convert the port groups one after another through the calls of the interactive mode instead of the --plan mode")
+    parser.add_argument('--max-parallel', type=int, default=4, help="port groups converted at the same time (default: 4)")
+    parser.add_argument('--max-in-flight', type=int, default=8, help="VM reconfiguration tasks running at the same time per port group (default: 8)")
+    parser.add_argument('--seed', type=int, default=0, help="seed of the simulated failures (default: 0)")
+    parser.add_argument('--vcenters', type=int, default=1, help="simulated vCenters converted at the same time through the fleet mode, each with every VM of a size (default: 1)")
+    parser.add_argument('--unreachable', type=int, default=0, help="with --vcenters, how many of them refuse the login (default: 0)")
+    parser.add_argument('--output', help="also write the results as JSON to this file")
+    args = parser.parse_args(argv)
+
+    print(f"{'VMs':>7} {'seconds':>9} {'API calls':>10} {'calls/VM':>9} {'peak MB':>8} {'outage p95':>11} "
+          f"{'host peak':>10} {'failed':>7}")
+    runs = []
+    for size in args.sizes:
+        if args.vcenters > 1:
+            run = run_fleet_benchmark(size, args.vcenters, min(args.unreachable, args.vcenters), args.portgroups,
+                                      args.nics_per_vm, args.latency, args.task_duration, args.failure_rate,
+                                      args.direct_cutover, args.max_parallel, args.max_in_flight, seed=args.seed,
+                                      hosts=args.hosts, host_capacity=args.host_capacity,
+                                      max_per_host=args.max_per_host)
+        else:
+            run = run_benchmark(size, args.portgroups, args.nics_per_vm, args.latency, args.task_duration,
+                                args.failure_rate, args.direct_cutover, args.max_parallel,
+                                max_in_flight=args.max_in_flight, seed=args.seed, hosts=args.hosts,
+                                host_capacity=args.host_capacity, max_per_host=args.max_per_host,
+                                interactive=args.interactive)
+        runs.append(run)
+        print(f"{run['vms']:>7} {run['duration']:>9.2f} {run['total_api_calls']:>10} {run['api_calls_per_vm']:>9.2f} "
+              f"{run['peak_memory_mb']:>8.1f} {run['vm_outage']['p95']:>11.3f} {run['host_peak']:>10} "
+              f"{run['rows_failed']:>7}")
+        if run['rows_failed'] or run['nics_left']:
+            print(f"  {run['rows_failed']} row(s) failed, {run['nics_left']} NIC(s) not converted", file=sys.stderr)
+        if run.get('vcenters_failed'):
+            print(f"  {run['vcenters_failed']} reachable vCenter(s) failed", file=sys.stderr)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'format': BENCHMARK_FORMAT, 'options': {k: v for k, v in vars(args).items() if k != 'output'},
+                       'runs': runs}, f, indent=2)
+    return 0 if all(not run['rows_failed'] and not run['nics_left'] and not run.get('vcenters_failed')
+                    for run in runs) else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,180 @@
+# Inventory snapshot that follows changes made on vCenter.
+#
+# A dedicated PropertyCollector holds a filter on every switch, portgroup and
+# VM. The first WaitForUpdatesEx call returns the full state, later calls only
+# return what changed since the last version, which is applied to the snapshot
+# in place. The workflow can then wait for a condition such as "port group X
+# has no VMs left" instead of sleeping and re-reading the inventory.
+import math
+import threading
+import time
+
+from pyVmomi import vim, vmodl
+
+from pvlan_migration.inventory import (INVENTORY_PROPERTY_SPECS, InventorySnapshot, build_filter_spec, nic_records,
+                                       retrieve_pages)
+
+# Upper bound for the object updates returned by a single WaitForUpdatesEx call
+MAX_OBJECT_UPDATES = 1000
+
+# Longest single wait in wait_until, keeps the cache responsive when several
+# threads wait on it at once
+MAX_WAIT_SLICE = 5
+
+
+class InventoryCache(InventorySnapshot):
+    def __init__(self, content):
+        super().__init__()
+        # A private collector keeps our version sequence separate from other
+        # users of the session collector, such as WaitForTask
+        self._collector = content.propertyCollector.CreatePropertyCollector()
+        self._view = content.viewManager.CreateContainerView(
+            content.rootFolder, [vimtype for vimtype, _ in INVENTORY_PROPERTY_SPECS], True)
+        self._filter = self._collector.CreateFilter(build_filter_spec(self._view, INVENTORY_PROPERTY_SPECS), False)
+        self._version = ''
+        # _refresh_lock keeps one WaitForUpdatesEx call running at a time,
+        # _lock guards the records and is only held while updates are applied
+        self._refresh_lock = threading.Lock()
+        self._lock = threading.RLock()
+        self.refresh()
+
+    def _wait_for_updates(self, max_wait):
+        options = vmodl.query.PropertyCollector.WaitOptions(maxWaitSeconds=max_wait,
+                                                            maxObjectUpdates=MAX_OBJECT_UPDATES)
+        return self._collector.WaitForUpdatesEx(self._version, options)
+
+    def refresh(self, max_wait=0):
+        # Apply all pending changes, waiting up to max_wait seconds for the
+        # first one. Returns True if anything changed.
+        with self._refresh_lock:
+            update_set = self._wait_for_updates(max_wait)
+            changed = False
+            while update_set is not None:
+                with self._lock:
+                    self._apply(update_set)
+                changed = True
+                if not update_set.truncated:
+                    break
+                update_set = self._wait_for_updates(0)
+            return changed
+
+    def _apply(self, update_set):
+        self._version = update_set.version
+        for filter_update in update_set.filterSet or []:
+            for object_update in filter_update.objectSet or []:
+                if object_update.kind == 'leave':
+                    self.remove_object(object_update.obj)
+                    continue
+                props = {}
+                for change in object_update.changeSet or []:
+                    if change.op in ('remove', 'indirectRemove'):
+                        props[change.name] = None
+                    else:
+                        props[change.name] = change.val
+                self.update_object(object_update.obj, props)
+
+    def wait_until(self, condition, timeout):
+        # Block until condition(self) is true or timeout seconds have passed.
+        # Returns the final value of the condition.
+        deadline = time.monotonic() + timeout
+        self.refresh()
+        while not condition(self):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            self.refresh(max_wait=max(1, min(MAX_WAIT_SLICE, math.ceil(remaining))))
+        return True
+
+    def wait_for_empty_portgroup(self, vds_name, port_group_name, timeout):
+        def is_empty(inventory):
+            pg = inventory.portgroup(vds_name, port_group_name)
+            return pg is None or not pg.vm_refs
+        return self.wait_until(is_empty, timeout)
+
+    def current_nics(self, vm_refs):
+        # Read in one retrieval instead of from the change feed, which may not
+        # have delivered the latest reconfigurations yet. VMs that are gone
+        # are left out.
+        refs = list(vm_refs)
+        prop_spec = vmodl.query.PropertyCollector.PropertySpec(type=vim.VirtualMachine,
+                                                               pathSet=['config.hardware.device'], all=False)
+        while refs:
+            filter_spec = vmodl.query.PropertyCollector.FilterSpec(
+                objectSet=[vmodl.query.PropertyCollector.ObjectSpec(obj=ref, skip=False) for ref in refs],
+                propSet=[prop_spec])
+            try:
+                return {obj._moId: nic_records(obj._moId, props.get('config.hardware.device'))
+                        for obj, props in retrieve_pages(self._collector, filter_spec)}
+            except vmodl.fault.ManagedObjectNotFound as e:
+                missing = getattr(e.obj, '_moId', None)
+                if missing is None:
+                    raise
+                refs = [ref for ref in refs if ref._moId != missing]
+        return {}
+
+    # Parallel rows share the cache, and one row's refresh applies updates
+    # while another row reads. The readers take the lock too and hand out
+    # copies, so nothing a caller iterates changes under it.
+
+    def objects(self):
+        with self._lock:
+            return list(super().objects())
+
+    def switch(self, name):
+        with self._lock:
+            return super().switch(name)
+
+    def switch_names(self):
+        with self._lock:
+            return super().switch_names()
+
+    def portgroup(self, vds_name, name):
+        with self._lock:
+            return super().portgroup(vds_name, name)
+
+    def portgroup_by_key(self, key):
+        with self._lock:
+            return super().portgroup_by_key(key)
+
+    def find_portgroup(self, name):
+        with self._lock:
+            return super().find_portgroup(name)
+
+    def portgroup_names(self, vds_name):
+        with self._lock:
+            return super().portgroup_names(vds_name)
+
+    def vm(self, ref):
+        with self._lock:
+            return super().vm(ref)
+
+    def nics_on_portgroup(self, key):
+        with self._lock:
+            return {moid: list(nics) for moid, nics in super().nics_on_portgroup(key).items()}
+
+    def vms_with_nics_on(self, key):
+        with self._lock:
+            return super().vms_with_nics_on(key)
+
+    def vms_on_portgroup(self, key):
+        with self._lock:
+            return super().vms_on_portgroup(key)
+
+    def discard_portgroup(self, key):
+        with self._lock:
+            super().discard_portgroup(key)
+
+    def record_reconfiguration(self, vm_ref, spec):
+        with self._lock:
+            super().record_reconfiguration(vm_ref, spec)
+
+    def close(self):
+        for destroy in (self._filter.Destroy, self._view.Destroy, self._collector.Destroy):
+            try:
+                destroy()
+            except vmodl.MethodFault:
+                pass
+
+
+def start_inventory_cache(content):
+    return InventoryCache(content)
@@ -0,0 +1,582 @@
+# Local stand-ins for the parts of the vSphere API the migration drives.
+#
+# Objects here behave like their pyVmomi counterparts as far as the workflow
+# can tell: calls take time to return, tasks move from queued to running to a
+# final state and some of them fail. Nothing talks to a vCenter.
+#
+# FakeVCenter goes one step further and holds a whole networking inventory.
+# Real pyVmomi managed objects are bound to its FakeStub, so the inventory
+# cache, the batch runner and everything below them run unchanged against it.
+import copy
+import datetime
+import random
+import threading
+import time
+from collections import OrderedDict
+
+from pyVmomi import VmomiSupport, vim, vmodl
+
+
+class FakeTaskInfo:
+    def __init__(self, state, result=None, error=None):
+        self.state = state
+        self.result = result
+        self.error = error
+
+
+class FakeTask:
+    def __init__(self, duration=0.0, error=None, result=None, on_success=None, on_poll=None):
+        self._created = time.monotonic()
+        self._on_poll = on_poll
+        self._duration = duration
+        self._error = error
+        self._result = result
+        self._on_success = on_success
+        self._done = False
+        self._lock = threading.Lock()
+
+    @property
+    def info(self):
+        if self._on_poll is not None:
+            self._on_poll()
+        elapsed = time.monotonic() - self._created
+        if elapsed < self._duration:
+            return FakeTaskInfo('running')
+        with self._lock:
+            if not self._done and self._error is None:
+                self._done = True
+                if self._on_success is not None:
+                    try:
+                        self._on_success()
+                    except vmodl.MethodFault as e:
+                        # The change no longer applies by the time the task runs
+                        self._error = e
+        if self._error is not None:
+            return FakeTaskInfo('error', error=self._error)
+        return FakeTaskInfo('success', result=self._result)
+
+
+class FakeBehaviour:
+    # Shared knobs for how slow and how unreliable the fake vCenter is.
+    # latency is the time each API call blocks the caller, task_duration the
+    # time a task stays running and failure_rate the share of tasks that end in
+    # error. host_capacity is the number of VM reconfigurations a host agent
+    # works on at once, later ones queue behind them. 0 means no limit.
+    # link_loss_rate is the share of moved NICs that come back disconnected.
+    def __init__(self, latency=0.0, task_duration=0.0, failure_rate=0.0, seed=None, fault=None, host_capacity=0,
+                 link_loss_rate=0.0):
+        self.latency = latency
+        self.task_duration = task_duration
+        self.failure_rate = failure_rate
+        self.host_capacity = host_capacity
+        self.link_loss_rate = link_loss_rate
+        self.fault = fault or (lambda: vim.fault.ConcurrentAccess(msg="Simulated concurrent modification"))
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def call(self):
+        if self.latency:
+            time.sleep(self.latency)
+
+    def link_lost(self):
+        with self._lock:
+            return self.link_loss_rate > 0 and self._rng.random() < self.link_loss_rate
+
+    def task(self, result=None, on_success=None, error=None, on_poll=None, duration=None):
+        # error forces the task to fail with that fault
+        with self._lock:
+            failed = self._rng.random() < self.failure_rate
+        if error is None and failed:
+            error = self.fault()
+        return FakeTask(duration=self.task_duration if duration is None else duration, error=error, result=result,
+                        on_success=on_success, on_poll=on_poll)
+
+
+class FakeVirtualMachine:
+    def __init__(self, name, behaviour=None, moid=None):
+        self._moId = moid or f"vm-{name}"
+        self.name = name
+        self.behaviour = behaviour or FakeBehaviour()
+        self.reconfigured = []
+
+    def ReconfigVM_Task(self, spec):
+        self.behaviour.call()
+        return self.behaviour.task(on_success=lambda: self.reconfigured.append(spec))
+
+
+class _Namespace:
+    def __init__(self, **fields):
+        self.__dict__.update(fields)
+
+
+class FakeStub:
+    # Routes method calls and property reads of managed objects to the
+    # FakeVCenter they belong to. A SessionPool can hand it out like a
+    # SoapStubAdapter: called for an outer stub it returns (status, result)
+    # and property reads arrive as Fetch calls.
+    version = VmomiSupport.newestVersions.GetName('vim')
+    cookie = None
+
+    def __init__(self, vcenter):
+        self.vcenter = vcenter
+
+    def InvokeMethod(self, mo, info, args, outerStub=None):
+        if outerStub is None or outerStub is self:
+            return self._invoke(mo, info, args)
+        try:
+            return 200, self._invoke(mo, info, args)
+        except vmodl.MethodFault as e:
+            return 500, e
+
+    def _invoke(self, mo, info, args):
+        if info.wsdlName == 'Fetch':
+            return self.vcenter.read(mo, args[0])
+        return self.vcenter.invoke(mo, info.wsdlName, args)
+
+    def DropConnections(self):
+        pass
+
+    def InvokeAccessor(self, mo, info):
+        return self.vcenter.read(mo, info.name)
+
+
+class FakeVCenter:
+    # Switches, port groups and VMs with the properties the inventory cache
+    # collects. Every change bumps a version so WaitForUpdatesEx can hand out
+    # what changed since the caller's version. calls counts API calls per
+    # method, property reads and task polls included, host_peak the most VM
+    # reconfigurations outstanding on each host at once.
+    def __init__(self, behaviour=None):
+        self.behaviour = behaviour or FakeBehaviour()
+        self.stub = FakeStub(self)
+        self.calls = {}
+        self._objects = {}
+        self._props = {}
+        self._vm_portgroups = {}
+        self._portgroup_vms = {}
+        self._switch_portgroups = {}
+        # host moid -> end times of the VM reconfigurations started on it
+        self._host_tasks = {}
+        self.host_peak = {}
+        self._version = 0
+        # moid -> (version, kind) ordered by version
+        self._changes = OrderedDict()
+        self._next_id = 0
+        # view moid -> (container, types), retrieval token -> (objects still
+        # to hand out, page size)
+        self._views = {}
+        self._retrievals = {}
+        self._changed = threading.Condition(threading.RLock())
+        self.content = vim.ServiceInstanceContent(
+            rootFolder=vim.Folder('group-d1', self.stub),
+            propertyCollector=vmodl.query.PropertyCollector('propertyCollector', self.stub),
+            viewManager=vim.view.ViewManager('ViewManager', self.stub),
+            sessionManager=vim.SessionManager('SessionManager', self.stub),
+            customFieldsManager=vim.CustomFieldsManager('CustomFieldsManager', self.stub))
+        self._props['CustomFieldsManager'] = {'field': []}
+
+    def service_instance(self):
+        return vim.ServiceInstance('ServiceInstance', self.stub)
+
+    @property
+    def total_calls(self):
+        return sum(self.calls.values())
+
+    def _count(self, method):
+        with self._changed:
+            self.calls[method] = self.calls.get(method, 0) + 1
+        self.behaviour.call()
+
+    def _moid(self, prefix):
+        with self._changed:
+            self._next_id += 1
+            return f"{prefix}-{self._next_id}"
+
+    def _touch(self, moid, kind='modify'):
+        # Called with the lock held
+        self._version += 1
+        self._changes.pop(moid, None)
+        self._changes[moid] = (self._version, kind)
+        self._changed.notify_all()
+
+    # Building the inventory
+
+    def add_switch(self, name):
+        with self._changed:
+            moid = self._moid('dvs')
+            ref = vim.dvs.VmwareDistributedVirtualSwitch(moid, self.stub)
+            uuid = f"50 00 00 00 00 00 00 00-00 00 00 00 00 00 {self._next_id:02x} 00"
+            config = vim.dvs.VmwareDistributedVirtualSwitch.ConfigInfo(name=name, uuid=uuid, configVersion='1',
+                                                                      pvlanConfig=[])
+            self._objects[moid] = ref
+            self._props[moid] = {'name': name, 'uuid': uuid, 'config': config}
+            self._switch_portgroups[moid] = set()
+            self._touch(moid, 'enter')
+            return ref
+
+    def _portgroup_config(self, switch, key, spec):
+        return vim.dvs.DistributedVirtualPortgroup.ConfigInfo(
+            key=key, name=spec.name, type=spec.type or 'earlyBinding', numPorts=spec.numPorts or 8,
+            autoExpand=spec.autoExpand, description=spec.description, defaultPortConfig=spec.defaultPortConfig,
+            policy=spec.policy or vim.dvs.VmwareDistributedVirtualSwitch.VMwarePortgroupPolicy(),
+            portNameFormat=spec.portNameFormat, distributedVirtualSwitch=switch,
+            configVersion='1')
+
+    def add_portgroup(self, switch, spec):
+        with self._changed:
+            moid = self._moid('dvportgroup')
+            ref = vim.dvs.DistributedVirtualPortgroup(moid, self.stub)
+            self._objects[moid] = ref
+            self._props[moid] = {'name': spec.name, 'key': moid, 'vm': [],
+                                 'config': self._portgroup_config(switch, moid, spec)}
+            self._switch_portgroups[switch._moId].add(moid)
+            self._portgroup_vms[moid] = set()
+            self._touch(moid, 'enter')
+            return ref
+
+    def add_host(self, name):
+        with self._changed:
+            moid = self._moid('host')
+            ref = vim.HostSystem(moid, self.stub)
+            self._objects[moid] = ref
+            self._props[moid] = {'name': name}
+            self._host_tasks[moid] = []
+            return ref
+
+    def add_custom_field(self, name):
+        with self._changed:
+            fields = self._props['CustomFieldsManager']['field']
+            key = len(fields) + 100
+            fields.append(vim.CustomFieldsManager.FieldDef(key=key, name=name, type=str,
+                                                           managedObjectType=vim.VirtualMachine))
+            return key
+
+    def add_folder(self, name):
+        with self._changed:
+            moid = self._moid('group-v')
+            ref = vim.Folder(moid, self.stub)
+            self._objects[moid] = ref
+            self._props[moid] = {'name': name}
+            return ref
+
+    def add_vm(self, name, nics, host=None, attributes=None, folder=None):
+        # nics is a list of (switch ref, port group ref) pairs, a None switch
+        # puts the NIC on a standard switch. attributes maps custom field keys
+        # to values.
+        with self._changed:
+            moid = self._moid('vm')
+            ref = vim.VirtualMachine(moid, self.stub)
+            devices = []
+            for i, (switch, portgroup) in enumerate(nics):
+                nic = vim.vm.device.VirtualVmxnet3(
+                    key=4000 + i, deviceInfo=vim.Description(label=f"Network adapter {i + 1}", summary=''),
+                    macAddress=f"00:50:56:{self._next_id >> 8 & 0xff:02x}:{self._next_id & 0xff:02x}:{i:02x}",
+                    connectable=vim.vm.device.VirtualDevice.ConnectInfo(connected=True, startConnected=True))
+                if switch is None:
+                    nic.backing = vim.vm.device.VirtualEthernetCard.NetworkBackingInfo(deviceName='VM Network')
+                else:
+                    nic.backing = vim.vm.device.VirtualEthernetCard.DistributedVirtualPortBackingInfo(
+                        port=vim.dvs.PortConnection(switchUuid=self._props[switch._moId]['uuid'],
+                                                    portgroupKey=portgroup._moId))
+                devices.append(nic)
+            self._objects[moid] = ref
+            self._props[moid] = {'name': name, 'config.hardware.device': devices, 'runtime.host': host,
+                                 'parent': folder or self.content.rootFolder,
+                                 'customValue': [vim.CustomFieldsManager.StringValue(key=key, value=str(value))
+                                                 for key, value in (attributes or {}).items()]}
+            self._touch(moid, 'enter')
+            self._update_membership(moid)
+            return ref
+
+    def _update_membership(self, vm_moid):
+        keys = set()
+        for device in self._props[vm_moid]['config.hardware.device']:
+            port = getattr(device.backing, 'port', None)
+            if port is not None:
+                keys.add(port.portgroupKey)
+        old = self._vm_portgroups.get(vm_moid, set())
+        for key in old ^ keys:
+            members = self._portgroup_vms.get(key)
+            if members is None:
+                continue
+            if key in keys:
+                members.add(vm_moid)
+            else:
+                members.discard(vm_moid)
+            self._props[key]['vm'] = [self._objects[m] for m in members]
+            self._touch(key)
+        self._vm_portgroups[vm_moid] = keys
+
+    def portgroup_names(self, switch):
+        with self._changed:
+            return sorted(self._props[key]['name'] for key in self._switch_portgroups[switch._moId])
+
+    def vm_portgroups(self, vm):
+        with self._changed:
+            return set(self._vm_portgroups.get(vm._moId, ()))
+
+    # API
+
+    def read(self, mo, name):
+        self._count(f"read {name}")
+        if name == 'content':
+            return self.content
+        with self._changed:
+            props = self._props.get(mo._moId)
+            if props is None:
+                raise vmodl.fault.ManagedObjectNotFound(obj=mo)
+            if name == 'config' and 'config.hardware.device' in props:
+                return vim.vm.ConfigInfo(hardware=vim.vm.VirtualHardware(device=props['config.hardware.device']))
+            return props.get(name)
+
+    def invoke(self, mo, method, args):
+        self._count(method)
+        handler = getattr(self, f"_call_{method}", None)
+        if handler is None:
+            raise vmodl.fault.NotSupported(msg=f"{method} is not simulated")
+        return handler(mo, *args)
+
+    def _task(self, apply, error=None, duration=None):
+        def on_success():
+            with self._changed:
+                apply()
+        return self.behaviour.task(on_success=on_success, error=error, on_poll=lambda: self._count('read info'),
+                                   duration=duration)
+
+    def _host_task_duration(self, host):
+        # Called with the lock held, books a reconfiguration on host
+        if host is None:
+            return None
+        now = time.monotonic()
+        booked = sorted(end for end in self._host_tasks[host._moId] if end > now)
+        self.host_peak[host._moId] = max(self.host_peak.get(host._moId, 0), len(booked) + 1)
+        # Tasks are booked in order, so the agent frees up a slot when the
+        # last capacity-th of them ends
+        capacity = self.behaviour.host_capacity
+        start = booked[-capacity] if capacity and len(booked) >= capacity else now
+        booked.append(start + self.behaviour.task_duration)
+        self._host_tasks[host._moId] = booked
+        return booked[-1] - now
+
+    def _call_CurrentTime(self, mo):
+        return datetime.datetime.now(datetime.timezone.utc)
+
+    def _call_Logout(self, mo):
+        return None
+
+    def _call_CreatePropertyCollector(self, mo):
+        return vmodl.query.PropertyCollector(self._moid('session[fake]collector'), self.stub)
+
+    def _call_CreateContainerView(self, mo, container, types, recursive):
+        view = vim.view.ContainerView(self._moid('session[fake]view'), self.stub)
+        self._views[view._moId] = (container, tuple(types))
+        return view
+
+    def _in_container(self, container, moid):
+        # Folders hold their VMs, hosts the VMs running on them, the root
+        # folder everything
+        if container._moId == self.content.rootFolder._moId:
+            return True
+        props = self._props[moid]
+        for name in ('parent', 'runtime.host'):
+            if getattr(props.get(name), '_moId', None) == container._moId:
+                return True
+        return False
+
+    def _selected(self, spec):
+        # Objects a filter spec reaches: the members of a container view or
+        # the objects a traversal from the starting object leads to
+        for object_spec in spec.objectSet:
+            obj = object_spec.obj
+            if isinstance(obj, vim.view.ContainerView):
+                container, types = self._views[obj._moId]
+                for moid, ref in list(self._objects.items()):
+                    if isinstance(ref, types) and moid in self._props and self._in_container(container, moid):
+                        yield ref
+                continue
+            if obj._moId not in self._props:
+                raise vmodl.fault.ManagedObjectNotFound(obj=obj)
+            if not object_spec.skip:
+                yield obj
+            for traversal in object_spec.selectSet or []:
+                yield from self._props[obj._moId].get(traversal.path) or []
+
+    def _property(self, moid, path):
+        props = self._props[moid]
+        if path in props:
+            return props[path]
+        head, _, rest = path.partition('.')
+        value = props.get(head)
+        for name in rest.split('.') if rest else []:
+            value = getattr(value, name, None)
+        return value
+
+    def _call_RetrievePropertiesEx(self, mo, spec_set, options):
+        with self._changed:
+            objects = []
+            for spec in spec_set:
+                for ref in self._selected(spec):
+                    paths = [path for prop_spec in spec.propSet if isinstance(ref, prop_spec.type)
+                             for path in prop_spec.pathSet]
+                    if not paths:
+                        continue
+                    values = [(path, self._property(ref._moId, path)) for path in paths]
+                    objects.append(_Namespace(obj=ref, propSet=[_Namespace(name=path, val=value)
+                                                                for path, value in values if value is not None]))
+            return self._page(objects, getattr(options, 'maxObjects', None))
+
+    def _page(self, objects, page_size):
+        token = None
+        if page_size and len(objects) > page_size:
+            token = self._moid('token')
+            self._retrievals[token] = (objects[page_size:], page_size)
+            objects = objects[:page_size]
+        return _Namespace(objects=objects, token=token)
+
+    def _call_ContinueRetrievePropertiesEx(self, mo, token):
+        with self._changed:
+            if token not in self._retrievals:
+                raise vmodl.fault.InvalidArgument(invalidProperty='token')
+            return self._page(*self._retrievals.pop(token))
+
+    def _call_CancelRetrievePropertiesEx(self, mo, token):
+        with self._changed:
+            self._retrievals.pop(token, None)
+
+    def _call_CreateFilter(self, mo, spec, partial_updates):
+        return vmodl.query.PropertyCollector.Filter(self._moid('session[fake]filter'), self.stub)
+
+    def _call_DestroyPropertyCollector(self, mo):
+        return None
+
+    def _call_DestroyView(self, mo):
+        return None
+
+    def _call_DestroyPropertyFilter(self, mo):
+        return None
+
+    def _call_WaitForUpdatesEx(self, mo, version, options):
+        since = int(version or 0)
+        max_wait = getattr(options, 'maxWaitSeconds', None)
+        max_updates = getattr(options, 'maxObjectUpdates', None) or len(self._changes) or 1
+        with self._changed:
+            if self._version <= since and max_wait:
+                self._changed.wait(max_wait)
+            if self._version <= since:
+                return None
+            pending = []
+            for moid, (changed, kind) in reversed(self._changes.items()):
+                if changed <= since:
+                    break
+                pending.append((changed, moid, kind))
+            pending.reverse()
+            truncated = len(pending) > max_updates
+            pending = pending[:max_updates]
+            object_set = []
+            for changed, moid, kind in pending:
+                if kind == 'leave':
+                    object_set.append(_Namespace(kind='leave', obj=self._objects.pop(moid), changeSet=[]))
+                    self._changes.pop(moid, None)
+                    continue
+                change_set = [_Namespace(name=name, op='assign', val=value)
+                              for name, value in self._props[moid].items()]
+                # A new object only counts as entered once
+                object_set.append(_Namespace(kind='enter' if since == 0 or kind == 'enter' else 'modify',
+                                             obj=self._objects[moid], changeSet=change_set))
+            return _Namespace(version=str(pending[-1][0]), truncated=truncated,
+                              filterSet=[_Namespace(objectSet=object_set)])
+
+    def _call_ReconfigVM_Task(self, mo, spec):
+        with self._changed:
+            if mo._moId not in self._props:
+                return self._task(None, vmodl.fault.ManagedObjectNotFound(obj=mo))
+            duration = self._host_task_duration(self._props[mo._moId]['runtime.host'])
+
+        def apply():
+            devices = {d.key: d for d in self._props[mo._moId]['config.hardware.device']}
+            for change in spec.deviceChange or []:
+                if change.device.key in devices:
+                    device = change.device
+                    if self.behaviour.link_lost():
+                        device = copy.copy(device)
+                        device.connectable = vim.vm.device.VirtualDevice.ConnectInfo(connected=False,
+                                                                                     startConnected=True)
+                    devices[change.device.key] = device
+            self._props[mo._moId]['config.hardware.device'] = list(devices.values())
+            self._touch(mo._moId)
+            self._update_membership(mo._moId)
+        return self._task(apply, duration=duration)
+
+    def _call_AddDVPortgroup_Task(self, mo, specs):
+        with self._changed:
+            existing = {self._props[key]['name'] for key in self._switch_portgroups[mo._moId]}
+            duplicate = next((spec.name for spec in specs if spec.name in existing), None)
+        if duplicate is not None:
+            return self._task(None, vim.fault.DuplicateName(name=duplicate, msg=f"{duplicate} already exists"))
+        return self._task(lambda: [self.add_portgroup(mo, spec) for spec in specs])
+
+    def _call_Destroy_Task(self, mo):
+        with self._changed:
+            if self._portgroup_vms.get(mo._moId):
+                return self._task(None, vim.fault.ResourceInUse(msg=f"{mo._moId} is in use"))
+
+        def apply():
+            for portgroups in self._switch_portgroups.values():
+                portgroups.discard(mo._moId)
+            self._portgroup_vms.pop(mo._moId, None)
+            self._props.pop(mo._moId, None)
+            self._touch(mo._moId, 'leave')
+        return self._task(apply)
+
+    def _check_config_version(self, mo, spec):
+        # Called with the lock held, vCenter compares the version again when
+        # the task runs, another change may have been applied in between
+        config = self._props[mo._moId]['config']
+        if spec.configVersion != config.configVersion:
+            raise vim.fault.ConcurrentAccess(msg="configVersion is stale")
+        return config
+
+    def _call_ReconfigureDvs_Task(self, mo, spec):
+        with self._changed:
+            try:
+                self._check_config_version(mo, spec)
+            except vim.fault.ConcurrentAccess as e:
+                return self._task(None, e)
+
+        def apply():
+            config = self._check_config_version(mo, spec)
+            entries = list(config.pvlanConfig)
+            for pvlan_spec in spec.pvlanConfigSpec or []:
+                entry = pvlan_spec.pvlanEntry
+                same = [e for e in entries if (e.primaryVlanId, e.secondaryVlanId, e.pvlanType) ==
+                        (entry.primaryVlanId, entry.secondaryVlanId, entry.pvlanType)]
+                if pvlan_spec.operation == 'add' and not same:
+                    entries.append(entry)
+                elif pvlan_spec.operation == 'remove':
+                    entries = [e for e in entries if e not in same]
+            new_config = vim.dvs.VmwareDistributedVirtualSwitch.ConfigInfo(
+                name=config.name, uuid=config.uuid, pvlanConfig=entries,
+                configVersion=str(int(config.configVersion) + 1))
+            self._props[mo._moId]['config'] = new_config
+            self._touch(mo._moId)
+        return self._task(apply)
+
+    def _call_ReconfigureDVPortgroup_Task(self, mo, spec):
+        with self._changed:
+            try:
+                self._check_config_version(mo, spec)
+            except vim.fault.ConcurrentAccess as e:
+                return self._task(None, e)
+
+        def apply():
+            config = self._check_config_version(mo, spec)
+            props = self._props[mo._moId]
+            if spec.name:
+                props['name'] = spec.name
+            # Everything the spec leaves unset stays as it was
+            new_config = copy.copy(config)
+            new_config.name = props['name']
+            new_config.configVersion = str(int(config.configVersion) + 1)
+            props['config'] = new_config
+            self._touch(mo._moId)
+        return self._task(apply)
@@ -0,0 +1,289 @@
+# Conversion across several vCenters at once.
+#
+# A fleet file lists vCenter endpoints, each with the plan for its port
+# groups. Every endpoint gets its own VCenter, so its own login, session pool,
+# inventory cache, task limits and retry throttle, and runs in its own thread:
+# discovery, validation, then the dry run or the conversion. A vCenter that
+# cannot be reached, whose plan does not fit its inventory or whose tasks
+# fail is recorded in its result and the others carry on. The results are
+# merged into one report.
+#
+#   vcenters:
+#     - name: dc1
+#       host: vc1.example.com
+#       user: administrator@vsphere.local
+#       password_env: VC1_PASSWORD
+#       plan: dc1-plan.yaml
+import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import List, Optional
+
+from pvlan_migration.api import MAX_IN_FLIGHT, RETRIES, RETRY_DELAY, PlanInvalid, VCenter
+from pvlan_migration.metrics import RunMetrics
+from pvlan_migration.plan import PlanError, load_plan, parse_plan, read_records
+from pvlan_migration.retry import Throttle
+from pvlan_migration.schedule import DEFAULT_MAX_PER_HOST
+from pvlan_migration.tasks import fault_message
+
+FLEET_REPORT_FORMAT = 1
+
+FLEET_COLUMNS = ['name', 'host', 'user', 'password_env', 'insecure', 'plan', 'conversions', 'direct_cutover',
+                 'sessions', 'max_parallel', 'max_parallel_per_vds', 'max_in_flight', 'max_per_host',
+                 'priority_attribute']
+REQUIRED_FLEET_COLUMNS = ['host', 'user']
+
+DEFAULT_PASSWORD_ENV = 'VCENTER_PASSWORD'
+
+# vCenters worked on at the same time
+MAX_PARALLEL_VCENTERS = 8
+
+# Endpoint names become part of the journal file names, so they are limited
+# to characters that cannot leave the journal directory
+ENDPOINT_NAME = re.compile(r'[A-Za-z0-9_-][A-Za-z0-9._-]*')
+
+
+@dataclass
+class Endpoint:
+    name: str
+    host: str
+    user: str
+    rows: List
+    password_env: str = DEFAULT_PASSWORD_ENV
+    password: Optional[str] = field(default=None, repr=False)
+    insecure: bool = False
+    direct_cutover: bool = False
+    sessions: int = 4
+    max_parallel: int = 4
+    max_parallel_per_vds: int = 2
+    max_in_flight: int = MAX_IN_FLIGHT
+    max_per_host: int = DEFAULT_MAX_PER_HOST
+    priority_attribute: Optional[str] = None
+
+
+@dataclass
+class EndpointResult:
+    endpoint: Endpoint
+    ok: bool = False
+    # Last step started: connect, discovery, validation, dry run or convert
+    step: str = ''
+    error: Optional[str] = None
+    errors: List[str] = field(default_factory=list)
+    warnings: List[str] = field(default_factory=list)
+    results: List = field(default_factory=list)
+    plan: Optional[dict] = None
+    journal_path: Optional[str] = None
+    duration: float = 0.0
+    report: Optional[dict] = None
+
+
+def _parse_bool(value, column, name):
+    if value is None or value == '':
+        return False
+    if isinstance(value, bool):
+        return value
+    text = str(value).strip().lower()
+    if text in ('yes', 'true', '1'):
+        return True
+    if text in ('no', 'false', '0'):
+        return False
+    raise PlanError(f"vCenter {name}: {column} must be yes or no, got {value!r}")
+
+
+def _parse_count(value, column, name, default):
+    if value is None or str(value).strip() == '':
+        return default
+    try:
+        return int(str(value).strip())
+    except ValueError:
+        raise PlanError(f"vCenter {name}: {column} must be a number, got {value!r}")
+
+
+def _file_name_part(text):
+    # text with the characters an endpoint name may not use replaced
+    return re.sub(r'[^A-Za-z0-9._-]', '_', text).lstrip('.') or '_'
+
+
+def load_fleet(path):
+    # Endpoints of a YAML or JSON fleet file. Plan paths are relative to the
+    # fleet file, passwords are read from the environment variable named by
+    # password_env and left None when it is not set. Endpoints without a name
+    # are named after their host.
+    base = os.path.dirname(os.path.abspath(path))
+    endpoints = []
+    for number, record in enumerate(read_records(path, 'vcenters'), start=1):
+        if not isinstance(record, dict):
+            raise PlanError(f"vCenter {number}: expected a mapping of setting to value")
+        record = {str(k).strip(): v for k, v in record.items() if k is not None}
+        name = str(record.get('name') or '').strip()
+        if not name:
+            name = _file_name_part(str(record.get('host') or '').strip() or str(number))
+        elif not ENDPOINT_NAME.fullmatch(name):
+            raise PlanError(f"vCenter name {name!r} may only contain letters, digits, '.', '_' and '-' and must not "
+                            f"start with '.'")
+        unknown = set(record) - set(FLEET_COLUMNS)
+        if unknown:
+            raise PlanError(f"vCenter {name}: unknown setting(s) {', '.join(sorted(unknown))}")
+        missing = [c for c in REQUIRED_FLEET_COLUMNS if not str(record.get(c) or '').strip()]
+        if missing:
+            raise PlanError(f"vCenter {name}: missing {', '.join(missing)}")
+        if any(endpoint.name == name for endpoint in endpoints):
+            raise PlanError(f"vCenter name {name} is used more than once")
+        try:
+            if record.get('plan') and record.get('conversions') is None:
+                rows = load_plan(os.path.join(base, str(record['plan']).strip()))
+            elif isinstance(record.get('conversions'), list) and not record.get('plan'):
+                rows = parse_plan(record['conversions'])
+            else:
+                raise PlanError("needs either a plan file or a conversions list")
+        except (OSError, ValueError, PlanError) as e:
+            raise PlanError(f"vCenter {name}: {e}")
+        password_env = str(record.get('password_env') or DEFAULT_PASSWORD_ENV).strip()
+        endpoints.append(Endpoint(
+            name=name,
+            host=str(record['host']).strip(),
+            user=str(record['user']).strip(),
+            rows=rows,
+            password_env=password_env,
+            password=os.environ.get(password_env),
+            insecure=_parse_bool(record.get('insecure'), 'insecure', name),
+            direct_cutover=_parse_bool(record.get('direct_cutover'), 'direct_cutover', name),
+            sessions=_parse_count(record.get('sessions'), 'sessions', name, 4),
+            max_parallel=_parse_count(record.get('max_parallel'), 'max_parallel', name, 4),
+            max_parallel_per_vds=_parse_count(record.get('max_parallel_per_vds'), 'max_parallel_per_vds', name, 2),
+            max_in_flight=_parse_count(record.get('max_in_flight'), 'max_in_flight', name, MAX_IN_FLIGHT),
+            max_per_host=_parse_count(record.get('max_per_host'), 'max_per_host', name, DEFAULT_MAX_PER_HOST),
+            priority_attribute=str(record.get('priority_attribute') or '').strip() or None,
+        ))
+    if not endpoints:
+        raise PlanError("The fleet file lists no vCenters")
+    return endpoints
+
+
+def _run_endpoint(endpoint, dry_run, journal_path, on_event, connect, retries, retry_delay, waves):
+    result = EndpointResult(endpoint)
+    metrics = RunMetrics()
+    vc = VCenter(endpoint.host, endpoint.user, endpoint.password, verify_certificate=not endpoint.insecure,
+                 sessions=endpoint.sessions, connect=connect, metrics=metrics, max_in_flight=endpoint.max_in_flight,
+                 retries=retries, retry_delay=retry_delay, max_per_host=endpoint.max_per_host,
+                 priority_attribute=endpoint.priority_attribute, waves=waves)
+
+    def row_event(row, message, ok):
+        if on_event is not None:
+            on_event(endpoint, row, message, ok)
+
+    started = time.monotonic()
+    try:
+        result.step = 'connect'
+        vc.session_pool
+        result.step = 'discovery'
+        vc.inventory
+        result.step = 'validation'
+        validation = vc.check_plan(endpoint.rows, endpoint.direct_cutover)
+        result.warnings = validation.warnings
+        if not validation.ok:
+            result.errors = validation.errors
+            result.error = f"{len(result.errors)} plan error(s)"
+            return result
+        if dry_run:
+            result.step = 'dry run'
+            result.plan = vc.dry_run(endpoint.rows, endpoint.direct_cutover)
+            result.errors = result.plan['errors']
+            result.ok = not result.errors
+            return result
+        result.step = 'convert'
+        result.journal_path = journal_path
+        result.results = vc.convert(endpoint.rows, endpoint.direct_cutover, journal_path, on_event=row_event,
+                                    max_parallel=endpoint.max_parallel,
+                                    max_parallel_per_vds=endpoint.max_parallel_per_vds, throttle=Throttle())
+        failed = [r for r in result.results if not r.ok]
+        if failed:
+            result.error = f"{len(failed)} of {len(result.results)} port group(s) failed"
+        result.ok = not failed
+    except PlanInvalid as e:
+        result.errors = e.errors
+        result.error = f"{len(result.errors)} plan error(s)"
+    except Exception as e:
+        # Whatever goes wrong with one vCenter stays with it
+        result.error = fault_message(e)
+    finally:
+        result.duration = time.monotonic() - started
+        result.report = metrics.report({'session_pool': vc.session_pool.stats.as_dict()} if vc.connected else None)
+        vc.close()
+    return result
+
+
+def run_fleet(endpoints, dry_run=False, journal_prefix=None, on_event=None, on_done=None, connect=None,
+              max_parallel=MAX_PARALLEL_VCENTERS, retries=RETRIES, retry_delay=RETRY_DELAY, waves=None):
+    # EndpointResult of every endpoint, in their order. Each converting
+    # endpoint journals to <journal_prefix>-<name>.journal, characters a name
+    # from load_fleet cannot hold are replaced. on_event(endpoint, row,
+    # message, ok) reports the steps of every row, on_done(result) each
+    # endpoint as soon as it is finished, both from the worker threads.
+    # connect(endpoint) can replace the login, it returns a ServiceInstance.
+    # waves is the WavePolicy of every endpoint's VM moves.
+    lock = threading.Lock()
+
+    def run(endpoint):
+        journal_path = f"{journal_prefix}-{_file_name_part(endpoint.name)}.journal" if journal_prefix else None
+        endpoint_connect = (lambda: connect(endpoint)) if connect is not None else None
+        result = _run_endpoint(endpoint, dry_run, journal_path, on_event, endpoint_connect, retries, retry_delay,
+                               waves)
+        if on_done is not None:
+            with lock:
+                on_done(result)
+        return result
+
+    with ThreadPoolExecutor(max_workers=max(1, min(max_parallel, len(endpoints)))) as executor:
+        return list(executor.map(run, endpoints))
+
+
+def _conversion_entry(result):
+    return {
+        'port_group': result.row.label,
+        'target_port_group': result.row.target_port_group,
+        'ok': result.ok,
+        'step': result.step,
+        'error': result.error,
+        'vms': len(result.vm_results),
+        'failed_vms': [r.name for r in result.vm_results if not r.ok],
+    }
+
+
+def fleet_report(results):
+    # One report for the whole run, with each vCenter's run report inside
+    vcenters = []
+    for result in results:
+        endpoint = result.endpoint
+        vcenters.append({
+            'name': endpoint.name,
+            'host': endpoint.host,
+            'ok': result.ok,
+            'step': result.step,
+            'error': result.error,
+            'errors': result.errors,
+            'warnings': result.warnings,
+            'journal': result.journal_path,
+            'duration': round(result.duration, 3),
+            'conversions': [_conversion_entry(r) for r in result.results],
+            'plan': result.plan,
+            'report': result.report,
+        })
+    conversions = [r for result in results for r in result.results]
+    return {
+        'format': FLEET_REPORT_FORMAT,
+        'ok': all(result.ok for result in results),
+        'vcenters': vcenters,
+        'totals': {
+            'vcenters': len(results),
+            'vcenters_failed': sum(1 for result in results if not result.ok),
+            'port_groups': len(conversions),
+            'port_groups_failed': sum(1 for r in conversions if not r.ok),
+            'vms_reconfigured': sum(1 for r in conversions for vm in r.vm_results if vm.ok),
+            'api_calls': sum((result.report or {}).get('total_api_calls', 0) for result in results),
+            'duration': round(max((result.duration for result in results), default=0.0), 3),
+        },
+    }
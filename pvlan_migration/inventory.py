@@ -0,0 +1,411 @@
+# In-memory snapshot of the networking inventory.
+#
+# Reading a property of a managed object is a round trip to vCenter. Instead of
+# walking dvs.portgroup, pg.vm and vm.config one object at a time, everything
+# the workflow needs is fetched with a single PropertyCollector retrieval and
+# indexed so lookups are answered from memory.
+import json
+
+from pyVmomi import vim, vmodl
+
+from pvlan_migration.serialize import decode, encode
+
+# Properties fetched per managed object type
+SWITCH_PROPERTIES = ['name', 'uuid', 'config']
+PORTGROUP_PROPERTIES = ['name', 'key', 'config', 'vm']
+VM_PROPERTIES = ['name', 'config.hardware.device', 'runtime.host', 'customValue']
+
+INVENTORY_PROPERTY_SPECS = [
+    (vim.DistributedVirtualSwitch, SWITCH_PROPERTIES),
+    (vim.dvs.DistributedVirtualPortgroup, PORTGROUP_PROPERTIES),
+    (vim.VirtualMachine, VM_PROPERTIES),
+]
+
+# Page size requested from RetrievePropertiesEx
+RETRIEVE_PAGE_SIZE = 1000
+
+# Version of the snapshot file layout written by save_snapshot
+SNAPSHOT_FORMAT = 1
+
+# NicRecord.backing_type values
+BACKING_DISTRIBUTED = 'distributed'
+BACKING_STANDARD = 'standard'
+BACKING_OTHER = 'other'
+
+
+class SwitchInfo:
+    def __init__(self, ref, name, uuid, config):
+        self.ref = ref
+        self.name = name
+        self.uuid = uuid
+        self.config = config
+        self.portgroup_keys = []
+
+    @property
+    def config_version(self):
+        return self.config.configVersion if self.config else None
+
+    @property
+    def pvlan_config(self):
+        return list(getattr(self.config, 'pvlanConfig', None) or [])
+
+
+class PortgroupInfo:
+    def __init__(self, ref, name, key, config, vm_refs):
+        self.ref = ref
+        self.name = name
+        self.key = key
+        self.config = config
+        self.vm_refs = list(vm_refs or [])
+        self.switch_uuid = None
+
+    @property
+    def vlan(self):
+        port_config = self.config.defaultPortConfig if self.config else None
+        return getattr(port_config, 'vlan', None)
+
+
+class NicRecord:
+    # One network adapter, with the backing already classified so callers
+    # never walk the device list or run isinstance checks again
+    __slots__ = ('vm_moid', 'key', 'label', 'mac', 'backing_type', 'portgroup_key', 'switch_uuid', 'device')
+
+    def __init__(self, vm_moid, device):
+        self.vm_moid = vm_moid
+        self.key = device.key
+        self.label = device.deviceInfo.label if device.deviceInfo else None
+        self.mac = device.macAddress
+        self.set_backing(device)
+
+    def set_backing(self, device):
+        self.device = device
+        self.portgroup_key = None
+        self.switch_uuid = None
+        if isinstance(device.backing, vim.vm.device.VirtualEthernetCard.DistributedVirtualPortBackingInfo):
+            self.backing_type = BACKING_DISTRIBUTED
+            if device.backing.port is not None:
+                self.portgroup_key = device.backing.port.portgroupKey
+                self.switch_uuid = device.backing.port.switchUuid
+        elif isinstance(device.backing, vim.vm.device.VirtualEthernetCard.NetworkBackingInfo):
+            self.backing_type = BACKING_STANDARD
+        else:
+            self.backing_type = BACKING_OTHER
+
+
+def nic_records(vm_moid, devices):
+    return [NicRecord(vm_moid, d) for d in devices or [] if isinstance(d, vim.vm.device.VirtualEthernetCard)]
+
+
+class VmInfo:
+    # One per VM in the snapshot, large inventories hold tens of thousands
+    __slots__ = ('ref', 'name', 'host', 'devices', 'nics', 'custom_values', 'attributes')
+
+    def __init__(self, ref, name, devices, host=None, custom_values=None):
+        self.ref = ref
+        self.name = name
+        self.host = host
+        self.set_devices(devices)
+        self.set_custom_values(custom_values)
+
+    @property
+    def host_moid(self):
+        # The ESXi host the VM runs on, None for VMs that are not registered
+        # on a host or were read from an older snapshot
+        return self.host._moId if self.host is not None else None
+
+    def set_custom_values(self, custom_values):
+        self.custom_values = list(custom_values or [])
+        self.attributes = {value.key: getattr(value, 'value', None) for value in self.custom_values}
+
+    def set_devices(self, devices):
+        self.devices = list(devices or [])
+        self.nics = nic_records(self.ref._moId, self.devices)
+
+
+def build_filter_spec(view, property_specs):
+    traversal = vmodl.query.PropertyCollector.TraversalSpec(
+        name='traverseView', path='view', skip=False, type=vim.view.ContainerView)
+    object_spec = vmodl.query.PropertyCollector.ObjectSpec(obj=view, skip=True, selectSet=[traversal])
+    prop_set = [vmodl.query.PropertyCollector.PropertySpec(type=vimtype, pathSet=paths, all=False)
+                for vimtype, paths in property_specs]
+    return vmodl.query.PropertyCollector.FilterSpec(objectSet=[object_spec], propSet=prop_set)
+
+
+def retrieve_pages(collector, filter_spec, page_size=RETRIEVE_PAGE_SIZE):
+    # Yield (obj, {property: value}) for every object filter_spec selects,
+    # following continuation tokens so only one page is held at a time. A
+    # caller that stops early releases the rest of the result on vCenter.
+    options = vmodl.query.PropertyCollector.RetrieveOptions(maxObjects=page_size)
+    result = collector.RetrievePropertiesEx([filter_spec], options)
+    token = None
+    try:
+        while result is not None:
+            token = result.token
+            for obj_content in result.objects:
+                yield obj_content.obj, {prop.name: prop.val for prop in obj_content.propSet or []}
+            if not token:
+                break
+            pending, token = token, None
+            result = collector.ContinueRetrievePropertiesEx(pending)
+    finally:
+        if token:
+            collector.CancelRetrievePropertiesEx(token)
+
+
+def retrieve_properties(content, property_specs, page_size=RETRIEVE_PAGE_SIZE, root=None):
+    # Yield (obj, {property: value}) for every object of the requested types
+    # below root, read in pages.
+    view = content.viewManager.CreateContainerView(
+        root or content.rootFolder, [vimtype for vimtype, _ in property_specs], True)
+    try:
+        yield from retrieve_pages(content.propertyCollector, build_filter_spec(view, property_specs), page_size)
+    finally:
+        view.Destroy()
+
+
+class InventorySnapshot:
+    def __init__(self):
+        self.switches = {}
+        self.portgroups = {}
+        self.vms = {}
+        self._switches_by_uuid = {}
+        self._switches_by_moid = {}
+        self._portgroups_by_name = {}
+        self._portgroups_by_moid = {}
+        # portgroupKey -> vm moid -> NicRecords of that VM on the port group
+        self._nics_by_portgroup = {}
+
+    @classmethod
+    def load(cls, content):
+        snapshot = cls()
+        for obj, props in retrieve_properties(content, INVENTORY_PROPERTY_SPECS):
+            snapshot.update_object(obj, props)
+        return snapshot
+
+    def objects(self):
+        # (ref, props) for every record, with the property names used when
+        # retrieving them so update_object() can read them back
+        for switch in self.switches.values():
+            yield switch.ref, {'name': switch.name, 'uuid': switch.uuid, 'config': switch.config}
+        for pg in self.portgroups.values():
+            yield pg.ref, {'name': pg.name, 'key': pg.key, 'config': pg.config, 'vm': pg.vm_refs}
+        for vm in self.vms.values():
+            yield vm.ref, {'name': vm.name, 'config.hardware.device': vm.devices, 'runtime.host': vm.host,
+                           'customValue': vm.custom_values}
+
+    def update_object(self, obj, props):
+        # Create or update the record for obj from a (possibly partial)
+        # property dict, keeping the indexes consistent
+        if isinstance(obj, vim.DistributedVirtualSwitch):
+            self._update_switch(obj, props)
+        elif isinstance(obj, vim.dvs.DistributedVirtualPortgroup):
+            self._update_portgroup(obj, props)
+        elif isinstance(obj, vim.VirtualMachine):
+            vm = self.vms.get(obj._moId)
+            if vm is None:
+                vm = VmInfo(obj, props.get('name'), props.get('config.hardware.device'), props.get('runtime.host'),
+                            props.get('customValue'))
+                self.vms[obj._moId] = vm
+                self._index_nics(vm.nics)
+            else:
+                if 'name' in props:
+                    vm.name = props['name']
+                if 'config.hardware.device' in props:
+                    self._unindex_nics(vm.nics)
+                    vm.set_devices(props['config.hardware.device'])
+                    self._index_nics(vm.nics)
+                if 'runtime.host' in props:
+                    vm.host = props['runtime.host']
+                if 'customValue' in props:
+                    vm.set_custom_values(props['customValue'])
+
+    def remove_object(self, obj):
+        if isinstance(obj, vim.DistributedVirtualSwitch):
+            switch = self._switches_by_moid.pop(obj._moId, None)
+            if switch is not None:
+                for key in list(switch.portgroup_keys):
+                    self.discard_portgroup(key)
+                self.switches.pop(switch.name, None)
+                self._switches_by_uuid.pop(switch.uuid, None)
+        elif isinstance(obj, vim.dvs.DistributedVirtualPortgroup):
+            pg = self._portgroups_by_moid.pop(obj._moId, None)
+            if pg is not None:
+                self.discard_portgroup(pg.key)
+        elif isinstance(obj, vim.VirtualMachine):
+            vm = self.vms.pop(obj._moId, None)
+            if vm is not None:
+                self._unindex_nics(vm.nics)
+
+    def _index_nics(self, nics):
+        for nic in nics:
+            if nic.portgroup_key is not None:
+                self._nics_by_portgroup.setdefault(nic.portgroup_key, {}).setdefault(nic.vm_moid, []).append(nic)
+
+    def _unindex_nics(self, nics):
+        for nic in nics:
+            vms = self._nics_by_portgroup.get(nic.portgroup_key)
+            if vms is None or nic not in vms.get(nic.vm_moid, ()):
+                continue
+            vms[nic.vm_moid].remove(nic)
+            if not vms[nic.vm_moid]:
+                del vms[nic.vm_moid]
+            if not vms:
+                del self._nics_by_portgroup[nic.portgroup_key]
+
+    def record_reconfiguration(self, vm_ref, spec):
+        # Apply the NIC edits of a ReconfigVM_Task vCenter confirmed, so the
+        # next phase sees them without waiting for the property update
+        vm = self.vms.get(vm_ref._moId)
+        if vm is None:
+            return
+        nics = {nic.key: nic for nic in vm.nics}
+        for change in spec.deviceChange or []:
+            nic = nics.get(change.device.key)
+            if nic is None or change.operation != vim.vm.device.VirtualDeviceSpec.Operation.edit:
+                continue
+            self._unindex_nics([nic])
+            nic.set_backing(change.device)
+            self._index_nics([nic])
+            vm.devices = [change.device if d.key == nic.key else d for d in vm.devices]
+
+    def _update_switch(self, obj, props):
+        switch = self._switches_by_moid.get(obj._moId)
+        if switch is None:
+            switch = SwitchInfo(obj, props.get('name'), props.get('uuid'), props.get('config'))
+            self._switches_by_moid[obj._moId] = switch
+            self.add_switch(switch)
+            # Attach portgroups that were seen before their switch
+            for pg in list(self._portgroups_by_moid.values()):
+                if pg.switch_uuid is None and self._switch_of(pg) is switch:
+                    self.add_portgroup(switch, pg)
+            return
+        if 'name' in props and props['name'] != switch.name:
+            self.switches.pop(switch.name, None)
+            switch.name = props['name']
+            self.switches[switch.name] = switch
+        if 'config' in props:
+            switch.config = props['config']
+
+    def _update_portgroup(self, obj, props):
+        pg = self._portgroups_by_moid.get(obj._moId)
+        if pg is None:
+            pg = PortgroupInfo(obj, props.get('name'), props.get('key'), props.get('config'), props.get('vm'))
+            self._portgroups_by_moid[obj._moId] = pg
+            switch = self._switch_of(pg)
+            if switch is not None:
+                self.add_portgroup(switch, pg)
+            return
+        if 'name' in props and props['name'] != pg.name:
+            self._portgroups_by_name.pop((pg.switch_uuid, pg.name), None)
+            pg.name = props['name']
+            if pg.switch_uuid is not None:
+                self._portgroups_by_name[(pg.switch_uuid, pg.name)] = pg
+        if 'config' in props:
+            pg.config = props['config']
+            if pg.switch_uuid is None:
+                switch = self._switch_of(pg)
+                if switch is not None:
+                    self.add_portgroup(switch, pg)
+        if 'vm' in props:
+            pg.vm_refs = list(props['vm'] or [])
+
+    def _switch_of(self, pg):
+        switch_ref = pg.config.distributedVirtualSwitch if pg.config else None
+        if switch_ref is None:
+            return None
+        return self._switches_by_moid.get(switch_ref._moId)
+
+    def add_switch(self, switch):
+        self.switches[switch.name] = switch
+        self._switches_by_uuid[switch.uuid] = switch
+        self._switches_by_moid[switch.ref._moId] = switch
+
+    def add_portgroup(self, switch, pg):
+        pg.switch_uuid = switch.uuid
+        switch.portgroup_keys.append(pg.key)
+        self.portgroups[pg.key] = pg
+        self._portgroups_by_name[(switch.uuid, pg.name)] = pg
+        self._portgroups_by_moid[pg.ref._moId] = pg
+
+    def discard_portgroup(self, key):
+        pg = self.portgroups.pop(key, None)
+        if pg is None:
+            return
+        self._portgroups_by_name.pop((pg.switch_uuid, pg.name), None)
+        self._portgroups_by_moid.pop(pg.ref._moId, None)
+        switch = self._switches_by_uuid.get(pg.switch_uuid)
+        if switch is not None and key in switch.portgroup_keys:
+            switch.portgroup_keys.remove(key)
+
+    def switch(self, name):
+        return self.switches.get(name)
+
+    def switch_by_uuid(self, uuid):
+        return self._switches_by_uuid.get(uuid)
+
+    def switch_names(self):
+        return list(self.switches)
+
+    def portgroup(self, vds_name, name):
+        switch = self.switches.get(vds_name)
+        if switch is None:
+            return None
+        return self._portgroups_by_name.get((switch.uuid, name))
+
+    def portgroup_by_key(self, key):
+        return self.portgroups.get(key)
+
+    def find_portgroup(self, name):
+        # First portgroup with this name on any switch
+        for pg in self.portgroups.values():
+            if pg.name == name:
+                return pg
+        return None
+
+    def portgroup_names(self, vds_name):
+        switch = self.switches.get(vds_name)
+        if switch is None:
+            return []
+        return [self.portgroups[key].name for key in switch.portgroup_keys]
+
+    def vm(self, ref):
+        return self.vms.get(ref._moId)
+
+    def current_nics(self, vm_refs):
+        # vm moid -> NicRecords of the VMs as vCenter reports them now, for a
+        # snapshot as they were read
+        return {ref._moId: self.vms[ref._moId].nics for ref in vm_refs if ref._moId in self.vms}
+
+    def nics_on_portgroup(self, key):
+        # vm moid -> NicRecords of the VM backed by port group key
+        return self._nics_by_portgroup.get(key, {})
+
+    def vms_with_nics_on(self, key):
+        return [self.vms[moid] for moid in list(self.nics_on_portgroup(key))]
+
+    def vms_on_portgroup(self, key):
+        pg = self.portgroups.get(key)
+        if pg is None:
+            return []
+        return [self.vms[ref._moId] for ref in pg.vm_refs if ref._moId in self.vms]
+
+
+def load_inventory(content):
+    return InventorySnapshot.load(content)
+
+
+def save_snapshot(inventory, path):
+    objects = [{'ref': encode(ref), 'props': encode(props)} for ref, props in inventory.objects()]
+    with open(path, 'w') as f:
+        json.dump({'format': SNAPSHOT_FORMAT, 'objects': objects}, f)
+
+
+def load_snapshot(path):
+    with open(path) as f:
+        data = json.load(f)
+    if data.get('format') != SNAPSHOT_FORMAT:
+        raise ValueError(f"Unsupported snapshot format {data.get('format')!r} in {path}")
+    snapshot = InventorySnapshot()
+    for item in data['objects']:
+        snapshot.update_object(decode(item['ref']), decode(item['props']))
+    return snapshot
@@ -0,0 +1,168 @@
+# Append-only journal of a conversion run.
+#
+# Every step is written as one JSON line before it starts (planned) and once
+# vCenter confirmed it (done or failed): port group creation, deletion and
+# renames, PVLAN map additions and every NIC backing change together with the
+# portgroupKey it had before. Lines are fsync'd before the call returns, and
+# writers from several threads share a single fsync when they arrive together
+# so journaling thousands of NIC moves stays cheap.
+import json
+import os
+import threading
+import time
+from dataclasses import asdict
+
+PLANNED = 'planned'
+DONE = 'done'
+FAILED = 'failed'
+
+
+class Journal:
+    def __init__(self, path):
+        self.path = path
+        self._seq = 0
+        if os.path.exists(path):
+            _drop_partial_line(path)
+            self._seq = len(read_journal(path))
+        self._file = open(path, 'a')
+        self._write_lock = threading.Lock()
+        self._sync_lock = threading.Lock()
+        self._synced = self._seq
+
+    def record(self, op, status=DONE, **fields):
+        return self.record_many([dict(fields, op=op, status=status)])
+
+    def record_many(self, entries):
+        # Write all entries, then make sure they are on disk. Returns the
+        # sequence number of the last one.
+        if not entries:
+            return self._seq
+        with self._write_lock:
+            lines = []
+            for entry in entries:
+                self._seq += 1
+                lines.append(json.dumps(dict(entry, seq=self._seq, ts=time.time()), sort_keys=True))
+            self._file.write("\n".join(lines) + "\n")
+            self._file.flush()
+            seq = self._seq
+        self._sync(seq)
+        return seq
+
+    def _sync(self, seq):
+        with self._sync_lock:
+            # Another writer's fsync may already have covered our lines
+            if self._synced >= seq:
+                return
+            with self._write_lock:
+                target = self._seq
+            os.fsync(self._file.fileno())
+            self._synced = target
+
+    def close(self):
+        self._file.close()
+
+
+def _drop_partial_line(path):
+    # A run killed mid-write can leave a last line without its newline, cut it
+    # off so new entries start on a line of their own
+    with open(path, 'rb+') as f:
+        data = f.read()
+        if data and not data.endswith(b"\n"):
+            f.truncate(data.rfind(b"\n") + 1)
+
+
+def read_journal(path):
+    entries = []
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                entries.append(json.loads(line))
+            except ValueError:
+                # A run killed mid-write leaves a partial last line
+                break
+    return entries
+
+
+def begin_entry(rows, direct):
+    return {'rows': [asdict(row) for row in rows], 'direct': direct}
+
+
+def nic_entries(row_label, hop, vm_specs, from_key, status):
+    # One entry per NIC in (name, vm, ConfigSpec) triples, recording the key
+    # each NIC is moved from and the key it is moved to
+    entries = []
+    for name, vm, spec in vm_specs:
+        for change in spec.deviceChange:
+            port = change.device.backing.port
+            entries.append({
+                'op': 'nic_move', 'status': status, 'row': row_label, 'hop': hop,
+                'vm': vm._moId, 'vm_name': name, 'device': change.device.key,
+                'from_key': from_key, 'to_key': port.portgroupKey, 'switch_uuid': port.switchUuid,
+            })
+    return entries
+
+
+class JournalState:
+    # What a journal says has happened, used to resume or roll back a run.
+    # Resuming trusts confirmed entries only. Rollback works from the planned
+    # ones, a change may have gone through without its confirmation reaching
+    # the journal, and checks the inventory before undoing anything.
+    def __init__(self, entries):
+        self.entries = entries
+        self.rows = []
+        self.direct = False
+        self.steps = {}
+        self.nic_moves = []
+        self.planned_nic_moves = []
+        self.created = []
+        self.deleted = []
+        self.pvlan_added = []
+        self.renamed = []
+        for entry in entries:
+            op = entry['op']
+            status = entry.get('status')
+            if op == 'begin':
+                self.rows = entry['rows']
+                self.direct = entry.get('direct', False)
+            elif op == 'step' and status == DONE:
+                self.steps.setdefault(entry['row'], set()).add(entry['step'])
+            elif op == 'nic_move':
+                (self.nic_moves if status == DONE else self.planned_nic_moves).append(entry)
+            elif status != PLANNED:
+                continue
+            elif op == 'portgroup_create':
+                self.created.append(entry)
+            elif op == 'portgroup_delete':
+                self.deleted.append(entry)
+            elif op == 'pvlan_map_add':
+                self.pvlan_added.append(entry)
+            elif op == 'portgroup_rename':
+                self.renamed.append(entry)
+
+    @classmethod
+    def load(cls, path):
+        return cls(read_journal(path))
+
+    def step_done(self, row_label, step):
+        return step in self.steps.get(row_label, ())
+
+    def parked(self, row_label):
+        # vm moid -> device keys this row planned to move to the dummy port
+        # group. Some may not have moved or have moved on already, check them
+        # against the inventory.
+        parked = {}
+        for move in self.planned_nic_moves:
+            if move['row'] == row_label and move['hop'] == 'dummy':
+                parked.setdefault(move['vm'], set()).add(move['device'])
+        return parked
+
+    def original_backings(self):
+        # (vm moid, device key) -> the first planned move of that NIC, which
+        # holds the portgroupKey it had before the run
+        original = {}
+        for move in self.planned_nic_moves:
+            original.setdefault((move['vm'], move['device']), move)
+        return original
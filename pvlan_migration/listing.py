@@ -0,0 +1,143 @@
+# Streaming listing of the VMs on a port group.
+#
+# The interactive mode lists VMs from the inventory cache, which first reads
+# every VM of the vCenter. For a port group with thousands of VMs,
+# port_group_nics asks a PropertyCollector for only the name, host and devices
+# of the VMs on that port group. The VMs come in pages, and one row per
+# network adapter is yielded as soon as its page arrives, so memory stays flat
+# and output starts right away. With a folder or host filter the VMs below
+# that folder or host are read instead, and those without a NIC on the port
+# group are skipped.
+import csv
+import fnmatch
+import json
+from dataclasses import asdict, dataclass, fields
+from typing import Optional
+
+from pyVmomi import vim, vmodl
+
+from pvlan_migration.inventory import (BACKING_DISTRIBUTED, BACKING_STANDARD, nic_records, retrieve_pages,
+                                       retrieve_properties)
+from pvlan_migration.plan import PlanError
+
+LISTING_PAGE_SIZE = 100
+
+LISTING_VM_PROPERTIES = ['name', 'runtime.host', 'config.hardware.device']
+
+LISTING_FORMATS = ['table', 'csv', 'jsonl']
+
+# Column widths of the table format, longer values are not cut
+TABLE_COLUMNS = [('vm', 40), ('host', 24), ('nic', 20), ('mac', 18), ('backing', 11)]
+
+
+@dataclass
+class NicRow:
+    vm: str
+    vm_moid: str
+    host: Optional[str]
+    nic: Optional[str]
+    mac: Optional[str]
+    # Distributed NICs on the port group, or standard switch NICs of the
+    # same VM, which the migration leaves alone
+    backing: str
+
+
+def _names(content, vimtype):
+    # moid -> name of every object of vimtype, hosts and folders are few
+    return {obj._moId: props.get('name') for obj, props in retrieve_properties(content, [(vimtype, ['name'])])}
+
+
+def _find(content, vimtype, name, what):
+    matches = [obj for obj, props in retrieve_properties(content, [(vimtype, ['name'])]) if props.get('name') == name]
+    if not matches:
+        raise PlanError(f"{what} {name} not found")
+    if len(matches) > 1:
+        raise PlanError(f"{what} name {name} is not unique")
+    return matches[0]
+
+
+def find_portgroup(content, port_group_name, vds_name=None):
+    # Reference and key of the port group, on vds_name if given
+    switches = _names(content, vim.DistributedVirtualSwitch) if vds_name else {}
+    portgroup_properties = ['name', 'key', 'config.distributedVirtualSwitch']
+    for obj, props in retrieve_properties(content, [(vim.dvs.DistributedVirtualPortgroup, portgroup_properties)]):
+        if props.get('name') != port_group_name:
+            continue
+        switch = props.get('config.distributedVirtualSwitch')
+        if vds_name and (switch is None or switches.get(switch._moId) != vds_name):
+            continue
+        return obj, props['key']
+    raise PlanError(f"Port group {port_group_name} not found" + (f" on {vds_name}" if vds_name else ""))
+
+
+def _portgroup_vm_filter(portgroup_ref):
+    # From the port group along its vm property to the VMs on it
+    traversal = vmodl.query.PropertyCollector.TraversalSpec(
+        name='traversePortgroupVms', path='vm', skip=False, type=vim.dvs.DistributedVirtualPortgroup)
+    object_spec = vmodl.query.PropertyCollector.ObjectSpec(obj=portgroup_ref, skip=True, selectSet=[traversal])
+    prop_spec = vmodl.query.PropertyCollector.PropertySpec(type=vim.VirtualMachine, pathSet=LISTING_VM_PROPERTIES,
+                                                           all=False)
+    return vmodl.query.PropertyCollector.FilterSpec(objectSet=[object_spec], propSet=[prop_spec])
+
+
+def port_group_nics(content, port_group_name, vds_name=None, name_pattern=None, folder=None, host=None,
+                    page_size=LISTING_PAGE_SIZE):
+    # Iterator of a NicRow for every NIC on the port group and every standard
+    # switch NIC of the VMs on it. name_pattern is a shell style pattern
+    # matched against the VM name regardless of case, folder and host are
+    # names of a VM folder and an ESXi host. The port group and the filters
+    # are looked up straight away, so unknown names raise PlanError here.
+    portgroup_ref, portgroup_key = find_portgroup(content, port_group_name, vds_name)
+    host_names = _names(content, vim.HostSystem)
+    root = None
+    if host:
+        root = _find(content, vim.HostSystem, host, "Host")
+    if folder:
+        root = _find(content, vim.Folder, folder, "Folder")
+    if root is None:
+        vms = retrieve_pages(content.propertyCollector, _portgroup_vm_filter(portgroup_ref), page_size)
+    else:
+        vms = retrieve_properties(content, [(vim.VirtualMachine, LISTING_VM_PROPERTIES)], page_size, root)
+    return _nic_rows(vms, portgroup_key, host_names, name_pattern, host)
+
+
+def _nic_rows(vms, portgroup_key, host_names, name_pattern, host):
+    pattern = name_pattern.lower() if name_pattern else None
+    for vm_ref, props in vms:
+        name = props.get('name') or vm_ref._moId
+        if pattern is not None and not fnmatch.fnmatchcase(name.lower(), pattern):
+            continue
+        vm_host = props.get('runtime.host')
+        if host and (vm_host is None or host_names.get(vm_host._moId) != host):
+            continue
+        nics = nic_records(vm_ref._moId, props.get('config.hardware.device'))
+        if not any(nic.portgroup_key == portgroup_key for nic in nics):
+            continue
+        for nic in nics:
+            if nic.backing_type == BACKING_STANDARD or nic.portgroup_key == portgroup_key:
+                yield NicRow(vm=name, vm_moid=vm_ref._moId,
+                             host=host_names.get(vm_host._moId) if vm_host is not None else None,
+                             nic=nic.label, mac=nic.mac,
+                             backing=BACKING_DISTRIBUTED if nic.portgroup_key == portgroup_key else BACKING_STANDARD)
+
+
+def write_rows(rows, output_format, stream):
+    # Write the rows as they come and return how many there were
+    count = 0
+    if output_format == 'csv':
+        writer = csv.DictWriter(stream, fieldnames=[field.name for field in fields(NicRow)])
+        writer.writeheader()
+    elif output_format == 'table':
+        stream.write(" ".join(name.upper().ljust(width) for name, width in TABLE_COLUMNS).rstrip() + "\n")
+    for row in rows:
+        if output_format == 'csv':
+            writer.writerow(asdict(row))
+        elif output_format == 'jsonl':
+            stream.write(json.dumps(asdict(row)) + "\n")
+        else:
+            stream.write(" ".join(str(getattr(row, name) or '-').ljust(width)
+                                  for name, width in TABLE_COLUMNS).rstrip() + "\n")
+        count += 1
+        # Rows show up as they are found, not when the buffer fills
+        stream.flush()
+    return count
@@ -0,0 +1,192 @@
+# Run instrumentation.
+#
+# Every SOAP call going through the session pool is counted per method with
+# its latency, errors and bytes on the wire. The workflow marks its phases,
+# and every confirmed VM reconfiguration extends that VM's outage window, which
+# runs from the start of its first reconfiguration to the end of its last one.
+# Recording is a few dict updates under one lock, the optional progress
+# display reads the counters from its own thread.
+import contextlib
+import json
+import sys
+import threading
+import time
+
+# Upper bounds in milliseconds of the latency histogram buckets
+LATENCY_BUCKETS_MS = [5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000]
+
+REPORT_FORMAT = 1
+
+
+class CallStats:
+    __slots__ = ('count', 'errors', 'latency_total', 'latency_max', 'buckets')
+
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.latency_total = 0.0
+        self.latency_max = 0.0
+        self.buckets = [0] * (len(LATENCY_BUCKETS_MS) + 1)
+
+    def add(self, latency, ok):
+        self.count += 1
+        if not ok:
+            self.errors += 1
+        self.latency_total += latency
+        self.latency_max = max(self.latency_max, latency)
+        latency_ms = latency * 1000
+        for i, bound in enumerate(LATENCY_BUCKETS_MS):
+            if latency_ms <= bound:
+                self.buckets[i] += 1
+                break
+        else:
+            self.buckets[-1] += 1
+
+    def as_dict(self):
+        histogram = {f"le_{bound}ms": n for bound, n in zip(LATENCY_BUCKETS_MS, self.buckets)}
+        histogram['over'] = self.buckets[-1]
+        return {
+            'count': self.count,
+            'errors': self.errors,
+            'latency_total': round(self.latency_total, 4),
+            'latency_average': round(self.latency_total / self.count, 4) if self.count else 0.0,
+            'latency_max': round(self.latency_max, 4),
+            'histogram': histogram,
+        }
+
+
+class PhaseStats:
+    __slots__ = ('count', 'total', 'max')
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+
+def _percentile(values, fraction):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+class RunMetrics:
+    def __init__(self):
+        self.started = time.time()
+        self.calls = {}
+        self.phases = {}
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        # vm moid -> [name, first reconfiguration start, last reconfiguration end]
+        self.vm_windows = {}
+        self._lock = threading.Lock()
+
+    def record_call(self, method, latency, ok=True):
+        with self._lock:
+            stats = self.calls.get(method)
+            if stats is None:
+                stats = self.calls[method] = CallStats()
+            stats.add(latency, ok)
+
+    def record_bytes(self, sent=0, received=0):
+        with self._lock:
+            self.bytes_sent += sent
+            self.bytes_received += received
+
+    def record_vm_reconfiguration(self, moid, name, started, finished):
+        # started and finished are time.monotonic() values
+        with self._lock:
+            window = self.vm_windows.get(moid)
+            if window is None:
+                self.vm_windows[moid] = [name, started, finished]
+            else:
+                window[1] = min(window[1], started)
+                window[2] = max(window[2], finished)
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            duration = time.monotonic() - started
+            with self._lock:
+                stats = self.phases.get(name)
+                if stats is None:
+                    stats = self.phases[name] = PhaseStats()
+                stats.count += 1
+                stats.total += duration
+                stats.max = max(stats.max, duration)
+
+    @property
+    def call_count(self):
+        return sum(stats.count for stats in list(self.calls.values()))
+
+    def report(self, extra=None):
+        with self._lock:
+            outages = {window[0] or moid: round(window[2] - window[1], 3) for moid, window in self.vm_windows.items()}
+            report = {
+                'format': REPORT_FORMAT,
+                'started': self.started,
+                'finished': time.time(),
+                'phases': {name: {'count': s.count, 'total': round(s.total, 3), 'max': round(s.max, 3)}
+                           for name, s in self.phases.items()},
+                'api_calls': {method: stats.as_dict() for method, stats in sorted(self.calls.items())},
+                'total_api_calls': sum(stats.count for stats in self.calls.values()),
+                'bytes': {'sent': self.bytes_sent, 'received': self.bytes_received},
+            }
+        values = list(outages.values())
+        report['duration'] = round(report['finished'] - report['started'], 3)
+        report['vm_outage'] = {
+            'vms': len(values),
+            'average': round(sum(values) / len(values), 3) if values else 0.0,
+            'p50': _percentile(values, 0.5),
+            'p95': _percentile(values, 0.95),
+            'max': max(values) if values else 0.0,
+            'per_vm': outages,
+        }
+        if extra:
+            report.update(extra)
+        return report
+
+    def write_report(self, path, extra=None):
+        with open(path, 'w') as f:
+            json.dump(self.report(extra), f, indent=2)
+
+
+# Shared by everything in the process, like the retry throttle
+METRICS = RunMetrics()
+
+
+class ProgressDisplay:
+    # Rewrites one status line every interval seconds from a background
+    # thread, the workers never wait on it
+    def __init__(self, metrics=METRICS, interval=1.0, stream=sys.stderr):
+        self.metrics = metrics
+        self.interval = interval
+        self.stream = stream
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def _line(self):
+        metrics = self.metrics
+        elapsed = time.time() - metrics.started
+        return (f"\r{elapsed:7.1f}s  {metrics.call_count} vCenter calls  "
+                f"{len(metrics.vm_windows)} VMs reconfigured  "
+                f"{(metrics.bytes_sent + metrics.bytes_received) / 1e6:.1f} MB  ")
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.stream.write(self._line())
+            self.stream.flush()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        self.stream.write(self._line() + "\n")
+        self.stream.flush()
@@ -0,0 +1,28 @@
+# Port group naming rules of a conversion.
+#
+# Kept free of pyVmomi so plan files can be read and checked without loading
+# it.
+PROMISCUOUS_SUFFIX = '_promiscuous'
+ISOLATED_SUFFIX = '_isolated'
+
+# Appended to the PVLAN port group names while a direct cutover is running
+CUTOVER_SUFFIX = '_cutover'
+
+# Accepted spellings of the final target port group type
+TARGET_SUFFIXES = {
+    'promiscuous': PROMISCUOUS_SUFFIX,
+    'p': PROMISCUOUS_SUFFIX,
+    'isolated': ISOLATED_SUFFIX,
+    'i': ISOLATED_SUFFIX,
+}
+
+
+def pvlan_portgroup_names(base_name):
+    return base_name + PROMISCUOUS_SUFFIX, base_name + ISOLATED_SUFFIX
+
+
+def target_portgroup_name(base_name, target_type):
+    suffix = TARGET_SUFFIXES.get(str(target_type).strip().lower())
+    if suffix is None:
+        return None
+    return base_name + suffix
@@ -0,0 +1,105 @@
+# Plan files of the batch conversion.
+#
+# A plan is a YAML, JSON or CSV file with one row per port group to convert.
+# Reading and checking it needs neither vCenter nor pyVmomi, so a bad plan is
+# reported before anything else happens.
+import csv
+import json
+import os
+from dataclasses import dataclass
+from typing import Optional
+
+from pvlan_migration.naming import target_portgroup_name
+
+PLAN_COLUMNS = ['vds', 'source_port_group', 'dummy_port_group', 'base_name',
+                'promiscuous_vlan', 'isolated_vlan', 'target_type', 'dummy_vlan']
+# dummy_port_group is only needed when NICs are parked on the way
+REQUIRED_COLUMNS = ['vds', 'source_port_group', 'target_type']
+
+
+class PlanError(Exception):
+    pass
+
+
+@dataclass
+class PlanRow:
+    line: int
+    vds: str
+    source_port_group: str
+    dummy_port_group: Optional[str]
+    target_type: str
+    base_name: Optional[str] = None
+    promiscuous_vlan: Optional[int] = None
+    isolated_vlan: Optional[int] = None
+    dummy_vlan: Optional[int] = None
+
+    @property
+    def label(self):
+        return f"{self.vds}/{self.source_port_group}"
+
+    @property
+    def target_port_group(self):
+        return target_portgroup_name(self.base_name, self.target_type)
+
+
+def _parse_int(value, column, line):
+    if value is None or str(value).strip() == '':
+        return None
+    try:
+        return int(str(value).strip())
+    except ValueError:
+        raise PlanError(f"Row {line}: {column} must be a number, got {value!r}")
+
+
+def read_records(path, key='conversions'):
+    # The list of mappings in a YAML, JSON or CSV file, or the list under key
+    # of a YAML or JSON mapping
+    ext = os.path.splitext(path)[1].lower()
+    with open(path, newline='') as f:
+        if ext == '.csv':
+            return list(csv.DictReader(f))
+        if ext in ('.yaml', '.yml'):
+            try:
+                import yaml
+            except ImportError:
+                raise PlanError("YAML plans need PyYAML, install it with 'pip install pyyaml'")
+            data = yaml.safe_load(f)
+        elif ext == '.json':
+            data = json.load(f)
+        else:
+            raise PlanError(f"Unsupported plan file type {ext!r}, use .yaml, .json or .csv")
+    if isinstance(data, dict):
+        data = data.get(key)
+    if not isinstance(data, list):
+        raise PlanError(f"The file must be a list of {key} or contain a '{key}' list")
+    return data
+
+
+def load_plan(path):
+    return parse_plan(read_records(path))
+
+
+def parse_plan(records):
+    rows = []
+    for line, record in enumerate(records, start=1):
+        if not isinstance(record, dict):
+            raise PlanError(f"Row {line}: expected a mapping of column to value")
+        record = {str(k).strip(): v for k, v in record.items() if k is not None}
+        unknown = set(record) - set(PLAN_COLUMNS)
+        if unknown:
+            raise PlanError(f"Row {line}: unknown column(s) {', '.join(sorted(unknown))}")
+        missing = [c for c in REQUIRED_COLUMNS if not str(record.get(c) or '').strip()]
+        if missing:
+            raise PlanError(f"Row {line}: missing {', '.join(missing)}")
+        rows.append(PlanRow(
+            line=line,
+            vds=str(record['vds']).strip(),
+            source_port_group=str(record['source_port_group']).strip(),
+            dummy_port_group=str(record.get('dummy_port_group') or '').strip() or None,
+            target_type=str(record['target_type']).strip().lower(),
+            base_name=str(record.get('base_name') or '').strip() or None,
+            promiscuous_vlan=_parse_int(record.get('promiscuous_vlan'), 'promiscuous_vlan', line),
+            isolated_vlan=_parse_int(record.get('isolated_vlan'), 'isolated_vlan', line),
+            dummy_vlan=_parse_int(record.get('dummy_vlan'), 'dummy_vlan', line),
+        ))
+    return rows
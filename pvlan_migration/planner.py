@@ -0,0 +1,137 @@
+# Dry-run planning of conversions.
+#
+# Works out, from an inventory snapshot alone, every change a batch run would
+# make: the NIC edits per VM for both hops, the port groups created and
+# deleted and the PVLAN map entries added, together with the number of vCenter
+# calls it takes. Port groups that do not exist yet have no key, their NIC
+# edits use a "<new:name>" placeholder instead.
+from pvlan_migration.inventory import nic_records
+from pvlan_migration.naming import CUTOVER_SUFFIX, pvlan_portgroup_names
+from pvlan_migration.pvlan import PvlanPlan
+from pvlan_migration.serialize import encode
+from pvlan_migration.validation import validate_plan
+from pvlan_migration.workflow import dummy_portgroup_specs, nic_device_changes, pvlan_portgroup_specs, source_template
+
+PLAN_FORMAT = 1
+
+
+def placeholder_key(port_group_name):
+    return f"<new:{port_group_name}>"
+
+
+class _PlannedVm:
+    # A VM as it will look once the dummy hop is done
+    def __init__(self, devices):
+        self.nics = nic_records(None, devices)
+
+
+def _count(calls, method, amount=1):
+    if amount:
+        calls[method] = calls.get(method, 0) + amount
+
+
+def plan_conversions(inventory, rows, direct=False):
+    # With direct the plan describes the direct cutover: one NIC move per VM
+    # to temporarily named port groups that are renamed at the end
+    report = validate_plan(rows, inventory, direct)
+    if not report.ok:
+        return {'format': PLAN_FORMAT, 'errors': report.errors, 'warnings': report.warnings}
+
+    calls = {}
+
+    # PVLAN map entries, one reconfiguration per switch with missing entries
+    pvlan_plan = PvlanPlan()
+    for row in rows:
+        pvlan_plan.add_pair(row.vds, row.promiscuous_vlan, row.isolated_vlan)
+    pvlan_map = {vds_name: [{'primaryVlanId': p, 'secondaryVlanId': s, 'pvlanType': t} for p, s, t in entries]
+                 for vds_name, entries in pvlan_plan.pending(inventory).items()}
+    _count(calls, 'ReconfigureDvs_Task', len(pvlan_map))
+
+    # Missing dummy port groups, one creation task per switch
+    def template_of(row):
+        return source_template(inventory, row.vds, row.source_port_group)
+    dummy_rows = [row for row in rows if not direct and inventory.portgroup(row.vds, row.dummy_port_group) is None]
+    dummy_portgroups = {vds_name: encode(specs)
+                        for vds_name, specs in dummy_portgroup_specs(dummy_rows, template_of).items()}
+    _count(calls, 'AddDVPortgroup_Task', len(dummy_portgroups))
+
+    conversions = []
+    vm_outage_steps = 0
+    for row in rows:
+        switch = inventory.switch(row.vds)
+        source = inventory.portgroup(row.vds, row.source_port_group)
+        name_suffix = CUTOVER_SUFFIX if direct else ''
+        target_key = placeholder_key(row.target_port_group + name_suffix)
+        if not direct:
+            dummy = inventory.portgroup(row.vds, row.dummy_port_group)
+            dummy_key = dummy.key if dummy is not None else placeholder_key(row.dummy_port_group)
+
+        vm_changes = []
+        for vm in sorted(inventory.vms_on_portgroup(source.key), key=lambda vm: vm.name):
+            if direct:
+                cutover = nic_device_changes(vm, switch.uuid, source.key, target_key)
+                if cutover:
+                    vm_changes.append({'vm': vm.name, 'moid': vm.ref._moId, 'outage_steps': 1,
+                                       'cutover': encode(cutover)})
+                continue
+            dummy_hop = nic_device_changes(vm, switch.uuid, source.key, dummy_key)
+            if not dummy_hop:
+                continue
+            final_hop = nic_device_changes(_PlannedVm([change.device for change in dummy_hop]),
+                                           switch.uuid, dummy_key, target_key)
+            vm_changes.append({
+                'vm': vm.name,
+                'moid': vm.ref._moId,
+                'outage_steps': 2,
+                'dummy_hop': encode(dummy_hop),
+                'final_hop': encode(final_hop),
+            })
+
+        reconfigurations = sum(change['outage_steps'] for change in vm_changes)
+        vm_outage_steps += reconfigurations
+        _count(calls, 'ReconfigVM_Task', reconfigurations)
+        _count(calls, 'Destroy_Task')
+        _count(calls, 'AddDVPortgroup_Task')
+        renames = []
+        if direct:
+            renames = [{'from': name + CUTOVER_SUFFIX, 'to': name} for name in pvlan_portgroup_names(row.base_name)]
+            _count(calls, 'ReconfigureDVPortgroup_Task', len(renames))
+
+        conversions.append({
+            'vds': row.vds,
+            'source_port_group': row.source_port_group,
+            'source_port_group_key': source.key,
+            'dummy_port_group': row.dummy_port_group,
+            'target_port_group': row.target_port_group,
+            'promiscuous_vlan': row.promiscuous_vlan,
+            'isolated_vlan': row.isolated_vlan,
+            'mode': 'direct' if direct else 'dummy',
+            'create_portgroups': encode(pvlan_portgroup_specs(row.base_name, row.promiscuous_vlan, row.isolated_vlan,
+                                                              name_suffix, *template_of(row))),
+            'delete_portgroups': [row.source_port_group],
+            'rename_portgroups': renames,
+            'vm_changes': vm_changes,
+            'cost': {
+                'vms': len(vm_changes),
+                'nics': sum(len(change['cutover' if direct else 'dummy_hop']) for change in vm_changes),
+                'vm_reconfigurations': reconfigurations,
+            },
+        })
+
+    return {
+        'format': PLAN_FORMAT,
+        'errors': [],
+        'warnings': report.warnings,
+        'pvlan_map': pvlan_map,
+        'dummy_portgroups': dummy_portgroups,
+        'conversions': conversions,
+        'cost': {
+            'api_calls': dict(sorted(calls.items())),
+            'total_api_calls': sum(calls.values()),
+            'vds_reconfigurations': calls.get('ReconfigureDvs_Task', 0),
+            'portgroup_operations': (calls.get('AddDVPortgroup_Task', 0) + calls.get('Destroy_Task', 0)
+                                     + calls.get('ReconfigureDVPortgroup_Task', 0)),
+            'vm_reconfigurations': calls.get('ReconfigVM_Task', 0),
+            'vm_outage_steps': vm_outage_steps,
+        },
+    }
@@ -0,0 +1,117 @@
+# PVLAN map changes grouped per distributed switch.
+#
+# Every ReconfigureDvs_Task is pushed to all hosts on the switch, so the map
+# entries needed for a run are collected first and then applied with a single
+# reconfiguration per switch. Entries already present in pvlanConfig are left
+# out, and a reconfiguration rejected because configVersion went stale is
+# rebuilt from the current switch config and sent again.
+from pyVmomi import vim
+
+from pvlan_migration.retry import THROTTLE
+from pvlan_migration.tasks import run_tasks
+
+PROMISCUOUS = 'promiscuous'
+ISOLATED = 'isolated'
+COMMUNITY = 'community'
+
+# Attempts per switch, a stale configVersion costs one attempt
+PVLAN_RETRIES = 3
+
+# Base delay of the exponential backoff between those attempts
+PVLAN_RETRY_DELAY = 1
+
+
+def pvlan_map_entry(primary_vlan, secondary_vlan, pvlan_type):
+    entry = vim.dvs.VmwareDistributedVirtualSwitch.PvlanMapEntry()
+    entry.primaryVlanId = primary_vlan
+    entry.secondaryVlanId = secondary_vlan
+    entry.pvlanType = pvlan_type
+    return entry
+
+
+def missing_entries(entries, pvlan_config):
+    existing = {(e.primaryVlanId, e.secondaryVlanId, e.pvlanType) for e in pvlan_config or []}
+    return [e for e in entries if e not in existing]
+
+
+def present_entries(entries, pvlan_config):
+    existing = {(e.primaryVlanId, e.secondaryVlanId, e.pvlanType) for e in pvlan_config or []}
+    return [e for e in entries if e in existing]
+
+
+def pending_entries(entries, pvlan_config, operation='add'):
+    if operation == 'remove':
+        return present_entries(entries, pvlan_config)
+    return missing_entries(entries, pvlan_config)
+
+
+def pvlan_config_spec(config, entries, operation='add'):
+    # Build the switch spec adding the entries that are not in config yet (or
+    # removing those that are), or None if there is nothing to do
+    pending = pending_entries(entries, getattr(config, 'pvlanConfig', None), operation)
+    if not pending:
+        return None
+    vds_config_spec = vim.dvs.VmwareDistributedVirtualSwitch.ConfigSpec()
+    vds_config_spec.configVersion = config.configVersion
+    vds_config_spec.pvlanConfigSpec = [
+        vim.dvs.VmwareDistributedVirtualSwitch.PvlanConfigSpec(operation=operation, pvlanEntry=pvlan_map_entry(*entry))
+        for entry in pending
+    ]
+    return vds_config_spec
+
+
+class PvlanPlan:
+    def __init__(self):
+        # switch name -> ordered list of (primary, secondary, type)
+        self.entries = {}
+
+    def add_entry(self, vds_name, primary_vlan, secondary_vlan, pvlan_type):
+        entries = self.entries.setdefault(vds_name, [])
+        entry = (primary_vlan, secondary_vlan, pvlan_type)
+        if entry not in entries:
+            entries.append(entry)
+
+    def add_pair(self, vds_name, promiscuous_vlan, isolated_vlan):
+        # The promiscuous primary maps onto itself, the isolated secondary
+        # hangs off that primary
+        self.add_entry(vds_name, promiscuous_vlan, promiscuous_vlan, PROMISCUOUS)
+        self.add_entry(vds_name, promiscuous_vlan, isolated_vlan, ISOLATED)
+
+    def pending(self, inventory, operation='add'):
+        # Entries per switch that are not in the snapshot's pvlanConfig yet,
+        # or with operation 'remove' the ones that are
+        pending = {}
+        for vds_name, entries in self.entries.items():
+            switch = inventory.switch(vds_name)
+            config_entries = switch.pvlan_config if switch is not None else []
+            entries = pending_entries(entries, config_entries, operation)
+            if entries:
+                pending[vds_name] = entries
+        return pending
+
+    def apply(self, inventory, max_in_flight=4, retries=PVLAN_RETRIES - 1, retry_delay=PVLAN_RETRY_DELAY,
+              operation='add', on_result=None, throttle=THROTTLE):
+        # One ReconfigureDvs_Task per switch, switches are reconfigured in
+        # parallel. Returns a TaskResult per switch that needed changes.
+        jobs = []
+        for vds_name, entries in self.pending(inventory, operation).items():
+            switch = inventory.switch(vds_name)
+            if switch is None:
+                raise KeyError(f"Distributed Virtual Switch {vds_name} not found")
+            jobs.append((vds_name, self._reconfigure(switch, entries, operation)))
+        return run_tasks(jobs, max_in_flight=max_in_flight, retries=retries, retry_delay=retry_delay,
+                         on_result=on_result, throttle=throttle)
+
+    def _reconfigure(self, switch, entries, operation):
+        attempts = []
+
+        def start():
+            # The first attempt uses the config held by the snapshot, retries
+            # read it again so the configVersion and existing entries are current
+            config = switch.config if not attempts else switch.ref.config
+            attempts.append(config)
+            spec = pvlan_config_spec(config, entries, operation)
+            if spec is None:
+                return None
+            return switch.ref.ReconfigureDvs_Task(spec)
+        return start
@@ -0,0 +1,206 @@
+# Resuming and rolling back a plan run from its journal.
+#
+# Resume runs the journaled rows again with the steps the journal confirmed
+# skipped. Rollback undoes a run, finished or not: deleted source port groups
+# are recreated from their recorded config, every NIC the run touched goes back
+# to the port group it started on, the port groups the run created are deleted
+# once empty and the PVLAN map entries it added are removed. Everything is
+# checked against the inventory first, so a rollback can itself be repeated.
+from dataclasses import dataclass, field
+from typing import List
+
+from pyVmomi import vim
+
+from pvlan_migration.batch import INVENTORY_WAIT_TIMEOUT, BatchRunner
+from pvlan_migration.journal import DONE, FAILED, PLANNED, Journal, JournalState
+from pvlan_migration.plan import PlanError, PlanRow
+from pvlan_migration.pvlan import PvlanPlan
+from pvlan_migration.schedule import DEFAULT_MAX_PER_HOST, HostSlots
+from pvlan_migration.serialize import decode
+from pvlan_migration.tasks import fault_message, reconfigure_vms, run_task, run_tasks
+from pvlan_migration.workflow import nic_backing_change, portgroup_spec_from_config
+
+
+@dataclass
+class RollbackResult:
+    restored_portgroups: List[str] = field(default_factory=list)
+    vm_results: List = field(default_factory=list)
+    deleted_portgroups: List[str] = field(default_factory=list)
+    errors: List[str] = field(default_factory=list)
+
+    @property
+    def ok(self):
+        return not self.errors
+
+
+def journaled_rows(state):
+    # The rows were resolved before the journal was written, defaults included
+    return [PlanRow(**row) for row in state.rows]
+
+
+def resume(journal_path, inventory, on_event=None, **runner_options):
+    state = JournalState.load(journal_path)
+    if not state.rows:
+        raise PlanError(f"{journal_path} does not contain a plan run to resume")
+    journal = Journal(journal_path)
+    try:
+        runner = BatchRunner(inventory, direct=state.direct, on_event=on_event, journal=journal, resume=state,
+                             **runner_options)
+        return runner.run(journaled_rows(state))
+    finally:
+        journal.close()
+
+
+def _restore_portgroups(inventory, journal, state, result, report, retries=0, retry_delay=0, **task_options):
+    # Recreate the deleted source port groups, one task per switch. Returns
+    # the old key -> new key of every source port group.
+    key_map = {}
+    missing = {}
+    for entry in state.deleted:
+        pg = inventory.portgroup(entry['vds'], entry['name'])
+        if pg is not None:
+            key_map[entry['key']] = pg.key
+        elif all(e['name'] != entry['name'] for e in missing.get(entry['vds'], [])):
+            missing.setdefault(entry['vds'], []).append(entry)
+
+    for vds_name, entries in missing.items():
+        names = [entry['name'] for entry in entries]
+        try:
+            journal.record('rollback_portgroup_create', PLANNED, vds=vds_name, names=names)
+            specs = [portgroup_spec_from_config(decode(entry['config'])) for entry in entries]
+            switch_ref = inventory.switch(vds_name).ref
+            run_task(lambda: switch_ref.AddDVPortgroup_Task(specs), retries, retry_delay)
+            if not inventory.wait_until(lambda inv: all(inv.portgroup(vds_name, n) for n in names),
+                                        INVENTORY_WAIT_TIMEOUT):
+                raise PlanError(f"Timed out waiting for {', '.join(names)}")
+            journal.record('rollback_portgroup_create', vds=vds_name, names=names)
+        except Exception as e:
+            result.errors.append(f"Recreating {', '.join(names)} on {vds_name} failed: {fault_message(e)}")
+            report(result.errors[-1], False)
+            continue
+        for entry in entries:
+            key_map[entry['key']] = inventory.portgroup(vds_name, entry['name']).key
+        result.restored_portgroups.extend(names)
+        report(f"Recreated {', '.join(names)} on {vds_name}", True)
+    return key_map
+
+
+def _restore_nics(inventory, journal, state, key_map, result, report, **task_options):
+    # One ReconfigVM_Task per VM putting all of its moved NICs back at once,
+    # VMs are reconfigured concurrently
+    moves_by_vm = {}
+    for (moid, _), move in state.original_backings().items():
+        moves_by_vm.setdefault(moid, []).append(move)
+
+    vm_specs = []
+    vm_entries = []
+    for moid, moves in moves_by_vm.items():
+        vm = inventory.vms.get(moid)
+        if vm is None:
+            result.errors.append(f"VM {moves[0]['vm_name']} is no longer in the inventory")
+            continue
+        nics = {nic.key: nic for nic in vm.nics}
+        device_change = []
+        entries = []
+        for move in moves:
+            nic = nics.get(move['device'])
+            original_key = key_map.get(move['from_key'], move['from_key'])
+            if nic is None or nic.portgroup_key == original_key:
+                continue
+            device_change.append(nic_backing_change(nic.device, move['switch_uuid'], original_key))
+            entries.append({'op': 'nic_restore', 'vm': moid, 'vm_name': vm.name, 'device': nic.key,
+                            'from_key': nic.portgroup_key, 'to_key': original_key})
+        if device_change:
+            vm_specs.append((vm.name, vm.ref, vim.vm.ConfigSpec(deviceChange=device_change)))
+            vm_entries.append(entries)
+
+    journal.record_many([dict(entry, status=PLANNED) for entries in vm_entries for entry in entries])
+
+    def on_result(vm_result):
+        if vm_result.ok:
+            journal.record_many([dict(entry, status=DONE) for entry in vm_entries[vm_result.index]])
+        report(f"{vm_result.name}: " + ("NICs restored" if vm_result.ok else vm_result.error), vm_result.ok)
+
+    result.vm_results = reconfigure_vms(vm_specs, inventory=inventory, on_result=on_result, **task_options)
+    failed = [r.name for r in result.vm_results if not r.ok]
+    if failed:
+        result.errors.append(f"{len(failed)} VM(s) could not be restored: {', '.join(failed)}")
+
+
+def _delete_created_portgroups(inventory, journal, state, result, report, **task_options):
+    # Port groups created by the run, under the names they ended up with
+    renamed = {(entry['vds'], entry['old_name']): entry['name'] for entry in state.renamed}
+    created = []
+    for entry in state.created:
+        for name in entry['names']:
+            name = renamed.get((entry['vds'], name), name)
+            if (entry['vds'], name) not in created:
+                created.append((entry['vds'], name))
+
+    def is_empty(inv):
+        return all(not getattr(inv.portgroup(vds_name, name), 'vm_refs', None) for vds_name, name in created)
+
+    if not inventory.wait_until(is_empty, INVENTORY_WAIT_TIMEOUT):
+        result.errors.append("Some port groups created by the run still have VMs, they were left in place")
+
+    jobs = []
+    job_portgroups = []
+    for vds_name, name in created:
+        pg = inventory.portgroup(vds_name, name)
+        if pg is None or pg.vm_refs:
+            continue
+        journal.record('rollback_portgroup_delete', PLANNED, vds=vds_name, name=name, key=pg.key)
+        jobs.append((name, lambda pg=pg: pg.ref.Destroy_Task()))
+        job_portgroups.append((vds_name, pg))
+    for task_result in run_tasks(jobs, **task_options):
+        vds_name, pg = job_portgroups[task_result.index]
+        if task_result.ok:
+            inventory.discard_portgroup(pg.key)
+            journal.record('rollback_portgroup_delete', vds=vds_name, name=pg.name, key=pg.key)
+            result.deleted_portgroups.append(pg.name)
+            report(f"Deleted {pg.name}", True)
+        else:
+            result.errors.append(f"Deleting {pg.name} failed: {task_result.error}")
+            report(result.errors[-1], False)
+
+
+def _remove_pvlan_entries(inventory, journal, state, result, report):
+    # Secondary entries have to go before the primary they hang off
+    pvlan_plan = PvlanPlan()
+    for entry in state.pvlan_added:
+        for primary, secondary, pvlan_type in reversed(entry['entries']):
+            pvlan_plan.add_entry(entry['vds'], primary, secondary, pvlan_type)
+    pending = pvlan_plan.pending(inventory, operation='remove')
+    for vds_name, entries in pending.items():
+        journal.record('rollback_pvlan_map_remove', PLANNED, vds=vds_name, entries=entries)
+    for pvlan_result in pvlan_plan.apply(inventory, operation='remove'):
+        if pvlan_result.ok:
+            journal.record('rollback_pvlan_map_remove', vds=pvlan_result.name, entries=pending[pvlan_result.name])
+            report(f"Removed PVLAN map entries from {pvlan_result.name}", True)
+        else:
+            result.errors.append(f"Removing PVLAN map entries from {pvlan_result.name} failed: {pvlan_result.error}")
+            report(result.errors[-1], False)
+
+
+def rollback(journal_path, inventory, max_in_flight=8, retries=2, retry_delay=5, on_event=None,
+             max_per_host=DEFAULT_MAX_PER_HOST):
+    # on_event(message, ok) is called for every action taken
+    def report(message, ok):
+        if on_event is not None:
+            on_event(message, ok)
+
+    state = JournalState.load(journal_path)
+    task_options = {'max_in_flight': max_in_flight, 'retries': retries, 'retry_delay': retry_delay}
+    result = RollbackResult()
+    journal = Journal(journal_path)
+    try:
+        journal.record('rollback', PLANNED)
+        key_map = _restore_portgroups(inventory, journal, state, result, report, **task_options)
+        _restore_nics(inventory, journal, state, key_map, result, report, host_slots=HostSlots(max_per_host),
+                      **task_options)
+        _delete_created_portgroups(inventory, journal, state, result, report, **task_options)
+        _remove_pvlan_entries(inventory, journal, state, result, report)
+        journal.record('rollback', DONE if result.ok else FAILED, errors=result.errors)
+    finally:
+        journal.close()
+    return result
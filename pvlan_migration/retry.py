@@ -0,0 +1,131 @@
+# Retry policy for vCenter calls.
+#
+# Faults are classified first: conflicts with another change, busy resources
+# and throttling go away on their own and are retried with exponential backoff
+# and jitter, while invalid state, permission problems and anything unknown
+# fail right away. When vCenter starts throttling, every worker sharing the
+# Throttle pauses, not just the one that was turned away.
+import http.client
+import random
+import socket
+import threading
+import time
+from dataclasses import dataclass
+
+from pyVmomi import vim, vmodl
+
+CONCURRENT_MODIFICATION = 'concurrent modification'
+RESOURCE_BUSY = 'resource busy'
+THROTTLED = 'throttled'
+CONNECTION = 'connection'
+INVALID_STATE = 'invalid state'
+AUTH = 'auth'
+FATAL = 'fatal'
+
+RETRYABLE = {CONCURRENT_MODIFICATION, RESOURCE_BUSY, THROTTLED, CONNECTION}
+
+# HTTP status codes vCenter answers with when it sheds load
+THROTTLE_STATUSES = ('429', '503')
+
+
+def classify_fault(fault):
+    if isinstance(fault, vim.fault.ConcurrentAccess):
+        return CONCURRENT_MODIFICATION
+    if isinstance(fault, (vim.fault.ResourceInUse, vim.fault.TaskInProgress, vim.fault.Timedout,
+                          vim.fault.ResourceNotAvailable, vmodl.fault.HostCommunication)):
+        return RESOURCE_BUSY
+    if isinstance(fault, (vmodl.fault.SecurityError, vim.fault.InvalidLogin)):
+        return AUTH
+    if isinstance(fault, vim.fault.InvalidState):
+        # Waiting does not power a VM on or bring a host out of maintenance
+        return INVALID_STATE
+    if isinstance(fault, vmodl.fault.RequestCanceled):
+        # Someone canceled the task, running it again would overrule them
+        return FATAL
+    if isinstance(fault, vmodl.MethodFault):
+        msg = (getattr(fault, 'msg', None) or '').lower()
+        if 'throttl' in msg or 'too many' in msg:
+            return THROTTLED
+        return FATAL
+    if isinstance(fault, http.client.HTTPException):
+        if str(fault).split(' ', 1)[0] in THROTTLE_STATUSES:
+            return THROTTLED
+        return CONNECTION
+    if isinstance(fault, (ConnectionError, socket.timeout)):
+        return CONNECTION
+    return FATAL
+
+
+def is_retryable(fault):
+    return classify_fault(fault) in RETRYABLE
+
+
+@dataclass
+class RetryPolicy:
+    retries: int = 0
+    base_delay: float = 1.0
+    max_delay: float = 60.0
+
+    def delay(self, attempt):
+        # Exponential backoff with equal jitter: half of the delay is fixed,
+        # the other half random so parallel workers spread out
+        delay = min(self.max_delay, self.base_delay * 2 ** (attempt - 1))
+        return delay / 2 + random.uniform(0, delay / 2)
+
+
+class Throttle:
+    # Shared pause gate. Each throttling fault doubles the pause every caller
+    # waits out before its next call, each success halves it again.
+    def __init__(self, base_delay=1.0, max_delay=60.0):
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.penalty = 0.0
+        self._resume_at = 0.0
+        self._lock = threading.Lock()
+
+    def wait(self):
+        with self._lock:
+            delay = self._resume_at - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+
+    def throttled(self):
+        with self._lock:
+            self.penalty = min(self.max_delay, max(self.base_delay, self.penalty * 2))
+            pause = self.penalty / 2 + random.uniform(0, self.penalty / 2)
+            self._resume_at = max(self._resume_at, time.monotonic() + pause)
+
+    def succeeded(self):
+        with self._lock:
+            if self.penalty:
+                self.penalty = self.penalty / 2 if self.penalty / 2 >= self.base_delay else 0.0
+
+
+# Shared by all task runs of the process that do not bring their own
+THROTTLE = Throttle()
+
+
+def retry_call(call, policy, throttle=THROTTLE, on_attempt=None):
+    # Call call() until it succeeds, raising the last fault once it is not
+    # retryable or the retries are used up. on_attempt(n) is called before
+    # every attempt.
+    attempt = 1
+    while True:
+        if on_attempt is not None:
+            on_attempt(attempt)
+        if throttle is not None:
+            throttle.wait()
+        try:
+            result = call()
+        except Exception as e:
+            kind = classify_fault(e)
+            if kind == THROTTLED and throttle is not None:
+                throttle.throttled()
+            if kind not in RETRYABLE or attempt > policy.retries:
+                raise
+            time.sleep(policy.delay(attempt))
+            attempt += 1
+            continue
+        if throttle is not None:
+            throttle.succeeded()
+        return result
@@ -0,0 +1,109 @@
+# Ordering of VM reconfigurations across ESXi hosts.
+#
+# vCenter hands every ReconfigVM_Task to the agent of the host the VM runs on.
+# When most VMs of a port group sit on one host, reconfiguring them together
+# queues all of the work on that agent while the other hosts are idle.
+# HostScheduler gives out jobs so that no host runs more than max_per_host at
+# a time, the hosts take turns, and jobs with a lower priority number start
+# before the rest. Jobs on an unknown host are never held back.
+#
+# The priority comes from a numeric custom attribute on the VM, so critical
+# workloads can be marked in vCenter and finish their cutover first.
+import math
+import threading
+from collections import deque
+
+from pyVmomi import vim
+
+# Reconfigurations running on one host at the same time
+DEFAULT_MAX_PER_HOST = 4
+
+
+class HostSlots:
+    # Reconfigurations running per host. One instance is shared by all port
+    # groups of a run, so the limit also holds while several are converted in
+    # parallel. A max_per_host of None or 0 only keeps count.
+    def __init__(self, max_per_host=DEFAULT_MAX_PER_HOST):
+        self.max_per_host = max_per_host
+        self.running = {}
+        self.peak = {}
+        self.changed = threading.Condition()
+
+    def free(self, host):
+        return host is None or not self.max_per_host or self.running.get(host, 0) < self.max_per_host
+
+    def take(self, host):
+        # Called with changed held
+        self.running[host] = self.running.get(host, 0) + 1
+        self.peak[host] = max(self.peak.get(host, 0), self.running[host])
+
+    def release(self, host):
+        with self.changed:
+            self.running[host] -= 1
+            self.changed.notify_all()
+
+
+class HostScheduler:
+    # hosts and priorities are sequences with one entry per job, a priority
+    # of None sorts after every number. Ties keep the order of the jobs.
+    def __init__(self, count, hosts=None, priorities=None, slots=None):
+        self.slots = slots or HostSlots(None)
+        self._queues = {}
+        for index in range(count):
+            host = hosts[index] if hosts is not None else None
+            priority = priorities[index] if priorities is not None else None
+            rank = math.inf if priority is None else priority
+            self._queues.setdefault(host, []).append((rank, index))
+        for host, jobs in self._queues.items():
+            self._queues[host] = deque(sorted(jobs))
+        # Hosts in the order they get their next turn
+        self._turns = list(self._queues)
+        self._queued = count
+
+    def _pick(self):
+        # The best ranked head of a host with a free slot, of equal ranks the
+        # host that waited longest
+        candidates = [host for host in self._turns if self._queues[host] and self.slots.free(host)]
+        if not candidates:
+            return None
+        # min() keeps the first of equal ranks
+        best = min(candidates, key=lambda host: self._queues[host][0][0])
+        _, index = self._queues[best].popleft()
+        self._turns.remove(best)
+        self._turns.append(best)
+        self.slots.take(best)
+        self._queued -= 1
+        return index, best
+
+    def next(self):
+        # (job index, host) of the job to start, blocks while every host with
+        # jobs left is at its limit. None once all jobs were handed out.
+        with self.slots.changed:
+            while self._queued:
+                picked = self._pick()
+                if picked is not None:
+                    return picked
+                self.slots.changed.wait()
+            return None
+
+    def done(self, host):
+        self.slots.release(host)
+
+
+def custom_field_key(content, name):
+    # Key of the VM custom attribute called name, None if there is none
+    for field in content.customFieldsManager.field or []:
+        if field.name == name and field.managedObjectType in (None, vim.VirtualMachine):
+            return field.key
+    return None
+
+
+def attribute_priority(field_key):
+    # priority(vm) for reconfigure_vms reading an integer custom attribute,
+    # VMs without a numeric value go last
+    def priority(vm):
+        try:
+            return int(vm.attributes.get(field_key))
+        except (TypeError, ValueError):
+            return None
+    return priority
@@ -0,0 +1,67 @@
+# JSON encoding of pyVmomi objects.
+#
+# Data objects are written as dicts carrying their vmodl type name, managed
+# object references as type and id, and unset properties are left out so files
+# stay small. decode() rebuilds the exact pyVmomi objects, which lets the
+# planner run from a saved inventory without a vCenter.
+import base64
+import datetime
+
+from pyVmomi import Iso8601, VmomiSupport
+
+TYPE_KEY = '_type'
+REF_KEY = '_ref'
+DATETIME_KEY = '_datetime'
+BYTES_KEY = '_bytes'
+
+
+def encode(value):
+    if value is None or isinstance(value, (bool, int, float, str)):
+        # Enum values are str subclasses, write them as plain strings
+        return value if type(value) in (bool, int, float, str) or value is None else str(value)
+    if isinstance(value, VmomiSupport.ManagedObject):
+        return {REF_KEY: f"{value.__class__.__name__}:{value._moId}"}
+    if isinstance(value, VmomiSupport.DataObject):
+        data = {TYPE_KEY: value.__class__.__name__}
+        for prop in value._GetPropertyList():
+            prop_value = getattr(value, prop.name)
+            if prop_value is None or (isinstance(prop_value, list) and not prop_value):
+                continue
+            data[prop.name] = encode(prop_value)
+        return data
+    if isinstance(value, datetime.datetime):
+        return {DATETIME_KEY: value.isoformat()}
+    if isinstance(value, bytes):
+        return {BYTES_KEY: base64.b64encode(value).decode('ascii')}
+    if isinstance(value, type):
+        return value.__name__
+    if isinstance(value, (list, tuple)):
+        return [encode(item) for item in value]
+    if isinstance(value, dict):
+        return {key: encode(item) for key, item in value.items()}
+    raise TypeError(f"Cannot encode {type(value).__name__}")
+
+
+def ref_from_string(text):
+    type_name, moid = text.split(':', 1)
+    return VmomiSupport.GetVmodlType(type_name)(moid)
+
+
+def decode(value):
+    if isinstance(value, list):
+        return [decode(item) for item in value]
+    if not isinstance(value, dict):
+        return value
+    if REF_KEY in value:
+        return ref_from_string(value[REF_KEY])
+    if DATETIME_KEY in value:
+        return Iso8601.ParseISO8601(value[DATETIME_KEY])
+    if BYTES_KEY in value:
+        return base64.b64decode(value[BYTES_KEY])
+    if TYPE_KEY in value:
+        obj = VmomiSupport.GetVmodlType(value[TYPE_KEY])()
+        for name, item in value.items():
+            if name != TYPE_KEY:
+                setattr(obj, name, decode(item))
+        return obj
+    return {key: decode(item) for key, item in value.items()}
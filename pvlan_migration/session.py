@@ -0,0 +1,184 @@
+# Pool of vCenter connections sharing one login.
+#
+# A pyVmomi stub sends every call of every thread over its own few HTTP
+# connections. The pool keeps several stubs that all carry the session cookie
+# of a single login and hands one to each call, so parallel workers do not
+# queue behind each other. Managed objects are bound to a PooledStub, which
+# borrows a stub per call, logs in again when the session expired and retries
+# the call once. Idle stubs are kept alive in the background so long prompt
+# pauses do not lose the session.
+import queue
+import threading
+import time
+
+from pyVmomi import SoapAdapter, vim
+
+from pvlan_migration.metrics import METRICS
+
+# Seconds a stub may sit idle before a keep-alive call is made on it
+KEEPALIVE_INTERVAL = 300
+
+
+class PoolStats:
+    def __init__(self):
+        self.acquisitions = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self.relogins = 0
+        self.keepalives = 0
+
+    @property
+    def wait_average(self):
+        return self.wait_total / self.acquisitions if self.acquisitions else 0.0
+
+    def as_dict(self):
+        return {'acquisitions': self.acquisitions, 'wait_total': round(self.wait_total, 3),
+                'wait_max': round(self.wait_max, 3), 'wait_average': round(self.wait_average, 4),
+                'relogins': self.relogins, 'keepalives': self.keepalives}
+
+
+def _clone_stub(stub):
+    # A new stub for the same endpoint, authenticated with the same cookie
+    clone = SoapAdapter.SoapStubAdapter(url=f"https://{stub.host}{stub.path}", version=stub.version,
+                                        sslContext=stub.schemeArgs.get('context'), poolSize=1)
+    clone.cookie = stub.cookie
+    return clone
+
+
+def _count_bytes(stub, metrics):
+    # Request bodies are counted as they are sent, responses by their
+    # Content-Length (chunked responses are not counted)
+    def count_request(request):
+        metrics.record_bytes(sent=len(request))
+        return request
+    stub.requestModifierList.append(count_request)
+
+    if isinstance(stub.scheme, type):
+        class CountingConnection(stub.scheme):
+            def getresponse(self, *args, **kwargs):
+                response = super().getresponse(*args, **kwargs)
+                metrics.record_bytes(received=response.length or 0)
+                return response
+        stub.scheme = CountingConnection
+
+
+class SessionPool:
+    # connect() logs in and returns a ServiceInstance, it is called once up
+    # front and again whenever the session has expired
+    def __init__(self, connect, size=4, keepalive_interval=KEEPALIVE_INTERVAL, metrics=METRICS):
+        self._connect = connect
+        self.size = max(1, size)
+        self.metrics = metrics
+        self.stats = PoolStats()
+        self._login_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._generation = 0
+        self._closed = threading.Event()
+
+        primary = connect()._stub
+        if isinstance(primary, SoapAdapter.SoapStubAdapter):
+            self._stubs = [primary] + [_clone_stub(primary) for _ in range(self.size - 1)]
+            if metrics is not None:
+                for stub in self._stubs:
+                    _count_bytes(stub, metrics)
+        else:
+            # A local simulator has no HTTP connection to clone, its one stub
+            # serves every worker
+            self._stubs = [primary] * self.size
+        self._last_used = {id(stub): time.monotonic() for stub in self._stubs}
+        self._idle = queue.LifoQueue()
+        for stub in self._stubs:
+            self._idle.put(stub)
+
+        self.stub = PooledStub(self)
+        self._keepalive = None
+        if keepalive_interval:
+            self._keepalive = threading.Thread(target=self._keep_alive, args=(keepalive_interval,), daemon=True)
+            self._keepalive.start()
+
+    def service_instance(self):
+        return vim.ServiceInstance('ServiceInstance', self.stub)
+
+    def acquire(self):
+        # Returns a stub and the login generation it was handed out under
+        started = time.monotonic()
+        stub = self._idle.get()
+        waited = time.monotonic() - started
+        with self._stats_lock:
+            self.stats.acquisitions += 1
+            self.stats.wait_total += waited
+            self.stats.wait_max = max(self.stats.wait_max, waited)
+        return stub, self._generation
+
+    def release(self, stub):
+        self._last_used[id(stub)] = time.monotonic()
+        self._idle.put(stub)
+
+    def relogin(self, generation):
+        # Log in again unless another worker already did since generation
+        with self._login_lock:
+            if generation != self._generation:
+                return
+            # Only the cookie of the new login is used, the connections of the
+            # stub it came with are released straight away
+            login_stub = self._connect()._stub
+            for stub in self._stubs:
+                stub.cookie = login_stub.cookie
+            if login_stub not in self._stubs:
+                login_stub.DropConnections()
+            self._generation += 1
+            self.stats.relogins += 1
+
+    def _keep_alive(self, interval):
+        while not self._closed.wait(min(interval, 60)):
+            for _ in range(self._idle.qsize()):
+                try:
+                    stub = self._idle.get_nowait()
+                except queue.Empty:
+                    break
+                generation = self._generation
+                try:
+                    if time.monotonic() - self._last_used[id(stub)] >= interval:
+                        vim.ServiceInstance('ServiceInstance', stub).CurrentTime()
+                        self.stats.keepalives += 1
+                except vim.fault.NotAuthenticated:
+                    self.relogin(generation)
+                except Exception:
+                    # The next real call retries and reports connection errors
+                    pass
+                finally:
+                    self.release(stub)
+
+    def close(self):
+        self._closed.set()
+        try:
+            self.service_instance().content.sessionManager.Logout()
+        except Exception:
+            pass
+        for stub in set(self._stubs):
+            stub.DropConnections()
+
+
+class PooledStub(SoapAdapter.StubAdapterBase):
+    def __init__(self, pool):
+        SoapAdapter.StubAdapterBase.__init__(self, version=pool._stubs[0].version)
+        self.pool = pool
+
+    def InvokeMethod(self, mo, info, args):
+        for attempt in range(2):
+            stub, generation = self.pool.acquire()
+            started = time.monotonic()
+            status = None
+            try:
+                status, obj = stub.InvokeMethod(mo, info, args, self)
+            finally:
+                self.pool.release(stub)
+                if self.pool.metrics is not None:
+                    self.pool.metrics.record_call(info.wsdlName, time.monotonic() - started, status == 200)
+            if status == 200:
+                return obj
+            if attempt == 0 and isinstance(obj, vim.fault.NotAuthenticated):
+                # The session expired, log in again and repeat the call
+                self.pool.relogin(generation)
+                continue
+            raise obj
@@ -0,0 +1,185 @@
+# Concurrent execution of vCenter tasks.
+#
+# Calls such as ReconfigVM_Task return as soon as vCenter has queued the work,
+# so the outcome of a change is only known once the task reaches a final state.
+# Everything in here tracks each task until then and reports the real result.
+import queue
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Optional
+
+from pyVmomi import vmodl
+
+from pvlan_migration.metrics import METRICS
+from pvlan_migration.retry import THROTTLE, RetryPolicy, classify_fault, retry_call
+from pvlan_migration.schedule import HostScheduler
+from pvlan_migration.workflow import rename_portgroup_spec
+
+TASK_SUCCESS = 'success'
+TASK_ERROR = 'error'
+
+
+class TaskTimeout(Exception):
+    pass
+
+
+# What run_task raises when vCenter turns a change down or never finishes it
+TASK_FAULTS = (vmodl.MethodFault, TaskTimeout)
+
+
+@dataclass
+class TaskResult:
+    name: str
+    ok: bool
+    error: Optional[str] = None
+    fault_kind: Optional[str] = None
+    index: int = -1
+    attempts: int = 0
+    started: float = 0.0
+    finished: float = 0.0
+
+    @property
+    def duration(self):
+        return self.finished - self.started
+
+
+def fault_message(fault):
+    if fault is None:
+        return "unknown error"
+    msg = getattr(fault, 'msg', None)
+    if msg:
+        return msg
+    return str(fault) or type(fault).__name__
+
+
+def wait_for_task(task, poll_interval=0.2, max_poll_interval=2.0, timeout=None):
+    # Poll the task until vCenter reports success or error. The interval grows
+    # while the task is still running so long tasks do not flood vCenter.
+    deadline = None if timeout is None else time.monotonic() + timeout
+    delay = poll_interval
+    while True:
+        info = task.info
+        if info.state == TASK_SUCCESS:
+            return info.result
+        if info.state == TASK_ERROR:
+            raise info.error
+        if deadline is not None and time.monotonic() >= deadline:
+            raise TaskTimeout(f"Task did not finish within {timeout} seconds")
+        time.sleep(delay)
+        delay = min(delay * 2, max_poll_interval)
+
+
+def _start_and_wait(start, poll_interval, timeout):
+    task = start()
+    # start() returns None when there turned out to be nothing to do
+    if task is not None:
+        return wait_for_task(task, poll_interval=poll_interval, timeout=timeout)
+    return None
+
+
+def run_task(start, retries=0, retry_delay=1.0, poll_interval=0.2, timeout=None, throttle=THROTTLE):
+    # Issue a single task through the retry policy and wait for it. Returns the
+    # task result, raises the fault of the last attempt.
+    return retry_call(lambda: _start_and_wait(start, poll_interval, timeout),
+                      RetryPolicy(retries, retry_delay), throttle)
+
+
+def _run_job(index, name, start, policy, throttle, poll_interval, timeout):
+    result = TaskResult(name=name, ok=False, index=index, started=time.monotonic())
+
+    def count_attempt(attempt):
+        result.attempts = attempt
+
+    # A task that timed out is not retried, it may still complete on vCenter
+    # and starting it again would race with it
+    try:
+        retry_call(lambda: _start_and_wait(start, poll_interval, timeout), policy, throttle, count_attempt)
+        result.ok = True
+    except Exception as e:
+        result.error = fault_message(e)
+        result.fault_kind = classify_fault(e)
+    result.finished = time.monotonic()
+    return result
+
+
+def run_tasks(jobs, max_in_flight=8, retries=0, retry_delay=0, poll_interval=0.2, timeout=None, on_result=None,
+              throttle=THROTTLE, hosts=None, priorities=None, host_slots=None):
+    # jobs is a sequence of (name, start) pairs where start() issues the vCenter
+    # call and returns its task. start() is called again for every retry of a
+    # retryable fault, with exponential backoff from retry_delay. At most
+    # max_in_flight tasks are outstanding at any time, hosts and host_slots
+    # bound them per host, see schedule.HostScheduler. on_result is called
+    # from the calling thread as results come in. Results are returned in the
+    # order of the jobs, result.index is the position of its job.
+    jobs = list(jobs)
+    if not jobs:
+        return []
+    policy = RetryPolicy(retries, retry_delay)
+    scheduler = HostScheduler(len(jobs), hosts, priorities, host_slots)
+    finished = queue.SimpleQueue()
+
+    def worker():
+        while True:
+            picked = scheduler.next()
+            if picked is None:
+                return
+            index, host = picked
+            name, start = jobs[index]
+            try:
+                result = _run_job(index, name, start, policy, throttle, poll_interval, timeout)
+            finally:
+                scheduler.done(host)
+            finished.put(result)
+
+    results = [None] * len(jobs)
+    workers = max(1, min(max_in_flight, len(jobs)))
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for _ in range(workers):
+            pool.submit(worker)
+        for _ in range(len(jobs)):
+            result = finished.get()
+            results[result.index] = result
+            if on_result is not None:
+                on_result(result)
+    return results
+
+
+def reconfigure_vms(vm_specs, inventory=None, on_result=None, metrics=METRICS, priority=None, **kwargs):
+    # vm_specs is a sequence of (name, vm, vim.vm.ConfigSpec) triples. The name
+    # is passed separately so reporting does not read vm.name from vCenter.
+    # With an inventory the VMs are spread over their hosts, and priority(vm)
+    # of the VmInfo orders them. Each confirmed reconfiguration is applied to
+    # inventory right away and extends the VM's outage window in metrics.
+    vm_specs = list(vm_specs)
+    jobs = [(name, lambda vm=vm, spec=spec: vm.ReconfigVM_Task(spec=spec)) for name, vm, spec in vm_specs]
+    if inventory is not None:
+        vms = [inventory.vm(vm) for _, vm, _ in vm_specs]
+        kwargs['hosts'] = [vm.host_moid if vm is not None else None for vm in vms]
+        if priority is not None:
+            kwargs['priorities'] = [priority(vm) if vm is not None else None for vm in vms]
+
+    def record(result):
+        if result.ok:
+            name, vm, spec = vm_specs[result.index]
+            if inventory is not None:
+                inventory.record_reconfiguration(vm, spec)
+            if metrics is not None:
+                metrics.record_vm_reconfiguration(vm._moId, name, result.started, result.finished)
+        if on_result is not None:
+            on_result(result)
+    return run_tasks(jobs, on_result=record, **kwargs)
+
+
+def rename_portgroups(renames, **kwargs):
+    # renames is a sequence of (PortgroupInfo, new name) pairs. Retries read
+    # the port group config again in case configVersion went stale.
+    def job(pg, new_name):
+        attempts = []
+
+        def start():
+            config = pg.config if not attempts else pg.ref.config
+            attempts.append(config)
+            return pg.ref.ReconfigureDVPortgroup_Task(rename_portgroup_spec(new_name, config.configVersion))
+        return start
+    return run_tasks([(pg.name, job(pg, new_name)) for pg, new_name in renames], **kwargs)
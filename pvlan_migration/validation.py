@@ -0,0 +1,313 @@
+# Pre-flight validation of conversions.
+#
+# Every row of a plan, or the single conversion of an interactive run, is
+# checked against one inventory snapshot before anything is changed, and all
+# problems are reported together instead of one per attempt. Errors are what
+# vCenter would reject halfway through a run: VLAN IDs out of range, PVLAN map
+# entries that clash with the switch or with other rows, port group names that
+# are taken, sources that are trunks, private VLANs or uplinks and dummy port
+# groups without room for the parked NICs. Warnings, such as VMs that keep a
+# NIC on a standard switch, do not stop a run.
+from dataclasses import dataclass, field
+from typing import List
+
+from pyVmomi import vim
+
+from pvlan_migration.inventory import BACKING_OTHER, BACKING_STANDARD
+from pvlan_migration.naming import CUTOVER_SUFFIX, TARGET_SUFFIXES, pvlan_portgroup_names
+from pvlan_migration.pvlan import ISOLATED, PROMISCUOUS
+
+ERROR = 'error'
+WARNING = 'warning'
+
+VLAN_MIN = 1
+VLAN_MAX = 4094
+
+# VM names listed in a single finding before the rest is summarised
+MAX_LISTED_VMS = 5
+
+
+@dataclass
+class Finding:
+    severity: str
+    line: int
+    label: str
+    message: str
+
+    def __str__(self):
+        return f"Row {self.line} ({self.label}): {self.message}"
+
+
+@dataclass
+class ValidationReport:
+    findings: List[Finding] = field(default_factory=list)
+
+    @property
+    def errors(self):
+        return [str(f) for f in self.findings if f.severity == ERROR]
+
+    @property
+    def warnings(self):
+        return [str(f) for f in self.findings if f.severity == WARNING]
+
+    @property
+    def ok(self):
+        return not any(f.severity == ERROR for f in self.findings)
+
+
+def single_vlan_id(vlan_spec):
+    # The VLAN ID of a plain VLAN port group, None for untagged, trunk and
+    # private VLAN port groups
+    if isinstance(vlan_spec, vim.dvs.VmwareDistributedVirtualSwitch.VlanIdSpec):
+        vlan_id = vlan_spec.vlanId
+        return vlan_id if isinstance(vlan_id, int) and vlan_id > 0 else None
+    return None
+
+
+def describe_vlan(vlan_spec):
+    if isinstance(vlan_spec, vim.dvs.VmwareDistributedVirtualSwitch.TrunkVlanSpec):
+        ranges = [f"{r.start}-{r.end}" if r.start != r.end else str(r.start) for r in vlan_spec.vlanId or []]
+        return f"a VLAN trunk ({', '.join(ranges)})"
+    if isinstance(vlan_spec, vim.dvs.VmwareDistributedVirtualSwitch.PvlanSpec):
+        return f"a private VLAN port group (PVLAN {vlan_spec.pvlanId})"
+    if isinstance(vlan_spec, vim.dvs.VmwareDistributedVirtualSwitch.VlanIdSpec):
+        return f"VLAN {vlan_spec.vlanId}" if vlan_spec.vlanId else "untagged"
+    return "without a VLAN setting"
+
+
+def _vm_list(names):
+    names = sorted(names)
+    listed = ', '.join(names[:MAX_LISTED_VMS])
+    if len(names) > MAX_LISTED_VMS:
+        listed += f" and {len(names) - MAX_LISTED_VMS} more"
+    return listed
+
+
+class _SwitchIndex:
+    # What the checks need from one switch, built in one pass over its
+    # port groups and PVLAN map
+    def __init__(self, inventory, switch):
+        # secondary VLAN -> (primary VLAN, type), primary VLAN -> isolated secondary
+        self.secondary_of = {}
+        self.isolated_of = {}
+        for entry in switch.pvlan_config:
+            self.secondary_of[entry.secondaryVlanId] = (entry.primaryVlanId, entry.pvlanType)
+            if entry.pvlanType == ISOLATED:
+                self.isolated_of[entry.primaryVlanId] = entry.secondaryVlanId
+        # VLAN ID -> names of the plain VLAN port groups using it
+        self.vlan_users = {}
+        for key in list(switch.portgroup_keys):
+            pg = inventory.portgroup_by_key(key)
+            vlan_id = single_vlan_id(pg.vlan) if pg is not None else None
+            if vlan_id is not None:
+                self.vlan_users.setdefault(vlan_id, []).append(pg.name)
+
+
+class _Validator:
+    def __init__(self, inventory, direct):
+        self.inventory = inventory
+        self.direct = direct
+        self.report = ValidationReport()
+        self._switches = {}
+
+    def switch_index(self, switch):
+        index = self._switches.get(switch.name)
+        if index is None:
+            index = self._switches[switch.name] = _SwitchIndex(self.inventory, switch)
+        return index
+
+    def add(self, severity, row, message):
+        self.report.findings.append(Finding(severity, row.line, row.label, message))
+
+    def error(self, row, message):
+        self.add(ERROR, row, message)
+
+    def warning(self, row, message):
+        self.add(WARNING, row, message)
+
+    def check_source(self, row, source):
+        # Fill in the VLAN defaults from the source and check it can be converted
+        config = source.config
+        if config is not None and getattr(config, 'uplink', False):
+            self.error(row, f"port group {row.source_port_group} is an uplink port group")
+        vlan_spec = source.vlan
+        if isinstance(vlan_spec, (vim.dvs.VmwareDistributedVirtualSwitch.TrunkVlanSpec,
+                                  vim.dvs.VmwareDistributedVirtualSwitch.PvlanSpec)):
+            self.error(row, f"port group {row.source_port_group} is {describe_vlan(vlan_spec)}, "
+                            f"only single VLAN port groups can be converted")
+
+        row.base_name = row.base_name or row.source_port_group
+        if row.promiscuous_vlan is None:
+            row.promiscuous_vlan = single_vlan_id(vlan_spec)
+        if row.isolated_vlan is None and row.promiscuous_vlan is not None:
+            row.isolated_vlan = row.promiscuous_vlan + 1
+
+    def check_vlans(self, row):
+        for column in ('promiscuous_vlan', 'isolated_vlan', 'dummy_vlan'):
+            value = getattr(row, column)
+            if value is None and column != 'dummy_vlan':
+                self.error(row, f"{column} not given and cannot be derived from the source port group")
+            elif value is not None and not VLAN_MIN <= value <= VLAN_MAX:
+                self.error(row, f"{column} {value} is outside {VLAN_MIN}-{VLAN_MAX}")
+        if row.promiscuous_vlan is not None and row.promiscuous_vlan == row.isolated_vlan:
+            self.error(row, f"promiscuous_vlan and isolated_vlan are both {row.promiscuous_vlan}")
+        if row.dummy_vlan is not None and row.dummy_vlan in (row.promiscuous_vlan, row.isolated_vlan):
+            self.error(row, f"dummy_vlan {row.dummy_vlan} is one of the private VLANs of the row")
+
+    def check_pvlan_map(self, row, switch, converted_sources):
+        # The entries must fit the map already on the switch: a VLAN is either
+        # a primary or the secondary of exactly one primary, and a primary has
+        # at most one isolated secondary
+        primary, isolated = row.promiscuous_vlan, row.isolated_vlan
+        if primary is None or isolated is None:
+            return
+        index = self.switch_index(switch)
+        owner = index.secondary_of.get(primary)
+        if owner is not None and owner[0] != primary:
+            self.error(row, f"promiscuous_vlan {primary} is already the {owner[1]} secondary of primary "
+                            f"{owner[0]} in the PVLAN map of {row.vds}")
+        owner = index.secondary_of.get(isolated)
+        if owner is not None and owner != (primary, ISOLATED):
+            if owner[0] == isolated:
+                self.error(row, f"isolated_vlan {isolated} is already a primary VLAN in the PVLAN map of {row.vds}")
+            else:
+                self.error(row, f"isolated_vlan {isolated} is already the {owner[1]} secondary of primary "
+                                f"{owner[0]} in the PVLAN map of {row.vds}")
+        existing_isolated = index.isolated_of.get(primary)
+        if existing_isolated is not None and existing_isolated != isolated:
+            self.error(row, f"primary VLAN {primary} already has isolated secondary {existing_isolated} "
+                            f"on {row.vds}, a primary can have only one")
+
+        # Plain VLAN port groups left on the same IDs would share their traffic
+        for column, vlan_id in (('promiscuous_vlan', primary), ('isolated_vlan', isolated)):
+            users = [name for name in index.vlan_users.get(vlan_id, []) if (row.vds, name) not in converted_sources]
+            if users:
+                self.warning(row, f"{column} {vlan_id} is also the VLAN of port group(s) {', '.join(sorted(users))}")
+
+    def check_names(self, row):
+        for name in pvlan_portgroup_names(row.base_name):
+            if name != row.source_port_group and self.inventory.portgroup(row.vds, name) is not None:
+                self.error(row, f"port group {name} already exists")
+            if self.direct and self.inventory.portgroup(row.vds, name + CUTOVER_SUFFIX) is not None:
+                self.error(row, f"port group {name + CUTOVER_SUFFIX} already exists")
+
+    def check_dummy(self, row):
+        if not row.dummy_port_group:
+            self.error(row, "dummy_port_group is required unless the direct cutover is used")
+        elif self.inventory.portgroup(row.vds, row.dummy_port_group) is None and row.dummy_vlan is None:
+            self.error(row, f"dummy port group {row.dummy_port_group} not found and no dummy_vlan given")
+        elif row.dummy_port_group == row.source_port_group:
+            self.error(row, "dummy port group must differ from the source port group")
+
+    def check_vms(self, row, source):
+        standard = set()
+        other = set()
+        for vm in self.inventory.vms_on_portgroup(source.key):
+            for nic in vm.nics:
+                if nic.backing_type == BACKING_STANDARD:
+                    standard.add(vm.name)
+                elif nic.backing_type == BACKING_OTHER:
+                    other.add(vm.name)
+        if standard:
+            self.warning(row, f"{len(standard)} VM(s) also have NICs on a standard switch, those are not moved: "
+                              f"{_vm_list(standard)}")
+        if other:
+            self.warning(row, f"{len(other)} VM(s) also have NICs that are neither on a standard nor a distributed "
+                              f"switch, those are not moved: {_vm_list(other)}")
+
+    def check_plan(self, rows):
+        # Checks spanning rows: new names must not be taken by another row,
+        # the PVLAN entries of all rows must form one valid map per switch and
+        # a shared dummy port group must hold the NICs of all of its rows,
+        # which may be parked at the same time
+        new_names = {}
+        sources = {(row.vds, row.source_port_group): row for row in rows}
+        secondaries = {}
+        isolated_of = {}
+        parked = {}
+        for row in rows:
+            if row.base_name is None:
+                continue
+            names = list(pvlan_portgroup_names(row.base_name))
+            if self.direct:
+                names += [name + CUTOVER_SUFFIX for name in names]
+            for name in names:
+                other = new_names.setdefault((row.vds, name), row)
+                if other is not row:
+                    self.error(row, f"port group {name} is also created by row {other.line}")
+                source_row = sources.get((row.vds, name))
+                if source_row is not None and source_row is not row:
+                    self.error(row, f"port group {name} is the source of row {source_row.line}")
+            if not self.direct and row.dummy_port_group:
+                dummy_source = sources.get((row.vds, row.dummy_port_group))
+                if dummy_source is not None and dummy_source is not row:
+                    self.error(row, f"dummy port group {row.dummy_port_group} is converted by row {dummy_source.line}")
+
+            primary, isolated = row.promiscuous_vlan, row.isolated_vlan
+            if primary is not None and isolated is not None and primary != isolated:
+                for vlan_id, entry in ((primary, (primary, PROMISCUOUS)), (isolated, (primary, ISOLATED))):
+                    other_entry, other_row = secondaries.setdefault((row.vds, vlan_id), (entry, row))
+                    if other_entry != entry:
+                        self.error(row, f"VLAN {vlan_id} is the {entry[1]} VLAN of primary {entry[0]} here but the "
+                                        f"{other_entry[1]} VLAN of primary {other_entry[0]} in row {other_row.line}")
+                other_isolated, other_row = isolated_of.setdefault((row.vds, primary), (isolated, row))
+                if other_isolated != isolated:
+                    self.error(row, f"primary VLAN {primary} gets isolated secondary {isolated} here but "
+                                    f"{other_isolated} in row {other_row.line}, a primary can have only one")
+
+            if not self.direct and row.dummy_port_group:
+                source = self.inventory.portgroup(row.vds, row.source_port_group)
+                if source is not None:
+                    nics = sum(len(n) for n in self.inventory.nics_on_portgroup(source.key).values())
+                    parked.setdefault((row.vds, row.dummy_port_group), []).append((row, nics))
+
+        for (vds_name, dummy_name), parking_rows in parked.items():
+            self.check_dummy_capacity(vds_name, dummy_name, parking_rows)
+
+    def check_dummy_capacity(self, vds_name, dummy_name, parking_rows):
+        # Port groups that expand on demand or use ephemeral ports never run
+        # out. A dummy port group the run creates itself expands on demand.
+        dummy = self.inventory.portgroup(vds_name, dummy_name)
+        config = dummy.config if dummy is not None else None
+        if config is None or config.autoExpand or config.type == 'ephemeral' or config.numPorts is None:
+            return
+        in_use = sum(len(n) for n in self.inventory.nics_on_portgroup(dummy.key).values())
+        needed = sum(nics for _, nics in parking_rows)
+        free = config.numPorts - in_use
+        if needed > free:
+            row = parking_rows[0][0]
+            self.error(row, f"dummy port group {dummy_name} has {max(free, 0)} free port(s) but up to {needed} NIC(s) "
+                            f"are parked on it, raise numPorts or enable autoExpand")
+
+
+def validate_plan(rows, inventory, direct=False):
+    # Fill in the defaults used by the interactive prompts and check every
+    # row. With direct the rows are converted without parking NICs on a dummy
+    # port group.
+    validator = _Validator(inventory, direct)
+    converted_sources = {(row.vds, row.source_port_group) for row in rows}
+    seen = set()
+    for row in rows:
+        if row.target_type not in TARGET_SUFFIXES:
+            validator.error(row, "target_type must be promiscuous/p or isolated/i")
+        switch = inventory.switch(row.vds)
+        if switch is None:
+            validator.error(row, f"Distributed Virtual Switch {row.vds} not found")
+            continue
+        if (row.vds, row.source_port_group) in seen:
+            validator.error(row, "source port group listed more than once")
+        seen.add((row.vds, row.source_port_group))
+
+        source = inventory.portgroup(row.vds, row.source_port_group)
+        if source is None:
+            validator.error(row, f"port group {row.source_port_group} not found")
+            continue
+        if not direct:
+            validator.check_dummy(row)
+        validator.check_source(row, source)
+        validator.check_vlans(row)
+        validator.check_pvlan_map(row, switch, converted_sources)
+        validator.check_names(row)
+        validator.check_vms(row, source)
+    validator.check_plan(rows)
+    return validator.report
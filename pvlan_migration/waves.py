@@ -0,0 +1,194 @@
+# Canary rollout of the VM reconfigurations of one move.
+#
+# Instead of reconfiguring every VM of a port group at once, the VMs go in
+# waves: a canary set first, then waves growing by a factor until the rest go
+# together, 1, 5, 25, 125 and so on. After each wave the NICs it moved are read
+# back from vCenter. A VM counts as failed when its task failed, one of its
+# NICs did not end up on the target port group or a NIC that was connected
+# before lost its connection. Once the failed share of all VMs reconfigured so
+# far passes the threshold no further wave starts, and with rollback the VMs
+# already moved go back to the port group they came from. A bad change then
+# reaches a handful of VMs instead of the whole port group, while the later
+# waves run with the full parallelism.
+import copy
+import math
+import time
+from dataclasses import dataclass, field
+from typing import List, Tuple
+
+from pyVmomi import vim
+
+from pvlan_migration.plan import PlanError
+from pvlan_migration.workflow import nic_backing_change
+
+HALT = 'halt'
+ROLLBACK = 'rollback'
+WAVE_FAILURE_ACTIONS = [HALT, ROLLBACK]
+
+DEFAULT_CANARY = 1
+DEFAULT_GROWTH = 5
+DEFAULT_MAX_FAILURE_RATE = 0.1
+
+
+@dataclass
+class WavePolicy:
+    canary: int = DEFAULT_CANARY
+    growth: float = DEFAULT_GROWTH
+    # Failed share of the VMs reconfigured so far that stops the rollout once
+    # it is passed, 0 stops at the first failure
+    max_failure_rate: float = DEFAULT_MAX_FAILURE_RATE
+    on_failure: str = HALT
+    # Seconds to wait after each wave before its NICs are checked
+    pause: float = 0.0
+
+    def sizes(self, total):
+        # Wave sizes adding up to total, the last one takes what is left
+        sizes = []
+        size = max(1, self.canary)
+        while total > 0:
+            sizes.append(min(size, total))
+            total -= sizes[-1]
+            size = max(size + 1, math.ceil(size * self.growth))
+        return sizes
+
+
+@dataclass
+class Wave:
+    number: int
+    size: int
+    # (VM name, why it failed) pairs
+    failed: List[Tuple[str, str]] = field(default_factory=list)
+
+
+@dataclass
+class Rollout:
+    total: int
+    vm_results: List = field(default_factory=list)
+    waves: List[Wave] = field(default_factory=list)
+    halted: bool = False
+    # VMs never started because the rollout stopped
+    skipped: int = 0
+    # TaskResults of putting the moved VMs back, with rollback
+    restored: List = field(default_factory=list)
+
+    @property
+    def failed(self):
+        return [failure for wave in self.waves for failure in wave.failed]
+
+    @property
+    def reconfigured(self):
+        return sum(wave.size for wave in self.waves)
+
+
+class WaveHalted(PlanError):
+    def __init__(self, rollout):
+        failed = len(rollout.failed)
+        message = (f"Stopped after wave {len(rollout.waves)}: {failed} of {rollout.reconfigured} VM(s) failed, "
+                   f"{rollout.skipped} VM(s) not started")
+        if rollout.restored:
+            restored = sum(1 for result in rollout.restored if result.ok)
+            message += f", {restored} of {len(rollout.restored)} moved VM(s) put back"
+        super().__init__(message)
+        self.rollout = rollout
+
+
+def _nic_states(inventory, vm_specs):
+    # (vm moid, device key) -> (port group key, switch uuid, connectable) of
+    # the NICs about to move, copied before the inventory records the move
+    states = {}
+    for _, vm, spec in vm_specs:
+        info = inventory.vm(vm)
+        nics = {nic.key: nic for nic in info.nics} if info is not None else {}
+        for change in spec.deviceChange or []:
+            nic = nics.get(change.device.key)
+            if nic is not None:
+                states[vm._moId, nic.key] = (nic.portgroup_key, nic.switch_uuid,
+                                             copy.copy(nic.device.connectable))
+    return states
+
+
+def _connected(connectable):
+    return bool(getattr(connectable, 'connected', False))
+
+
+def check_wave(inventory, vm_specs, states):
+    # (VM name, problem) for every VM of the wave whose NICs vCenter does not
+    # report on their target port group and as connected as before
+    current = inventory.current_nics([vm for _, vm, _ in vm_specs])
+    problems = []
+    for name, vm, spec in vm_specs:
+        if vm._moId not in current:
+            problems.append((name, "no longer in vCenter"))
+            continue
+        nics = {nic.key: nic for nic in current[vm._moId]}
+        for change in spec.deviceChange or []:
+            nic = nics.get(change.device.key)
+            label = change.device.deviceInfo.label if change.device.deviceInfo else change.device.key
+            if nic is None or nic.portgroup_key != change.device.backing.port.portgroupKey:
+                problems.append((name, f"{label} is not on the target port group"))
+                break
+            before = states.get((vm._moId, nic.key))
+            if before is not None and _connected(before[2]) and not _connected(nic.device.connectable):
+                problems.append((name, f"{label} lost its connection"))
+                break
+    return problems
+
+
+def restore_specs(inventory, vm_specs, states):
+    # (name, vm, ConfigSpec) putting the NICs of vm_specs back where they were
+    restores = []
+    for name, vm, spec in vm_specs:
+        info = inventory.vm(vm)
+        if info is None:
+            continue
+        nics = {nic.key: nic for nic in info.nics}
+        device_change = []
+        for change in spec.deviceChange or []:
+            nic = nics.get(change.device.key)
+            before = states.get((vm._moId, change.device.key))
+            if nic is None or before is None or nic.portgroup_key == before[0]:
+                continue
+            nic_spec = nic_backing_change(nic.device, before[1], before[0])
+            nic_spec.device.connectable = before[2]
+            device_change.append(nic_spec)
+        if device_change:
+            restores.append((name, vm, vim.vm.ConfigSpec(deviceChange=device_change)))
+    return restores
+
+
+def run_waves(vm_specs, inventory, reconfigure, policy, restore=None, on_wave=None):
+    # Reconfigure (name, vm, ConfigSpec) triples in waves. reconfigure(specs)
+    # runs one wave and returns its TaskResults, restore(specs) puts VMs back
+    # on rollback and defaults to reconfigure. on_wave(wave, rollout) is
+    # called after each wave is checked. The TaskResults in the Rollout are
+    # indexed like vm_specs.
+    vm_specs = list(vm_specs)
+    states = _nic_states(inventory, vm_specs)
+    rollout = Rollout(total=len(vm_specs))
+    moved = []
+    start = 0
+    for number, size in enumerate(policy.sizes(len(vm_specs)), start=1):
+        wave_specs = vm_specs[start:start + size]
+        results = reconfigure(wave_specs)
+        for result in results:
+            result.index += start
+        start += size
+        rollout.vm_results.extend(results)
+
+        if policy.pause:
+            time.sleep(policy.pause)
+        wave = Wave(number, size, [(r.name, r.error or "task failed") for r in results if not r.ok])
+        done = [vm_specs[r.index] for r in results if r.ok]
+        moved.extend(done)
+        wave.failed.extend(check_wave(inventory, done, states))
+        rollout.waves.append(wave)
+        if on_wave is not None:
+            on_wave(wave, rollout)
+
+        if len(rollout.failed) > policy.max_failure_rate * rollout.reconfigured:
+            rollout.halted = True
+            rollout.skipped = len(vm_specs) - start
+            if policy.on_failure == ROLLBACK:
+                rollout.restored = (restore or reconfigure)(restore_specs(inventory, moved, states))
+            break
+    return rollout
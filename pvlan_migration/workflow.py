@@ -0,0 +1,166 @@
+# Building blocks shared by the interactive script and the batch runner.
+#
+# Everything here only builds specs from an inventory snapshot, nothing is
+# sent to vCenter.
+import copy
+
+from pyVmomi import vim
+
+from pvlan_migration.inventory import BACKING_DISTRIBUTED
+from pvlan_migration.naming import pvlan_portgroup_names
+
+
+def _portgroup_spec(name, vlan, template=None, num_ports=None):
+    # A bare earlyBinding port group, or with template, the ConfigInfo of an
+    # existing port group, a copy of it with every policy (teaming, security,
+    # traffic shaping, ports) kept and only name and VLAN replaced. num_ports
+    # sizes it for the NICs about to move in, so autoExpand does not have to
+    # grow it while they arrive.
+    if template is None:
+        portgroup_config_spec = vim.dvs.DistributedVirtualPortgroup.ConfigSpec()
+        portgroup_config_spec.defaultPortConfig = vim.dvs.VmwareDistributedVirtualSwitch.VmwarePortConfigPolicy()
+        portgroup_config_spec.type = "earlyBinding"
+    else:
+        portgroup_config_spec = portgroup_spec_from_config(template)
+        portgroup_config_spec.defaultPortConfig = (copy.deepcopy(template.defaultPortConfig) or
+                                                   vim.dvs.VmwareDistributedVirtualSwitch.VmwarePortConfigPolicy())
+    portgroup_config_spec.name = name
+    portgroup_config_spec.defaultPortConfig.vlan = vlan
+    if num_ports:
+        portgroup_config_spec.numPorts = max(portgroup_config_spec.numPorts or 0, num_ports)
+    return portgroup_config_spec
+
+
+def vlan_portgroup_spec(name, vlan_id, template=None, num_ports=None):
+    vlan = vim.dvs.VmwareDistributedVirtualSwitch.VlanIdSpec()
+    vlan.vlanId = vlan_id
+    portgroup_config_spec = _portgroup_spec(name, vlan, template, num_ports)
+    # Used for dummy port groups, which have to take every parked NIC
+    portgroup_config_spec.autoExpand = True
+    return portgroup_config_spec
+
+
+def pvlan_portgroup_spec(name, pvlan_id, template=None, num_ports=None):
+    vlan = vim.dvs.VmwareDistributedVirtualSwitch.PvlanSpec()
+    vlan.pvlanId = pvlan_id
+    return _portgroup_spec(name, vlan, template, num_ports)
+
+
+def pvlan_portgroup_specs(base_name, promiscuous_vlan, isolated_vlan, name_suffix='', template=None, num_ports=None):
+    # Specs for the isolated and promiscuous port groups, in that order. Both
+    # go into one AddDVPortgroup_Task.
+    promiscuous_name, isolated_name = pvlan_portgroup_names(base_name)
+    return [pvlan_portgroup_spec(isolated_name + name_suffix, isolated_vlan, template, num_ports),
+            pvlan_portgroup_spec(promiscuous_name + name_suffix, promiscuous_vlan, template, num_ports)]
+
+
+def source_template(inventory, vds_name, port_group_name):
+    # (ConfigInfo, NICs on it) of the port group the new ones are cloned
+    # from, (None, 0) if it is gone
+    source = inventory.portgroup(vds_name, port_group_name)
+    if source is None:
+        return None, 0
+    return source.config, sum(len(nics) for nics in inventory.nics_on_portgroup(source.key).values())
+
+
+def dummy_portgroup_specs(rows, template_of):
+    # vds name -> specs of the dummy port groups the rows park their NICs on.
+    # template_of(row) is the (ConfigInfo, NIC count) of the row's source, see
+    # source_template. A dummy port group shared by several rows is cloned
+    # from the first of them and sized for the NICs of all.
+    specs = {}
+    nic_counts = {}
+    for row in rows:
+        template, nic_count = template_of(row)
+        key = (row.vds, row.dummy_port_group)
+        if key not in specs:
+            specs[key] = vlan_portgroup_spec(row.dummy_port_group, row.dummy_vlan, template)
+            nic_counts[key] = 0
+        nic_counts[key] += nic_count
+    by_switch = {}
+    for key, spec in specs.items():
+        if nic_counts[key]:
+            spec.numPorts = max(spec.numPorts or 0, nic_counts[key])
+        by_switch.setdefault(key[0], []).append(spec)
+    return by_switch
+
+
+def portgroup_spec_from_config(config):
+    # Spec recreating a port group from its ConfigInfo, used to bring back a
+    # deleted port group on rollback
+    portgroup_config_spec = vim.dvs.DistributedVirtualPortgroup.ConfigSpec()
+    for name in ('name', 'type', 'numPorts', 'autoExpand', 'description', 'defaultPortConfig', 'policy',
+                 'portNameFormat', 'backingType', 'vmVnicNetworkResourcePoolKey'):
+        setattr(portgroup_config_spec, name, getattr(config, name, None))
+    return portgroup_config_spec
+
+
+def rename_portgroup_spec(name, config_version):
+    portgroup_config_spec = vim.dvs.DistributedVirtualPortgroup.ConfigSpec()
+    portgroup_config_spec.name = name
+    portgroup_config_spec.configVersion = config_version
+    return portgroup_config_spec
+
+
+def nic_backing_change(device, switch_uuid, portgroup_key):
+    # Create specification for device change, on a copy so the snapshot
+    # keeps describing the current state
+    nic_spec = vim.vm.device.VirtualDeviceSpec()
+    nic_spec.operation = vim.vm.device.VirtualDeviceSpec.Operation.edit
+    nic_spec.device = copy.copy(device)
+    nic_spec.device.backing = vim.vm.device.VirtualEthernetCard.DistributedVirtualPortBackingInfo()
+    nic_spec.device.backing.port = vim.dvs.PortConnection()
+    nic_spec.device.backing.port.portgroupKey = portgroup_key
+    nic_spec.device.backing.port.switchUuid = switch_uuid
+    nic_spec.device.connectable = device.connectable  # Keep the same connectable settings
+    return nic_spec
+
+
+def nic_device_changes(vm, switch_uuid, original_key, target_key, only=None):
+    # Edit specs moving the VM's distributed switch NICs on original_key to
+    # target_key. NICs on a standard switch, an opaque or NSX network or
+    # another port group are never touched. only optionally limits the move to
+    # a set of device keys. vm.nics holds the NicRecords of the inventory index.
+    device_change = []
+    for nic in vm.nics:
+        # Only Ethernet cards connected to the original network of the distributed switch move
+        if nic.backing_type != BACKING_DISTRIBUTED or nic.portgroup_key != original_key:
+            continue
+
+        if only is not None and nic.key not in only:
+            continue
+
+        device_change.append(nic_backing_change(nic.device, switch_uuid, target_key))
+    return device_change
+
+
+def migration_specs(inventory, vds_name, original_port_group_name, target_port_group_name,
+                    is_initial_migration=True, only=None, select=None):
+    # (name, vm, ConfigSpec) for every VM on the original port group that has
+    # NICs to move, None if the switch or a port group is missing. Without
+    # is_initial_migration the VMs are the ones vCenter lists on the port
+    # group instead of those the NIC index finds. only maps VM managed object
+    # ids to the device keys that may be moved, VMs missing from it are left
+    # alone. select(vm) may veto single VMs.
+    vds = inventory.switch(vds_name)
+    original_network = inventory.portgroup(vds_name, original_port_group_name)
+    target_network = inventory.portgroup(vds_name, target_port_group_name)
+    if vds is None or original_network is None or target_network is None:
+        return None
+
+    # The NIC index answers which VMs have NICs on the port group directly
+    if is_initial_migration:
+        vms = inventory.vms_with_nics_on(original_network.key)
+    else:
+        vms = inventory.vms_on_portgroup(original_network.key)
+    vm_specs = []
+    for vm in vms:
+        device_keys = None
+        if only is not None:
+            device_keys = only.get(vm.ref._moId)
+            if not device_keys:
+                continue
+        device_change = nic_device_changes(vm, vds.uuid, original_network.key, target_network.key, device_keys)
+        if device_change and (select is None or select(vm)):
+            vm_specs.append((vm.name, vm.ref, vim.vm.ConfigSpec(deviceChange=device_change)))
+    return vm_specs
@@ -0,0 +1,63 @@
+# Fixtures running the migration against the simulated vCenter of
+# pvlan_migration.fake, with the layout the benchmark builds: one switch
+# bench-vds, port groups pg-0000, pg-0001 and so on with the VMs spread round
+# robin over them, and a dummy port group.
+import pytest
+from pyVmomi import vim
+
+from pvlan_migration.api import VCenter
+from pvlan_migration.benchmark import build_vcenter
+from pvlan_migration.fake import FakeBehaviour
+
+
+@pytest.fixture
+def fake_vcenter():
+    # (FakeVCenter, plan rows converting every port group to isolated)
+    return build_vcenter(12, 3, behaviour=FakeBehaviour(seed=0))
+
+
+@pytest.fixture
+def connect():
+    # connect(fake, **options) returns a VCenter on the fake that does not
+    # retry, closed again after the test
+    opened = []
+
+    def open_vcenter(fake, **options):
+        vc = VCenter('vcenter.invalid', 'tester', None, connect=fake.service_instance, retries=0, retry_delay=0,
+                     **options)
+        opened.append(vc)
+        return vc
+
+    yield open_vcenter
+    for vc in opened:
+        vc.close()
+
+
+@pytest.fixture
+def fail_reconfigurations(monkeypatch):
+    # fail_reconfigurations(fake, should_fail) makes every VM reconfiguration
+    # for which should_fail(vm name, target port group name) is true end in a
+    # fault that is not retried
+    def inject(fake, should_fail):
+        def failing(mo, spec):
+            target = spec.deviceChange[0].device.backing.port.portgroupKey
+            if should_fail(fake._props[mo._moId]['name'], fake._props[target]['name']):
+                return fake._task(None, vim.fault.InvalidState(msg="VM is locked"))
+            return type(fake)._call_ReconfigVM_Task(fake, mo, spec)
+        monkeypatch.setattr(fake, '_call_ReconfigVM_Task', failing)
+    return inject
+
+
+@pytest.fixture
+def nic_portgroups():
+    # nic_portgroups(fake) maps every VM name to the (port group name,
+    # connected) of each of its NICs, as the fake holds them
+    def read(fake):
+        placement = {}
+        for moid, props in fake._props.items():
+            if not moid.startswith('vm-'):
+                continue
+            placement[props['name']] = [(fake._props[nic.backing.port.portgroupKey]['name'], nic.connectable.connected)
+                                        for nic in props['config.hardware.device']]
+        return placement
+    return read
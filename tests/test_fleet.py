@@ -0,0 +1,87 @@
+# A fleet file names the vCenters and their plans, and every vCenter runs on
+# its own: one that cannot be reached does not stop the others.
+import json
+import os
+
+import pytest
+
+from pvlan_migration.benchmark import build_vcenter
+from pvlan_migration.fake import FakeBehaviour
+from pvlan_migration.fleet import fleet_report, load_fleet, run_fleet
+from pvlan_migration.plan import PlanError
+
+CONVERSION = {'vds': 'bench-vds', 'source_port_group': 'pg-0000', 'dummy_port_group': 'dummy',
+              'target_type': 'isolated'}
+
+
+def write_fleet(tmp_path, vcenters):
+    path = tmp_path / 'fleet.json'
+    path.write_text(json.dumps({'vcenters': vcenters}))
+    return str(path)
+
+
+def test_load_fleet(tmp_path, monkeypatch):
+    monkeypatch.setenv('DC1_PASSWORD', 'secret')
+    monkeypatch.delenv('VCENTER_PASSWORD', raising=False)
+    (tmp_path / 'dc1-plan.json').write_text(json.dumps([CONVERSION]))
+    path = write_fleet(tmp_path, [
+        {'name': 'dc1', 'host': 'vc1.example.com', 'user': 'admin', 'password_env': 'DC1_PASSWORD',
+         'plan': 'dc1-plan.json', 'insecure': 'yes', 'max_per_host': '2'},
+        {'host': 'vc2.example.com:8443', 'user': 'admin', 'conversions': [CONVERSION], 'direct_cutover': True},
+    ])
+    dc1, dc2 = load_fleet(path)
+    assert (dc1.name, dc1.host, dc1.password, dc1.insecure, dc1.max_per_host) == \
+        ('dc1', 'vc1.example.com', 'secret', True, 2)
+    assert [row.source_port_group for row in dc1.rows] == ['pg-0000']
+    # Named after the host, with the port separator replaced
+    assert (dc2.name, dc2.password, dc2.insecure, dc2.direct_cutover) == ('vc2.example.com_8443', None, False, True)
+
+
+@pytest.mark.parametrize('name', ['../dc1', 'dc/1', '.hidden', 'dc 1', '..'])
+def test_names_that_escape_the_journal_directory_are_rejected(tmp_path, name):
+    path = write_fleet(tmp_path, [{'name': name, 'host': 'vc1', 'user': 'admin', 'conversions': [CONVERSION]}])
+    with pytest.raises(PlanError, match="may only contain"):
+        load_fleet(path)
+
+
+@pytest.mark.parametrize('vcenters, message', [
+    ([], "lists no vCenters"),
+    ([{'name': 'dc1', 'user': 'admin', 'conversions': [CONVERSION]}], "vCenter dc1: missing host"),
+    ([{'host': 'vc1', 'user': 'admin', 'conversions': [CONVERSION], 'colour': 'blue'}],
+     "vCenter vc1: unknown setting"),
+    ([{'host': 'vc1', 'user': 'admin'}], "vCenter vc1: needs either a plan file or a conversions list"),
+    ([{'host': 'vc1', 'user': 'admin', 'conversions': [CONVERSION], 'insecure': 'maybe'}],
+     "vCenter vc1: insecure must be yes or no"),
+    ([{'host': 'vc1', 'user': 'admin', 'conversions': [CONVERSION]},
+      {'name': 'vc1', 'host': 'vc2', 'user': 'admin', 'conversions': [CONVERSION]}], "used more than once"),
+])
+def test_bad_fleet_files(tmp_path, vcenters, message):
+    with pytest.raises(PlanError, match=message):
+        load_fleet(write_fleet(tmp_path, vcenters))
+
+
+def test_unreachable_vcenter_does_not_stop_the_others(tmp_path):
+    fakes = {name: build_vcenter(6, 2, behaviour=FakeBehaviour(seed=0))[0] for name in ('dc1', 'dc2')}
+    path = write_fleet(tmp_path, [
+        {'name': name, 'host': f"{name}.invalid", 'user': 'admin', 'conversions': [CONVERSION]}
+        for name in ('dc1', 'dc2', 'dc3')])
+
+    def connect(endpoint):
+        if endpoint.name not in fakes:
+            raise ConnectionRefusedError(f"{endpoint.host} refused the connection")
+        return fakes[endpoint.name].service_instance()
+
+    prefix = str(tmp_path / 'run')
+    results = run_fleet(load_fleet(path), journal_prefix=prefix, connect=connect, retries=0, retry_delay=0)
+    assert [(result.endpoint.name, result.ok, result.step) for result in results] == \
+        [('dc1', True, 'convert'), ('dc2', True, 'convert'), ('dc3', False, 'connect')]
+    assert results[2].error == "dc3.invalid refused the connection"
+    for result in results[:2]:
+        assert result.journal_path == f"{prefix}-{result.endpoint.name}.journal"
+        assert os.path.exists(result.journal_path)
+
+    report = fleet_report(results)
+    assert not report['ok']
+    assert report['totals']['vcenters_failed'] == 1
+    # Three VMs on pg-0000 on each reachable vCenter, moved twice over the dummy port group
+    assert report['totals']['vms_reconfigured'] == 12
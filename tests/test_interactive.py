@@ -0,0 +1,123 @@
+# The interactive flow stops with a message when a step fails, it never
+# deletes a port group VMs are still on and only reports success when every
+# VM was moved.
+import pytest
+from pyVmomi import vim
+
+import VM_PVLAN_Migration as script
+from pvlan_migration import api
+
+
+@pytest.fixture
+def run_interactive(monkeypatch, connect):
+    # run_interactive(fake, direct) converts pg-0000 to isolated with the
+    # default names and VLANs, moving all VMs at once, and returns the output
+    monkeypatch.setattr(script, 'EMPTY_PORT_GROUP_TIMEOUT', 1)
+    monkeypatch.setattr(script, 'NEW_PORT_GROUP_TIMEOUT', 1)
+
+    def run(fake, capsys, direct=False):
+        vc = connect(fake)
+        names = vc.inventory.portgroup_names('bench-vds')
+        answers = ['1', str(names.index('pg-0000') + 1)]
+        if not direct:
+            answers.append(str(names.index('dummy') + 1))
+        answers += ['', '', '', 'i', 'all', 'yes', 'all', 'yes']
+        answers = iter(answers)
+        monkeypatch.setattr('builtins.input', lambda prompt='': next(answers))
+        script.run_interactive(vc, script.parser.parse_args(['--direct-cutover'] if direct else []))
+        vc.inventory.refresh()
+        return capsys.readouterr().out, vc.inventory.portgroup_names('bench-vds')
+    return run
+
+
+@pytest.mark.parametrize('direct', [False, True])
+def test_conversion_succeeds(fake_vcenter, run_interactive, nic_portgroups, capsys, direct):
+    fake, _ = fake_vcenter
+    out, names = run_interactive(fake, capsys, direct)
+    assert "VMs successfully migrated to pg-0000_isolated" in out
+    assert sorted(names) == ['dummy', 'pg-0000_isolated', 'pg-0000_promiscuous', 'pg-0001', 'pg-0002']
+    assert nic_portgroups(fake)['vm-00003'] == [('pg-0000_isolated', True)]
+
+
+def test_failed_dummy_hop_keeps_the_source_port_group(fake_vcenter, run_interactive, fail_reconfigurations, capsys):
+    fake, _ = fake_vcenter
+    fail_reconfigurations(fake, lambda vm, target: vm == 'vm-00003')
+    out, names = run_interactive(fake, capsys)
+    assert "1 of 4 VM(s) were not migrated to dummy" in out
+    assert "vm-00003: VM is locked" in out
+    assert "Cannot delete" in out
+    assert "successfully migrated" not in out
+    assert 'Destroy_Task' not in fake.calls
+    assert sorted(names) == ['dummy', 'pg-0000', 'pg-0001', 'pg-0002']
+
+
+def test_failed_final_hop_is_reported(fake_vcenter, run_interactive, fail_reconfigurations, nic_portgroups, capsys):
+    fake, _ = fake_vcenter
+    fail_reconfigurations(fake, lambda vm, target: vm == 'vm-00003' and target == 'pg-0000_isolated')
+    out, _ = run_interactive(fake, capsys)
+    assert "1 of 4 VM(s) were not migrated to pg-0000_isolated" in out
+    assert "successfully migrated" not in out
+    assert "stay parked on dummy" in out
+    assert nic_portgroups(fake)['vm-00003'] == [('dummy', True)]
+
+
+def test_failed_cutover_keeps_the_source_and_temporary_names(fake_vcenter, run_interactive, fail_reconfigurations,
+                                                             capsys):
+    fake, _ = fake_vcenter
+    fail_reconfigurations(fake, lambda vm, target: vm == 'vm-00003')
+    out, names = run_interactive(fake, capsys, direct=True)
+    assert "successfully migrated" not in out
+    assert 'Destroy_Task' not in fake.calls
+    assert sorted(names) == ['dummy', 'pg-0000', 'pg-0000_isolated_cutover', 'pg-0000_promiscuous_cutover',
+                             'pg-0001', 'pg-0002']
+
+
+def test_vcenter_fault_is_reported_without_traceback(fake_vcenter, run_interactive, monkeypatch, capsys):
+    fake, _ = fake_vcenter
+    monkeypatch.setattr(fake, '_call_Destroy_Task',
+                        lambda mo: fake._task(None, vim.fault.InvalidState(msg="Port group is locked")))
+    out, names = run_interactive(fake, capsys)
+    assert "Failed to delete port group pg-0000: Port group is locked" in out
+    assert "stay parked on dummy" in out
+    assert 'pg-0000_isolated' not in names
+
+
+@pytest.mark.parametrize('direct', [False, True])
+def test_port_groups_never_reported_stop_the_conversion(fake_vcenter, run_interactive, monkeypatch, nic_portgroups,
+                                                       capsys, direct):
+    fake, _ = fake_vcenter
+    # The creation tasks succeed but the new port groups never show up
+    monkeypatch.setattr(fake, '_call_AddDVPortgroup_Task', lambda mo, specs: fake._task(lambda: None))
+    out, names = run_interactive(fake, capsys, direct)
+    suffix = '_cutover' if direct else ''
+    assert f"Timed out waiting for vCenter to report port group(s) pg-0000_promiscuous{suffix}, " \
+           f"pg-0000_isolated{suffix}" in out
+    assert "successfully migrated" not in out
+    assert ('pg-0000' in names) == direct
+    assert nic_portgroups(fake)['vm-00003'] == [('pg-0000' if direct else 'dummy', True)]
+
+
+def test_main_reports_connection_errors(monkeypatch, capsys):
+    def refuse(vc):
+        raise ConnectionRefusedError("connection refused")
+    monkeypatch.setattr(api.VCenter, '_smart_connect', refuse)
+    monkeypatch.setenv('VCENTER_PASSWORD', 'secret')
+    assert script.main(['--accept-disclaimer', '--host', 'vcenter.invalid', '--user', 'tester', '--insecure']) == 1
+    assert "The conversion was stopped: connection refused" in capsys.readouterr().out
+
+
+def test_main_reports_vcenter_faults_but_not_bugs(monkeypatch, capsys):
+    monkeypatch.setenv('VCENTER_PASSWORD', 'secret')
+    argv = ['--accept-disclaimer', '--host', 'vcenter.invalid', '--user', 'tester', '--insecure']
+
+    def fault(vc, args):
+        raise vim.fault.NoPermission(msg="Permission to perform this operation was denied.")
+    monkeypatch.setattr(script, 'run_interactive', fault)
+    assert script.main(argv) == 1
+    assert "The conversion was stopped: Permission to perform this operation was denied." in capsys.readouterr().out
+
+    def bug(vc, args):
+        raise KeyError('portgroup')
+    monkeypatch.setattr(script, 'run_interactive', bug)
+    with pytest.raises(KeyError):
+        script.main(argv)
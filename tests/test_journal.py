@@ -0,0 +1,97 @@
+# The journal is on disk before a step is reported, writers arriving together
+# share one fsync, and reading it back tells what a run has done.
+import os
+import threading
+import time
+
+from pvlan_migration import journal as journal_module
+from pvlan_migration.journal import DONE, FAILED, PLANNED, Journal, JournalState, read_journal
+
+
+def test_concurrent_writers_share_fsyncs(tmp_path, monkeypatch):
+    fsyncs = []
+    real_fsync = os.fsync
+
+    def slow_fsync(fd):
+        fsyncs.append(fd)
+        time.sleep(0.005)
+        real_fsync(fd)
+    monkeypatch.setattr(journal_module.os, 'fsync', slow_fsync)
+
+    journal = Journal(str(tmp_path / 'run.journal'))
+    not_synced = []
+
+    def write(worker):
+        for n in range(25):
+            seq = journal.record('nic_move', vm=f"vm-{worker}", device=n)
+            # Nothing returns before its line is on disk
+            if journal._synced < seq:
+                not_synced.append(seq)
+    workers = [threading.Thread(target=write, args=(i,)) for i in range(8)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    journal.close()
+
+    entries = read_journal(journal.path)
+    assert [entry['seq'] for entry in entries] == list(range(1, 201))
+    assert not not_synced
+    assert len(fsyncs) < len(entries)
+
+
+def test_reopening_drops_a_partial_line_and_continues(tmp_path):
+    path = str(tmp_path / 'run.journal')
+    journal = Journal(path)
+    journal.record_many([{'op': 'step', 'row': 'a', 'step': 'pvlan map'},
+                         {'op': 'step', 'row': 'a', 'step': 'dummy hop'}])
+    journal.close()
+    with open(path, 'a') as f:
+        f.write('{"op": "step", "row"')
+    # A reader stops at the cut off line
+    assert len(read_journal(path)) == 2
+
+    journal = Journal(path)
+    assert journal.record('step', row='a', step='final hop') == 3
+    journal.close()
+    assert [entry['step'] for entry in read_journal(path)] == ['pvlan map', 'dummy hop', 'final hop']
+
+
+def test_state_replays_the_entries():
+    entries = [
+        {'op': 'begin', 'rows': [{'line': 1}], 'direct': True},
+        {'op': 'portgroup_create', 'status': PLANNED, 'row': 'a', 'names': ['a_isolated_cutover']},
+        {'op': 'portgroup_create', 'status': DONE, 'row': 'a', 'names': ['a_isolated_cutover']},
+        {'op': 'nic_move', 'status': PLANNED, 'row': 'a', 'hop': 'dummy', 'vm': 'vm-1', 'device': 4000,
+         'from_key': 'dvportgroup-1'},
+        {'op': 'nic_move', 'status': DONE, 'row': 'a', 'hop': 'dummy', 'vm': 'vm-1', 'device': 4000,
+         'from_key': 'dvportgroup-1'},
+        {'op': 'nic_move', 'status': PLANNED, 'row': 'a', 'hop': 'final', 'vm': 'vm-1', 'device': 4000,
+         'from_key': 'dvportgroup-9'},
+        {'op': 'step', 'status': DONE, 'row': 'a', 'step': 'dummy hop'},
+        {'op': 'step', 'status': FAILED, 'row': 'a', 'step': 'final hop'},
+        {'op': 'portgroup_delete', 'status': PLANNED, 'row': 'a', 'name': 'a'},
+    ]
+    state = JournalState(entries)
+    assert state.direct
+    assert state.rows == [{'line': 1}]
+    assert state.step_done('a', 'dummy hop') and not state.step_done('a', 'final hop')
+    assert [entry['names'] for entry in state.created] == [['a_isolated_cutover']]
+    assert [entry['name'] for entry in state.deleted] == ['a']
+    assert len(state.nic_moves) == 1
+    assert state.parked('a') == {'vm-1': {4000}}
+    # Rollback goes back to where the NIC was before its first move
+    assert state.original_backings()[('vm-1', 4000)]['from_key'] == 'dvportgroup-1'
+
+
+def test_run_journal_records_every_step(fake_vcenter, connect, tmp_path):
+    fake, rows = fake_vcenter
+    path = str(tmp_path / 'run.journal')
+    results = connect(fake).convert(rows, journal_path=path)
+    assert all(result.ok for result in results)
+    state = JournalState.load(path)
+    assert [row['source_port_group'] for row in state.rows] == ['pg-0000', 'pg-0001', 'pg-0002']
+    # Every NIC moved twice, confirmed after it was planned
+    assert len(state.nic_moves) == 24
+    assert sorted({move['vm_name'] for move in state.nic_moves}) == sorted(f"vm-{n:05d}" for n in range(12))
+    assert sorted(entry['name'] for entry in state.deleted) == ['pg-0000', 'pg-0001', 'pg-0002']
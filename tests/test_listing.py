@@ -0,0 +1,74 @@
+# The VMs of a port group stream page by page, without loading the inventory.
+import io
+import json
+
+import pytest
+
+from pvlan_migration.benchmark import build_vcenter
+from pvlan_migration.fake import FakeBehaviour
+from pvlan_migration.listing import port_group_nics, write_rows
+from pvlan_migration.plan import PlanError
+
+
+def test_rows_stream_page_by_page(connect):
+    fake, _ = build_vcenter(250, 1, behaviour=FakeBehaviour(seed=0))
+    content = connect(fake).content
+    rows = port_group_nics(content, 'pg-0000', 'bench-vds', page_size=100)
+    # The first row is there once the first page arrived
+    first = next(rows)
+    assert first.backing == 'distributed'
+    assert fake.calls.get('ContinueRetrievePropertiesEx', 0) == 0
+    assert len({first.vm} | {row.vm for row in rows}) == 250
+    assert fake.calls['ContinueRetrievePropertiesEx'] == 2
+
+    # A caller that stops early releases the rest of the result
+    rows = port_group_nics(content, 'pg-0000', page_size=100)
+    next(rows)
+    rows.close()
+    assert fake.calls['CancelRetrievePropertiesEx'] == 1
+
+
+def test_rows_and_filters(fake_vcenter, connect):
+    fake, _ = fake_vcenter
+    switch = next(ref for moid, ref in fake._objects.items() if moid.startswith('dvs-'))
+    portgroups = {fake._props[moid]['name']: ref for moid, ref in fake._objects.items()
+                  if moid.startswith('dvportgroup-')}
+    host = next(ref for moid, ref in fake._objects.items() if moid.startswith('host-'))
+    fake.add_vm('Mixed-01', [(switch, portgroups['pg-0000']), (None, None), (switch, portgroups['pg-0001'])],
+                host=host)
+    content = connect(fake).content
+
+    rows = list(port_group_nics(content, 'pg-0000'))
+    assert len(rows) == 6
+    # The standard switch NIC of the VM is listed, its NIC on pg-0001 is not
+    assert [(row.nic, row.backing, row.host) for row in rows if row.vm == 'Mixed-01'] == [
+        ('Network adapter 1', 'distributed', 'esx-00'), ('Network adapter 2', 'standard', 'esx-00')]
+
+    assert sorted({row.vm for row in port_group_nics(content, 'pg-0000', name_pattern='MIXED-*')}) == ['Mixed-01']
+    assert sorted({row.vm for row in port_group_nics(content, 'pg-0000', host='esx-00')}) == \
+        ['Mixed-01', 'vm-00000']
+
+
+def test_unknown_names_fail_before_any_row(fake_vcenter, connect):
+    fake, _ = fake_vcenter
+    content = connect(fake).content
+    with pytest.raises(PlanError, match="Port group missing not found"):
+        port_group_nics(content, 'missing')
+    with pytest.raises(PlanError, match="Port group pg-0000 not found on other-vds"):
+        port_group_nics(content, 'pg-0000', 'other-vds')
+    with pytest.raises(PlanError, match="Host esx-99 not found"):
+        port_group_nics(content, 'pg-0000', host='esx-99')
+
+
+@pytest.mark.parametrize('output_format', ['table', 'csv', 'jsonl'])
+def test_write_rows(fake_vcenter, connect, output_format):
+    fake, _ = fake_vcenter
+    stream = io.StringIO()
+    count = write_rows(port_group_nics(connect(fake).content, 'pg-0001'), output_format, stream)
+    lines = stream.getvalue().splitlines()
+    assert count == 4
+    if output_format == 'jsonl':
+        assert sorted(json.loads(line)['vm'] for line in lines) == ['vm-00001', 'vm-00004', 'vm-00007', 'vm-00010']
+    else:
+        assert len(lines) == 5
+        assert lines[0].startswith('vm,' if output_format == 'csv' else 'VM ')
@@ -0,0 +1,68 @@
+# The dry run works out from an inventory alone what a run changes and what
+# it costs, and gives the same plan from a snapshot file as from vCenter.
+import json
+
+import pytest
+
+from pvlan_migration.api import dry_run
+from pvlan_migration.inventory import load_snapshot, save_snapshot
+from pvlan_migration.plan import PlanRow
+from pvlan_migration.serialize import decode, encode
+from pvlan_migration.workflow import pvlan_portgroup_specs
+
+# Calls that change vCenter, the ones the plan estimates
+CHANGES = ('AddDVPortgroup_Task', 'Destroy_Task', 'ReconfigVM_Task', 'ReconfigureDvs_Task',
+           'ReconfigureDVPortgroup_Task')
+
+
+@pytest.mark.parametrize('direct', [False, True])
+def test_plan_from_a_snapshot_file_matches_the_live_one(fake_vcenter, connect, tmp_path, direct):
+    fake, rows = fake_vcenter
+    vc = connect(fake)
+    path = str(tmp_path / 'inventory.json')
+    save_snapshot(vc.inventory, path)
+    live = vc.dry_run(rows, direct)
+    offline = dry_run(load_snapshot(path), rows, direct)
+    assert not live['errors']
+    assert json.dumps(offline, sort_keys=True) == json.dumps(live, sort_keys=True)
+
+
+@pytest.mark.parametrize('direct', [False, True])
+def test_plan_predicts_the_calls_of_the_run(fake_vcenter, connect, nic_portgroups, direct):
+    fake, rows = fake_vcenter
+    vc = connect(fake)
+    plan = vc.dry_run(rows, direct)
+    conversion = plan['conversions'][0]
+    assert [change['vm'] for change in conversion['vm_changes']] == ['vm-00000', 'vm-00003', 'vm-00006', 'vm-00009']
+    assert conversion['cost'] == {'vms': 4, 'nics': 4, 'vm_reconfigurations': 4 if direct else 8}
+    assert plan['pvlan_map'] == {'bench-vds': [
+        {'primaryVlanId': vlan, 'secondaryVlanId': vlan + offset, 'pvlanType': pvlan_type}
+        for vlan in (100, 102, 104) for offset, pvlan_type in ((0, 'promiscuous'), (1, 'isolated'))]}
+    # Nothing changed yet
+    assert not any(method in fake.calls for method in CHANGES)
+    assert nic_portgroups(fake)['vm-00000'] == [('pg-0000', True)]
+
+    results = vc.convert(rows, direct)
+    assert all(result.ok for result in results)
+    made = {method: count for method, count in fake.calls.items() if method in CHANGES}
+    assert made == plan['cost']['api_calls']
+
+
+def test_plan_with_errors_lists_them_only(fake_vcenter, connect):
+    fake, _ = fake_vcenter
+    vc = connect(fake)
+    plan = vc.dry_run([PlanRow(line=1, vds='bench-vds', source_port_group='missing', dummy_port_group='dummy',
+                               target_type='isolated')])
+    assert plan['errors'] == ["Row 1 (bench-vds/missing): port group missing not found"]
+    assert 'conversions' not in plan
+
+
+def test_specs_survive_a_json_round_trip(fake_vcenter, connect):
+    fake, _ = fake_vcenter
+    vc = connect(fake)
+    template = vc.inventory.portgroup('bench-vds', 'pg-0000').config
+    specs = pvlan_portgroup_specs('pg-0000', 100, 101, '', template, 8)
+    encoded = encode(specs)
+    decoded = decode(json.loads(json.dumps(encoded)))
+    assert [type(spec) for spec in decoded] == [type(spec) for spec in specs]
+    assert encode(decoded) == encoded
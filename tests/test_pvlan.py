@@ -0,0 +1,100 @@
+# PVLAN map changes go out as one switch reconfiguration, and a
+# reconfiguration that lost the race for the configVersion is sent again.
+from pyVmomi import vim
+
+from pvlan_migration.pvlan import ISOLATED, PROMISCUOUS, PvlanPlan, pvlan_config_spec
+
+
+def _switch(fake):
+    return next(ref for moid, ref in fake._objects.items() if moid.startswith('dvs-'))
+
+
+def _pvlan_entries(fake):
+    config = fake._props[_switch(fake)._moId]['config']
+    return sorted((e.primaryVlanId, e.secondaryVlanId, e.pvlanType) for e in config.pvlanConfig)
+
+
+def test_stale_config_version_fails_when_the_task_runs(fake_vcenter):
+    fake, _ = fake_vcenter
+    switch = _switch(fake)
+    config = fake._props[switch._moId]['config']
+    # Both tasks are accepted with the same configVersion, the first one to
+    # run bumps it
+    first = switch.ReconfigureDvs_Task(pvlan_config_spec(config, [(100, 100, PROMISCUOUS)]))
+    second = switch.ReconfigureDvs_Task(pvlan_config_spec(config, [(200, 200, PROMISCUOUS)]))
+    assert first.info.state == 'success'
+    info = second.info
+    assert info.state == 'error'
+    assert isinstance(info.error, vim.fault.ConcurrentAccess)
+    assert _pvlan_entries(fake) == [(100, 100, PROMISCUOUS)]
+
+
+def test_change_landing_before_the_task_runs_is_retried(fake_vcenter, connect, monkeypatch):
+    fake, _ = fake_vcenter
+    vc = connect(fake)
+    switch = _switch(fake)
+    accepted = []
+
+    def racing(mo, spec):
+        task = type(fake)._call_ReconfigureDvs_Task(fake, mo, spec)
+        if not accepted:
+            # Another client changes the switch after our task was accepted
+            config = fake._props[switch._moId]['config']
+            type(fake)._call_ReconfigureDvs_Task(fake, mo, pvlan_config_spec(config, [(300, 300, PROMISCUOUS)])).info
+        accepted.append(spec)
+        return task
+    monkeypatch.setattr(fake, '_call_ReconfigureDvs_Task', racing)
+
+    plan = PvlanPlan()
+    plan.add_pair('bench-vds', 100, 101)
+    results = plan.apply(vc.inventory, retry_delay=0)
+    assert [result.ok for result in results] == [True]
+    assert len(accepted) == 2
+    assert _pvlan_entries(fake) == [(100, 100, PROMISCUOUS), (100, 101, ISOLATED), (300, 300, PROMISCUOUS)]
+
+
+def test_one_reconfiguration_per_switch(fake_vcenter, connect):
+    fake, rows = fake_vcenter
+    fake.add_switch('other-vds')
+    vc = connect(fake)
+    plan = PvlanPlan()
+    for i in range(len(rows)):
+        plan.add_pair('bench-vds', 100 + 2 * i, 101 + 2 * i)
+    plan.add_pair('other-vds', 100, 101)
+    # The same pair twice is one pair
+    plan.add_pair('other-vds', 100, 101)
+
+    results = plan.apply(vc.inventory, retry_delay=0)
+    assert sorted(result.name for result in results) == ['bench-vds', 'other-vds']
+    assert all(result.ok for result in results)
+    assert fake.calls['ReconfigureDvs_Task'] == 2
+    assert _pvlan_entries(fake) == [(vlan, vlan + offset, pvlan_type) for vlan in (100, 102, 104)
+                                    for offset, pvlan_type in ((0, PROMISCUOUS), (1, ISOLATED))]
+
+
+def test_entries_already_in_the_map_are_left_out(fake_vcenter, connect):
+    fake, _ = fake_vcenter
+    vc = connect(fake)
+    plan = PvlanPlan()
+    plan.add_pair('bench-vds', 100, 101)
+    plan.apply(vc.inventory, retry_delay=0)
+    vc.inventory.refresh()
+    assert plan.pending(vc.inventory) == {}
+    assert plan.apply(vc.inventory, retry_delay=0) == []
+    assert fake.calls['ReconfigureDvs_Task'] == 1
+
+    # Removing takes them out again, in one reconfiguration
+    assert plan.pending(vc.inventory, 'remove') == {'bench-vds': [(100, 100, PROMISCUOUS), (100, 101, ISOLATED)]}
+    results = plan.apply(vc.inventory, retry_delay=0, operation='remove')
+    assert [result.ok for result in results] == [True]
+    assert _pvlan_entries(fake) == []
+    assert fake.calls['ReconfigureDvs_Task'] == 2
+
+
+def test_conversion_run_reconfigures_the_switch_once(fake_vcenter, connect):
+    fake, rows = fake_vcenter
+    vc = connect(fake)
+    results = vc.convert(rows)
+    assert all(result.ok for result in results)
+    assert fake.calls['ReconfigureDvs_Task'] == 1
+    assert len(_pvlan_entries(fake)) == 2 * len(rows)
@@ -0,0 +1,42 @@
+# Plan runs journal every change, so a failed run can be resumed and any run
+# rolled back to where the VMs started.
+import pytest
+
+
+@pytest.mark.parametrize('direct', [False, True])
+def test_rollback_restores_original_backings(fake_vcenter, connect, nic_portgroups, tmp_path, direct):
+    fake, rows = fake_vcenter
+    before = nic_portgroups(fake)
+    journal = str(tmp_path / 'run.journal')
+    vc = connect(fake)
+
+    results = vc.convert(rows, direct, journal)
+    assert all(result.ok for result in results)
+    assert all(name == 'pg-0000_isolated' for name, _ in nic_portgroups(fake)['vm-00000'])
+
+    rollback = vc.rollback(journal)
+    assert rollback.ok, rollback.errors
+    assert nic_portgroups(fake) == before
+    vc.inventory.refresh()
+    assert sorted(vc.inventory.portgroup_names('bench-vds')) == ['dummy', 'pg-0000', 'pg-0001', 'pg-0002']
+
+
+def test_resume_finishes_a_failed_run(fake_vcenter, connect, fail_reconfigurations, nic_portgroups, tmp_path):
+    fake, rows = fake_vcenter
+    journal = str(tmp_path / 'run.journal')
+    vc = connect(fake)
+
+    # vm-00001 cannot leave the dummy port group, so pg-0001 stops at its final hop
+    fail_reconfigurations(fake, lambda vm, target: vm == 'vm-00001' and target != 'dummy')
+    results = vc.convert(rows, journal_path=journal)
+    failed = [result for result in results if not result.ok]
+    assert [result.row.source_port_group for result in failed] == ['pg-0001']
+    assert failed[0].step == 'final hop'
+    assert nic_portgroups(fake)['vm-00001'] == [('dummy', True)]
+
+    fail_reconfigurations(fake, lambda vm, target: False)
+    resumed = vc.resume(journal)
+    assert all(result.ok for result in resumed)
+    placement = nic_portgroups(fake)
+    for n, vm in enumerate(sorted(placement)):
+        assert placement[vm] == [(f"pg-{n % 3:04d}_isolated", True)]
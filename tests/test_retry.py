@@ -0,0 +1,81 @@
+# Faults that go away on their own are retried with backoff, the others fail
+# on the first attempt, and throttling slows every worker down.
+import http.client
+
+import pytest
+from pyVmomi import vim, vmodl
+
+from pvlan_migration.retry import (AUTH, CONCURRENT_MODIFICATION, CONNECTION, FATAL, INVALID_STATE, RESOURCE_BUSY,
+                                   THROTTLED, RetryPolicy, Throttle, classify_fault, retry_call)
+
+
+@pytest.mark.parametrize('fault, kind', [
+    (vim.fault.ConcurrentAccess(), CONCURRENT_MODIFICATION),
+    (vim.fault.ResourceInUse(), RESOURCE_BUSY),
+    (vim.fault.TaskInProgress(), RESOURCE_BUSY),
+    (vmodl.fault.HostCommunication(), RESOURCE_BUSY),
+    (vim.fault.InvalidLogin(), AUTH),
+    (vmodl.fault.SecurityError(), AUTH),
+    (vim.fault.InvalidState(), INVALID_STATE),
+    (vmodl.fault.RequestCanceled(msg="The task was canceled by a user."), FATAL),
+    (vmodl.fault.SystemError(msg="Too many outstanding operations"), THROTTLED),
+    (vim.fault.NoPermission(), AUTH),
+    (vim.fault.DuplicateName(), FATAL),
+    (http.client.HTTPException("503 Service Unavailable"), THROTTLED),
+    (http.client.HTTPException("429 Too Many Requests"), THROTTLED),
+    (http.client.RemoteDisconnected("Remote end closed connection without response"), CONNECTION),
+    (ConnectionResetError(), CONNECTION),
+    (KeyError('portgroup'), FATAL),
+])
+def test_classify_fault(fault, kind):
+    assert classify_fault(fault) == kind
+
+
+class Flaky:
+    def __init__(self, *faults):
+        self.faults = list(faults)
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        if self.faults:
+            raise self.faults.pop(0)
+        return 'done'
+
+
+def test_retryable_faults_are_retried():
+    call = Flaky(vim.fault.ConcurrentAccess(), vim.fault.ResourceInUse())
+    assert retry_call(call, RetryPolicy(retries=2, base_delay=0), throttle=None) == 'done'
+    assert call.calls == 3
+
+
+@pytest.mark.parametrize('fault', [vim.fault.InvalidState(), vmodl.fault.RequestCanceled()])
+def test_other_faults_fail_on_the_first_attempt(fault):
+    call = Flaky(fault)
+    with pytest.raises(type(fault)):
+        retry_call(call, RetryPolicy(retries=2, base_delay=0), throttle=None)
+    assert call.calls == 1
+
+
+def test_retries_run_out():
+    call = Flaky(*[vim.fault.ConcurrentAccess()] * 3)
+    with pytest.raises(vim.fault.ConcurrentAccess):
+        retry_call(call, RetryPolicy(retries=1, base_delay=0), throttle=None)
+    assert call.calls == 2
+
+
+def test_throttle_backs_off_and_recovers():
+    throttle = Throttle(base_delay=0.01, max_delay=0.04)
+    call = Flaky(http.client.HTTPException("503 Service Unavailable"))
+    assert retry_call(call, RetryPolicy(retries=1, base_delay=0), throttle=throttle) == 'done'
+    # One throttling fault set the penalty, the success after it halved it
+    assert throttle.penalty == 0.0
+    for _ in range(4):
+        throttle.throttled()
+    assert throttle.penalty == 0.04
+    throttle.succeeded()
+    assert throttle.penalty == 0.02
+    # Cancellations are not throttling and leave the penalty alone
+    with pytest.raises(vmodl.fault.RequestCanceled):
+        retry_call(Flaky(vmodl.fault.RequestCanceled()), RetryPolicy(retries=1, base_delay=0), throttle=throttle)
+    assert throttle.penalty == 0.02
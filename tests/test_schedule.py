@@ -0,0 +1,61 @@
+# VM reconfigurations are spread over the ESXi hosts, never more than
+# max_per_host at once on one host, with the VMs marked critical first.
+from pvlan_migration.benchmark import build_vcenter
+from pvlan_migration.fake import FakeBehaviour, FakeVCenter
+from pvlan_migration.schedule import HostScheduler, HostSlots
+from pvlan_migration.workflow import vlan_portgroup_spec
+
+
+def test_hosts_take_turns_within_their_limit():
+    slots = HostSlots(1)
+    scheduler = HostScheduler(5, hosts=['a', 'a', 'a', 'b', None], slots=slots)
+    assert [scheduler.next(), scheduler.next(), scheduler.next()] == [(0, 'a'), (3, 'b'), (4, None)]
+    # Both hosts are busy, a finishing frees the next job on it
+    scheduler.done('a')
+    assert scheduler.next() == (1, 'a')
+    scheduler.done('b')
+    scheduler.done('a')
+    assert scheduler.next() == (2, 'a')
+    assert scheduler.next() is None
+    assert slots.peak == {'a': 1, 'b': 1, None: 1}
+
+
+def test_lower_priority_numbers_start_first():
+    scheduler = HostScheduler(4, hosts=['a', 'a', 'b', 'b'], priorities=[None, 3, 2, 1])
+    assert [scheduler.next()[0] for _ in range(4)] == [3, 2, 1, 0]
+
+
+def test_jobs_on_unknown_hosts_are_never_held_back():
+    scheduler = HostScheduler(3, slots=HostSlots(1))
+    assert [scheduler.next() for _ in range(3)] == [(0, None), (1, None), (2, None)]
+
+
+def _host_peak(connect, max_per_host):
+    # Six VMs on pg-0000 on a single host, with tasks long enough to overlap
+    fake, _ = build_vcenter(6, 1, hosts=1, behaviour=FakeBehaviour(task_duration=0.05, seed=0))
+    vc = connect(fake, max_per_host=max_per_host)
+    results = vc.migrate_vms('bench-vds', 'pg-0000', 'dummy')
+    assert len(results) == 6 and all(result.ok for result in results)
+    return max(fake.host_peak.values())
+
+
+def test_run_keeps_to_the_host_limit(connect):
+    assert _host_peak(connect, 2) == 2
+    # Without a limit every VM of the host is reconfigured at once
+    assert _host_peak(connect, 0) == 6
+
+
+def test_priority_attribute_orders_the_vms(connect):
+    fake = FakeVCenter(FakeBehaviour(seed=0))
+    host = fake.add_host('esx-00')
+    switch = fake.add_switch('vds')
+    web = fake.add_portgroup(switch, vlan_portgroup_spec('web', 100))
+    fake.add_portgroup(switch, vlan_portgroup_spec('dummy', 4000))
+    field = fake.add_custom_field('migration-priority')
+    for name, priority in (('app', 20), ('db', 1), ('misc', None), ('web', 10)):
+        fake.add_vm(name, [(switch, web)], host=host, attributes={field: priority} if priority is not None else None)
+
+    vc = connect(fake, priority_attribute='migration-priority', max_in_flight=1)
+    started = []
+    vc.migrate_vms('vds', 'web', 'dummy', on_result=lambda result: started.append(result.name))
+    assert started == ['db', 'web', 'app', 'misc']
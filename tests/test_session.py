@@ -0,0 +1,81 @@
+# The pooled stubs share one login, which is renewed once when the session
+# expires, whichever worker notices first.
+import threading
+from types import SimpleNamespace
+
+from pyVmomi import VmomiSupport, vim
+
+from pvlan_migration.session import SessionPool
+
+
+class SessionStub:
+    # Answers every call with its name while its cookie is the current session
+    version = VmomiSupport.newestVersions.GetName('vim')
+
+    def __init__(self, server, cookie):
+        self.server = server
+        self.cookie = cookie
+        self.dropped = False
+
+    def InvokeMethod(self, mo, info, args, outerStub=None):
+        if self.cookie != self.server.session:
+            return 500, vim.fault.NotAuthenticated(msg="The session is not authenticated.")
+        return 200, info.wsdlName
+
+    def DropConnections(self):
+        self.dropped = True
+
+
+class SessionServer:
+    def __init__(self):
+        self.session = None
+        self.logins = []
+        self._lock = threading.Lock()
+
+    def connect(self):
+        with self._lock:
+            self.session = f"session-{len(self.logins)}"
+            login = SimpleNamespace(_stub=SessionStub(self, self.session))
+            self.logins.append(login)
+            return login
+
+
+def _call(pool, name='CurrentTime'):
+    return pool.stub.InvokeMethod(None, SimpleNamespace(wsdlName=name), [])
+
+
+def test_expired_session_is_renewed_once():
+    server = SessionServer()
+    pool = SessionPool(server.connect, size=2, keepalive_interval=0, metrics=None)
+    assert _call(pool) == 'CurrentTime'
+
+    server.session = 'expired'
+    assert _call(pool) == 'CurrentTime'
+    assert pool.stats.relogins == 1
+    assert len(server.logins) == 2
+    # The second login only lends its cookie, its connections are not kept
+    assert server.logins[1]._stub.dropped
+    assert not server.logins[0]._stub.dropped
+
+    # Workers that saw the same expired session do not log in again
+    generation = pool._generation - 1
+    pool.relogin(generation)
+    assert len(server.logins) == 2
+
+    pool.close()
+    assert server.logins[0]._stub.dropped
+
+
+def test_parallel_workers_share_one_relogin():
+    server = SessionServer()
+    pool = SessionPool(server.connect, size=4, keepalive_interval=0, metrics=None)
+    server.session = 'expired'
+    results = []
+    workers = [threading.Thread(target=lambda: results.append(_call(pool))) for _ in range(8)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    assert results == ['CurrentTime'] * 8
+    assert len(server.logins) == 2
+    pool.close()
@@ -0,0 +1,101 @@
+# Plans are checked against the inventory before anything changes: errors
+# stop the run, warnings describe what the run will leave alone.
+import pytest
+from pyVmomi import vim
+
+from pvlan_migration.api import PlanInvalid
+from pvlan_migration.plan import PlanRow
+
+
+def _refs(fake):
+    switch = next(ref for moid, ref in fake._objects.items() if moid.startswith('dvs-'))
+    portgroups = {fake._props[moid]['name']: ref for moid, ref in fake._objects.items()
+                  if moid.startswith('dvportgroup-')}
+    return switch, portgroups
+
+
+def _backings(fake, vm):
+    # (device key, port group name or network description) of every NIC
+    backings = []
+    for device in fake._props[vm._moId]['config.hardware.device']:
+        port = getattr(device.backing, 'port', None)
+        if port is not None:
+            backings.append((device.key, fake._props[port.portgroupKey]['name']))
+        elif isinstance(device.backing, vim.vm.device.VirtualEthernetCard.OpaqueNetworkBackingInfo):
+            backings.append((device.key, device.backing.opaqueNetworkId))
+        else:
+            backings.append((device.key, device.backing.deviceName))
+    return backings
+
+
+def _row(line=1, **columns):
+    values = dict(vds='bench-vds', source_port_group='pg-0000', dummy_port_group='dummy', target_type='isolated')
+    values.update(columns)
+    return PlanRow(line=line, **values)
+
+
+@pytest.mark.parametrize('direct', [False, True])
+def test_warned_nics_are_the_ones_left_in_place(fake_vcenter, connect, direct):
+    fake, rows = fake_vcenter
+    switch, portgroups = _refs(fake)
+    mixed = fake.add_vm('mixed', [(switch, portgroups['pg-0000']), (None, None), (switch, portgroups['pg-0001'])])
+    with fake._changed:
+        fake._props[mixed._moId]['config.hardware.device'].append(vim.vm.device.VirtualVmxnet3(
+            key=4003, deviceInfo=vim.Description(label='Network adapter 4', summary=''),
+            backing=vim.vm.device.VirtualEthernetCard.OpaqueNetworkBackingInfo(
+                opaqueNetworkId='ls-1', opaqueNetworkType='nsx.LogicalSwitch'),
+            connectable=vim.vm.device.VirtualDevice.ConnectInfo(connected=True, startConnected=True)))
+        fake._touch(mixed._moId)
+    vc = connect(fake)
+
+    report = vc.check_plan(rows[:1], direct)
+    assert report.ok, report.errors
+    assert len(report.warnings) == 2
+    assert 'standard switch' in report.warnings[0] and 'mixed' in report.warnings[0]
+    assert 'neither on a standard nor a distributed' in report.warnings[1] and 'mixed' in report.warnings[1]
+
+    results = vc.convert(rows[:1], direct)
+    assert all(result.ok for result in results)
+    # The source NIC moved, the warned ones and the NIC on pg-0001 did not
+    assert _backings(fake, mixed) == [(4000, 'pg-0000_isolated'), (4001, 'VM Network'), (4002, 'pg-0001'),
+                                      (4003, 'ls-1')]
+
+
+def test_all_errors_are_reported_together(fake_vcenter, connect):
+    fake, _ = fake_vcenter
+    vc = connect(fake)
+    rows = [
+        _row(1, promiscuous_vlan=5000),
+        _row(2, source_port_group='pg-0001', dummy_port_group='pg-0001'),
+        _row(3, source_port_group='missing'),
+        _row(4, vds='other-vds'),
+        _row(5, source_port_group='pg-0002', target_type='community'),
+    ]
+    report = vc.check_plan(rows)
+    assert not report.ok
+    # The isolated VLAN defaults to the promiscuous VLAN plus one
+    assert report.errors == [
+        "Row 1 (bench-vds/pg-0000): promiscuous_vlan 5000 is outside 1-4094",
+        "Row 1 (bench-vds/pg-0000): isolated_vlan 5001 is outside 1-4094",
+        "Row 2 (bench-vds/pg-0001): dummy port group must differ from the source port group",
+        "Row 3 (bench-vds/missing): port group missing not found",
+        "Row 4 (other-vds/pg-0000): Distributed Virtual Switch other-vds not found",
+        "Row 5 (bench-vds/pg-0002): target_type must be promiscuous/p or isolated/i",
+    ]
+    with pytest.raises(PlanInvalid):
+        vc.convert(rows)
+
+
+def test_rows_clashing_with_each_other(fake_vcenter, connect):
+    fake, _ = fake_vcenter
+    vc = connect(fake)
+    # pg-0001 reuses the primary VLAN of pg-0000 and both rows create the same names
+    rows = [_row(1, base_name='shared'), _row(2, source_port_group='pg-0001', base_name='shared', promiscuous_vlan=100,
+                                              isolated_vlan=102)]
+    report = vc.check_plan(rows)
+    assert report.errors == [
+        "Row 2 (bench-vds/pg-0001): port group shared_promiscuous is also created by row 1",
+        "Row 2 (bench-vds/pg-0001): port group shared_isolated is also created by row 1",
+        "Row 2 (bench-vds/pg-0001): primary VLAN 100 gets isolated secondary 102 here but 101 in row 1, "
+        "a primary can have only one",
+    ]
@@ -0,0 +1,60 @@
+# Canary waves stop a move once too many of the VMs moved so far lose their
+# connection, before the rest of the port group is touched.
+import pytest
+
+from pvlan_migration.waves import ROLLBACK, WaveHalted, WavePolicy
+
+
+def test_wave_sizes_grow_from_the_canary():
+    assert WavePolicy().sizes(100) == [1, 5, 25, 69]
+    assert WavePolicy(canary=3, growth=2).sizes(10) == [3, 6, 1]
+    assert WavePolicy().sizes(0) == []
+
+
+def test_lost_links_halt_the_move_after_the_canary(fake_vcenter, connect, nic_portgroups):
+    fake, _ = fake_vcenter
+    fake.behaviour.link_loss_rate = 1.0
+    vc = connect(fake)
+
+    with pytest.raises(WaveHalted) as halted:
+        vc.migrate_vms('bench-vds', 'pg-0000', 'dummy', waves=WavePolicy())
+    rollout = halted.value.rollout
+    assert rollout.halted
+    assert [wave.size for wave in rollout.waves] == [1]
+    assert rollout.failed == [('vm-00000', "Network adapter 1 lost its connection")]
+    assert rollout.skipped == 3
+    placement = nic_portgroups(fake)
+    assert placement['vm-00000'] == [('dummy', False)]
+    assert placement['vm-00003'] == [('pg-0000', True)]
+
+
+@pytest.mark.parametrize('on_failure, canary_on', [('halt', 'dummy'), (ROLLBACK, 'pg-0000')])
+def test_halted_plan_row_keeps_its_source_port_group(fake_vcenter, connect, nic_portgroups, tmp_path, on_failure,
+                                                     canary_on):
+    fake, rows = fake_vcenter
+    fake.behaviour.link_loss_rate = 1.0
+    vc = connect(fake, waves=WavePolicy(on_failure=on_failure))
+
+    result, = vc.convert(rows[:1], journal_path=str(tmp_path / 'run.journal'))
+    assert not result.ok
+    assert result.step == 'dummy hop'
+    assert result.error.startswith("Stopped after wave 1: 1 of 1 VM(s) failed, 3 VM(s) not started")
+    assert ("1 of 1 moved VM(s) put back" in result.error) == (on_failure == ROLLBACK)
+    vc.inventory.refresh()
+    assert 'pg-0000' in vc.inventory.portgroup_names('bench-vds')
+    assert nic_portgroups(fake)['vm-00000'][0][0] == canary_on
+
+
+def test_waves_without_failures_move_every_vm(fake_vcenter, connect, nic_portgroups):
+    fake, _ = fake_vcenter
+    moving = [vm for vm, nics in nic_portgroups(fake).items() if nics[0][0] == 'pg-0000']
+    vc = connect(fake)
+    waves = []
+
+    results = vc.migrate_vms('bench-vds', 'pg-0000', 'dummy', waves=WavePolicy(canary=1, growth=2),
+                             on_wave=lambda wave, rollout: waves.append((wave.size, len(wave.failed))))
+    assert waves == [(1, 0), (2, 0), (1, 0)]
+    assert [result.index for result in results] == [0, 1, 2, 3]
+    assert all(result.ok for result in results)
+    placement = nic_portgroups(fake)
+    assert [placement[vm] for vm in moving] == [[('dummy', True)]] * 4
@@ -0,0 +1,89 @@
+# Only the distributed switch NICs on the port group being converted move,
+# whatever else the VM is connected to.
+import pytest
+from pyVmomi import vim
+
+from pvlan_migration.cache import InventoryCache
+from pvlan_migration.inventory import VmInfo
+from pvlan_migration.plan import PlanError
+from pvlan_migration.workflow import migration_specs, nic_device_changes
+
+SWITCH_UUID = '50 00 00 00 00 00 00 01'
+
+
+def _nic(key, backing):
+    return vim.vm.device.VirtualVmxnet3(
+        key=key, backing=backing, deviceInfo=vim.Description(label=f"Network adapter {key - 3999}", summary=''),
+        connectable=vim.vm.device.VirtualDevice.ConnectInfo(connected=True, startConnected=True))
+
+
+def _distributed(portgroup_key):
+    return vim.vm.device.VirtualEthernetCard.DistributedVirtualPortBackingInfo(
+        port=vim.dvs.PortConnection(switchUuid=SWITCH_UUID, portgroupKey=portgroup_key))
+
+
+def _opaque():
+    return vim.vm.device.VirtualEthernetCard.OpaqueNetworkBackingInfo(opaqueNetworkId='ls-1',
+                                                                      opaqueNetworkType='nsx.LogicalSwitch')
+
+
+def mixed_vm():
+    # Source port group, another port group, a standard switch and an NSX segment
+    return VmInfo(vim.VirtualMachine('vm-1'), 'mixed', [
+        _nic(4000, _distributed('dvportgroup-source')),
+        _nic(4001, _distributed('dvportgroup-other')),
+        _nic(4002, vim.vm.device.VirtualEthernetCard.NetworkBackingInfo(deviceName='VM Network')),
+        _nic(4003, _opaque()),
+    ])
+
+
+def test_only_nics_on_the_source_port_group_move():
+    vm = mixed_vm()
+    changes = nic_device_changes(vm, SWITCH_UUID, 'dvportgroup-source', 'dvportgroup-target')
+    assert [change.device.key for change in changes] == [4000]
+    assert changes[0].device.backing.port.portgroupKey == 'dvportgroup-target'
+    # The snapshot still describes the VM as it is
+    assert vm.nics[0].portgroup_key == 'dvportgroup-source'
+
+
+def test_only_limits_the_move_to_device_keys():
+    vm = mixed_vm()
+    assert nic_device_changes(vm, SWITCH_UUID, 'dvportgroup-source', 'dvportgroup-target', only={4001}) == []
+
+
+def test_vms_listed_on_the_port_group_keep_their_other_nics(fake_vcenter):
+    fake, _ = fake_vcenter
+    switch = next(ref for moid, ref in fake._objects.items() if moid.startswith('dvs-'))
+    portgroups = {fake._props[moid]['name']: ref for moid, ref in fake._objects.items()
+                  if moid.startswith('dvportgroup-')}
+    vm = fake.add_vm('mixed', [(switch, portgroups['pg-0000']), (switch, portgroups['pg-0001']), (None, None)])
+    with fake._changed:
+        fake._props[vm._moId]['config.hardware.device'].append(_nic(4003, _opaque()))
+        fake._touch(vm._moId)
+    inventory = InventoryCache(fake.content)
+    try:
+        for is_initial_migration in (True, False):
+            specs = {name: spec for name, _, spec in migration_specs(inventory, 'bench-vds', 'pg-0000', 'dummy',
+                                                                     is_initial_migration)}
+            assert [change.device.key for change in specs['mixed'].deviceChange] == [4000]
+    finally:
+        inventory.close()
+
+
+def test_migrate_vms_moves_the_selected_vms(fake_vcenter, connect, nic_portgroups):
+    fake, _ = fake_vcenter
+    vc = connect(fake)
+    results = vc.migrate_vms('bench-vds', 'pg-0000', 'dummy', select=lambda vm: vm.name != 'vm-00003')
+    assert sorted(result.name for result in results) == ['vm-00000', 'vm-00006', 'vm-00009']
+    placement = nic_portgroups(fake)
+    assert placement['vm-00000'] == [('dummy', True)]
+    assert placement['vm-00003'] == [('pg-0000', True)]
+
+
+def test_migrate_vms_names_what_is_missing(fake_vcenter, connect):
+    fake, _ = fake_vcenter
+    vc = connect(fake)
+    with pytest.raises(PlanError, match="Distributed Virtual Switch other-vds not found"):
+        vc.migrate_vms('other-vds', 'pg-0000', 'dummy')
+    with pytest.raises(PlanError, match="Port group pg-0000 or missing not found on bench-vds"):
+        vc.migrate_vms('bench-vds', 'pg-0000', 'missing')